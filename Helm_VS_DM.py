@@ -3,17 +3,21 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import ROOT
+import spectrum_store as ss
 import old.limit_comparison.translate_couplings as tc
 
 fig = plt.figure(figsize=(6,4))
 ax = fig.add_subplot(111)
 
 #helm = np.loadtxt("recoil_spectrum_tables/Xe131/Xe131_NR_HelmFF_c1p=c1n.dat").T
-dens = np.loadtxt("recoil_spectrum_tables/Xe131/Xe131_NR_c1p=c1n.dat").T
+masses = np.array([3,4,5,6,7,8,9,10,11,12,14,16,18,20,22,24,26,28,30,35,40,45,50,60,70,80,100,200,300,500,700,800,1000,2000])
+
+spectra = ss.open_spectra("recoil_spectrum_tables","recoil_spectrum_tables/Xe131_NR_spectra.bin",[131],masses,
+                          operators=[1],combs=["p=n"],pattern="Xe{iso}/Xe{iso}_NR_{label}.dat")
+dens = spectra.table(131,1,"p=n").T
 
 print dens.shape
 
-masses = np.array([3,4,5,6,7,8,9,10,11,12,14,16,18,20,22,24,26,28,30,35,40,45,50,60,70,80,100,200,300,500,700,800,1000,2000])
 #masses = np.array([5,10,50])
 col = np.where(masses==10)[0][0] + 1 # column of the mass we want to extract
 print col
@@ -0,0 +1,69 @@
+""" Detection efficiency / acceptance curves in recoil energy
+
+    An Efficiency is a tabulated curve eff(E) (e.g. the combined acceptance
+    of a set of analysis cuts), linearly interpolated between its points.
+    It multiplies whole arrays of spectra (..., energy) in one broadcast
+    operation; SpectrumArchive caches the resulting spectra and their
+    cumulative-rate indices per curve, so window counts for many cut sets
+    are each computed once.
+
+    Curves are identified by their contents (see Efficiency.key), so two
+    curves with the same points share cached results.
+"""
+
+import numpy as np
+
+class Efficiency(object):
+
+   def __init__(self,energies=None,values=1.,left=0.,right=0.,name=None):
+      # energies, values: tabulated efficiency vs recoil energy in keV (energies increasing);
+      #                   if energies is None, 'values' is a constant efficiency
+      # left, right: efficiency below/above the tabulated range
+      # name: label for plots and printouts
+      if energies is None:
+         self.energies = None
+         self.values   = float(values)
+      else:
+         self.energies = np.asarray(energies,dtype=float)
+         self.values   = np.asarray(values,dtype=float)
+         if self.energies.shape!=self.values.shape or self.energies.ndim!=1:
+            raise ValueError("Efficiency needs matching 1D arrays of energies and values (got {0} and {1})".format(self.energies.shape,self.values.shape))
+         if np.any(np.diff(self.energies)<=0):
+            raise ValueError("Efficiency curve energies must be strictly increasing!")
+      if np.any(np.asarray(self.values)<0) or np.any(np.asarray(self.values)>1):
+         raise ValueError("Efficiency values must lie between 0 and 1!")
+      self.left, self.right = float(left), float(right)
+      self.name = name
+
+   @classmethod
+   def load(cls,fname,delimiter=None,**kwargs):
+      # Curve from a two-column text file (energy in keV, efficiency)
+      E, eff = np.loadtxt(fname,delimiter=delimiter,usecols=(0,1)).T
+      kwargs.setdefault("name",fname)
+      return cls(E,eff,**kwargs)
+
+   @property
+   def key(self):
+      # Hashable identifier of the curve (used to cache efficiency-weighted spectra)
+      if self.energies is None:
+         return (self.values,)
+      return (tuple(self.energies),tuple(self.values),self.left,self.right)
+
+   def __call__(self,E):
+      # Efficiency at recoil energies E (any shape)
+      E = np.asarray(E,dtype=float)
+      if self.energies is None:
+         return self.values*np.ones(E.shape)
+      return np.interp(E,self.energies,self.values,left=self.left,right=self.right)
+
+   def apply(self,energies,rates):
+      # Efficiency-weighted dR/dE for any (..., nE) array of spectra tabulated on 'energies'
+      return np.asarray(rates,dtype=float)*self(energies)
+
+def flat(value,name=None):
+   # Energy-independent efficiency
+   return Efficiency(values=value,name=name)
+
+# Acceptance applied to the published coupling tables (create_coupling_table.py), and by default
+# to the couplings served by rate_service.py, so that both give the same answers
+default = flat(0.5,name="flat 50%")
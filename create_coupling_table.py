@@ -2,7 +2,14 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import numpy as np
 import normalise_spectra as ns
-from scipy.interpolate import interp1d
+import spectrum_store as ss
+import poisson_limits as pl
+import toy_limits as tl
+from limit_curves import LimitCurves
+from curve_registry import CurveRegistry
+from resolution import Resolution
+from acceptance import Efficiency, flat
+import acceptance
 
 pathtodat = "EFTcoeffplotdata/"
 
@@ -16,14 +23,37 @@ colors = ["blue","k","darkred","limegreen","m","darkblue","goldenrod","gray","or
 isotopes = [128,129,130,131,132,134,136]
 
 # Exposure to use for normalisation
-exposure = 225*34 * 0.5  # 50% exposure to roughly account for cuts/acceptance
+exposure = 225*34
 #exposure = 85*118   # LUX
 
+# Natural xenon, combined on the fly from the per-isotope spectra
+# (use e.g. spectra.add_mix(iso,{...}) with custom abundances for an enriched/depleted target)
 iso = "Comb"
 
+# Detector energy resolution applied to all spectra before counting events in the windows
+# (None for sharp windows in true recoil energy), e.g. Resolution(b=0.5) for sigma = 0.5 sqrt(E/keV) keV
+resolution = None
+
+# Detection efficiency vs (observed) recoil energy, applied to all spectra. The default flat 50%
+# (shared with rate_service.py) roughly accounts for cuts/acceptance; use e.g.
+# Efficiency.load("acceptance.dat") for a tabulated curve
+efficiency = acceptance.default
+
 # Assumed number of events observed
 Nevents = 5
 
+# Alternatively, set limits from observed counts over a known background in each window
+# (Feldman-Cousins upper limits; see poisson_limits.py). Nobs=None uses Nevents directly.
+Nobs = None               # e.g. [0,1,3]
+background = [0.,0.,0.]   # expected background events per window
+CL = 0.9
+
+# Toy Monte Carlo bands (median, 1 and 2 sigma) on the expected limits given the background,
+# accumulated in pathtodat (reruns resume from there); 0 to skip. Toys run in chunks of toychunk,
+# so ntoys must be at most toychunk or a multiple of it
+ntoys = 0
+toychunk = 1000
+
 # Basic wiki table structure:
 # {|
 # |-
@@ -73,40 +103,55 @@ def format_table(table,colwidth,extracols):
     #newtable += ["{0:{1}}".format("",3)+" | " + " | ".join("{0:{1}d}".format(x,9) for x in masses) + " |"]
     return newtable
 
-table = []
-for O in operators:
-   rowa = []
-   rowb = []
-   rowc = []
-   for m in masses:
-      print "Extracting: ",iso, O, "mWIMP=",m
-      data = np.loadtxt("{0}/Xe{1}/Xe{1}_{2}.dat".format(pathtodat,iso,O))
-      print "Normalising spectrum for Xe iso={0}, operator={1}, mWIMP={2}".format(iso,O,m)
-      index = np.where(allmasses==m)[0][0]+1 #first column is ER
-      print index
-      spectrum = data[:,[0,index]] 
-      scaled_spectrum, c1a = ns.normalise_spectrum(spectrum,exposure,normrate=Nevents,normrange=(8,30),verbose=True)
-      scaled_spectrum, c1b = ns.normalise_spectrum(spectrum,exposure,normrate=Nevents,normrange=(8,240),verbose=True)
-      scaled_spectrum, c1c = ns.normalise_spectrum(spectrum,exposure,normrate=Nevents,normrange=(8,1000),verbose=True)
-      c1a2 = c1a**2
-      c1b2 = c1b**2
-      c1c2 = c1c**2
-
-      # Sanity check:
-      # should have c1a2 > c1b2 > c1c2
-      if (c1c2 > c1b2) or (c1c2 > c1a2):
-         raise ValueError("Relative coupling sizes make no sense! Should have c1a^2 > c1b^2 > c1c^2, but have instead {0},{1},{2}".format(c1a2,c1b2,c1c2))
-
-      if c1a**2>2*c1b**2: c1b2 = -c1b**2
-      if c1b**2>1.2*c1c**2: c1c2 = -c1c**2
-      rowa+=[c1a2]
-      rowb+=[c1b2]
-      rowc+=[c1c2]
-   table += [rowa]
-   table += [rowb]
-   table += [rowc]
-
-table = np.array(table)
+# Pack the text spectrum tables into a memory-mapped archive the first time round
+spectra = ss.open_spectra(pathtodat,ss.archive_name(pathtodat,isotopes,allmasses),isotopes,allmasses)
+spectra.add_mix(iso)
+
+# Couplings for every operator, mass and energy window in one pass
+print "Normalising spectra for Xe iso={0}, operators={1}, mWIMP={2}".format(iso,operators,masses)
+windows = [(8,30),(8,240),(8,1000)]
+mindex = [spectra.mass_index(m) for m in masses]
+# (operator, mass, window) events for the archive exposure, from the cumulative-rate indices the
+# archive keeps per resolution model and efficiency curve
+counts = np.array([spectra.index(iso,Onum,"p=n",resolution,efficiency).window_counts(windows)[mindex] for Onum in range(1,len(operators)+1)])
+if Nobs is None:
+   normrates = Nevents*np.ones(len(windows))
+else:
+   normrates = pl.upper_limits(Nobs,background,CL)
+   print "{0}% CL signal upper limits per window: {1}".format(100*CL,normrates)
+c2unit = ns.couplings_from_counts(counts,exposure,normrate=1)**2
+c2 = c2unit * normrates
+c1a2, c1b2, c1c2 = c2[...,0], c2[...,1], c2[...,2]
+
+if ntoys > 0:
+   # expected events at unit coupling in each (operator, mass, window) cell
+   with np.errstate(divide="ignore"):
+      unitcounts = 1/c2unit
+   if ntoys > toychunk and ntoys % toychunk!=0:
+      raise ValueError("ntoys={0} is not a multiple of the toy chunk size {1}!".format(ntoys,toychunk))
+   acc = tl.run("{0}/toys.npz".format(pathtodat),unitcounts,np.asarray(background),nchunks=-(-ntoys//toychunk),ntoys=min(ntoys,toychunk))
+   bands = tl.bands(acc,unitcounts,np.asarray(background),CL)**2 # (sigma, operator, mass, window), in c^2
+   np.savez("{0}/limit_bands.npz".format(pathtodat),sigmas=tl.sigmas,masses=masses,windows=windows,bands=bands)
+   print "saved expected-limit bands to {0}/limit_bands.npz".format(pathtodat)
+
+# Sanity check:
+# should have c1a2 > c1b2 > c1c2
+bad = (c1c2 > c1b2) | (c1c2 > c1a2)
+if np.any(bad):
+   i, j = np.argwhere(bad)[0]
+   raise ValueError("Relative coupling sizes make no sense for {0}, mWIMP={1}! Should have c1a^2 > c1b^2 > c1c^2, but have instead {2},{3},{4}".format(operators[i],masses[j],c1a2[i,j],c1b2[i,j],c1c2[i,j]))
+
+# Flag (with negative sign) entries where the wider window makes a big difference
+c1b2 = np.where(c1a2>2*c1b2, -c1b2, c1b2)
+c1c2 = np.where(np.abs(c1b2)>1.2*c1c2, -c1c2, c1c2)
+
+# Rows ordered as (O1 8-30, O1 8-240, O1 8-1000, O2 8-30, ...)
+table = np.stack((c1a2,c1b2,c1c2),axis=1).reshape(-1,len(masses))
+
+# Log-log splines through the limits for every operator and window, evaluated once on a fine mass grid
+# (curves.fine[Onum-1,w] is the curve for operator Onum in window w)
+curves = LimitCurves(masses,table.reshape(len(operators),len(windows),len(masses)))
+finemasses = curves.finemasses
 
 # Limits from CDMS paper (arxiv:)
 lims = {}
@@ -141,11 +186,7 @@ for k,plot in enumerate(plotOs):
    ax = fig.add_subplot(111)
    for Onum in plot:
 
-      finemasses = np.exp(np.arange(np.log(masses[0]),np.log(masses[-1]),np.log(1.01)))
-      kind = "cubic"
-      f1 = interp1d(np.log(masses), np.log(np.abs(table[(Onum-1)*3])),   kind=kind, bounds_error=False)
-      f2 = interp1d(np.log(masses), np.log(np.abs(table[(Onum-1)*3+1])), kind=kind, bounds_error=False)
-      f3 = interp1d(np.log(masses), np.log(np.abs(table[(Onum-1)*3+2])), kind=kind, bounds_error=False)
+      f1, f2, f3 = curves.fine[Onum-1]
  
       ax.set_xlabel(r"$\mathrm{WIMP\,mass\,[GeV]}$")
       ax.set_ylabel(r"$c^2 * (m^4_\mathrm{weak})$")
@@ -159,9 +200,9 @@ for k,plot in enumerate(plotOs):
       #row = np.abs(table[(Onum-1)*3])
       #ax.plot(masses, row, c=colors[Onum-1])
 
-      ax.plot(finemasses, np.exp(f1(np.log(finemasses))), label="$O_{{{0}}}$".format(Onum),  c=colors[Onum-1], lw=1.5 )
-      ax.plot(finemasses, np.exp(f2(np.log(finemasses))), c=colors[Onum-1], ls="dashed")
-      ax.plot(finemasses, np.exp(f3(np.log(finemasses))), c=colors[Onum-1], ls="dotted")
+      ax.plot(finemasses, f1, label="$O_{{{0}}}$".format(Onum),  c=colors[Onum-1], lw=1.5 )
+      ax.plot(finemasses, f2, c=colors[Onum-1], ls="dashed")
+      ax.plot(finemasses, f3, c=colors[Onum-1], ls="dotted")
        
       #ax.text(0.7*masses[0],table[(Onum-1)*3][0],"O{0}".format(Onum))
 
@@ -177,21 +218,16 @@ for k,plot in enumerate(plotOs):
 
 # Compare to CDMS:
 Ops = [(3,"O3","O_3"),(8,"O8","O_8")]
+external = CurveRegistry(pathtodat)
 #Ops = [(8,"O8","O_8")]
 
 for Onum,Oname,Olatexname in Ops:
+   # Digitized curves, sorted in increasing x value (parsed once and cached by the registry)
    datafile_basenames = ["CDMSIIGe", "CDMSIISi", "LUX", "SuperCDMS_Soudan"]
-   datafiles = ["{0}_{1}.dat".format(base,Oname) for base in datafile_basenames]
-   curvedata = [np.loadtxt("{0}/{1}".format(pathtodat,fname)) for fname in datafiles]
-      
-   # Sort the curve data in increasing x value
-   CDMSIIGe, CDMSIISi, LUX, SuperCDMS_Soudan = [c[c[:,0].argsort()] for c in curvedata]
-
-   finemasses = np.exp(np.arange(np.log(masses[0]),np.log(masses[-1]),np.log(1.01)))
-   kind = "cubic"
-   f1 = interp1d(np.log(masses), np.log(np.abs(table[(Onum-1)*3])),   kind=kind, bounds_error=False)
-   f2 = interp1d(np.log(masses), np.log(np.abs(table[(Onum-1)*3+1])), kind=kind, bounds_error=False)
-   f3 = interp1d(np.log(masses), np.log(np.abs(table[(Onum-1)*3+2])), kind=kind, bounds_error=False)
+   CDMSIIGe, CDMSIISi, LUX, SuperCDMS_Soudan = [np.array(external.get("{0}_{1}".format(base,Oname))).T
+                                                for base in datafile_basenames]
+
+   f1, f2, f3 = curves.fine[Onum-1]
  
    fig = plt.figure(figsize=(6,4))
    ax = fig.add_subplot(111)
@@ -199,9 +235,9 @@ for Onum,Oname,Olatexname in Ops:
    ax.plot(*CDMSIISi.T, label="CDMSII Si 90% CL", c="grey")
    ax.plot(*SuperCDMS_Soudan.T, label="SuperCDMS Soudan 90% CL", c="m")
    ax.plot(*LUX.T,      label="LUX 90% CL (est. by CDMS)", c="b")
-   ax.plot(finemasses, np.exp(f1(np.log(finemasses))), label="Xenon100 N={0} in 8-30 keV".format(Nevents),  c="r", lw=2 )
-   ax.plot(finemasses, np.exp(f2(np.log(finemasses))), label="Xenon100 N={0} in 8-240 keV".format(Nevents), c="r", ls="dashed")
-   ax.plot(finemasses, np.exp(f3(np.log(finemasses))), label="Xenon100 N={0} in 8-1000 keV".format(Nevents), c="r", ls="dotted")
+   ax.plot(finemasses, f1, label="Xenon100 N={0} in 8-30 keV".format(Nevents),  c="r", lw=2 )
+   ax.plot(finemasses, f2, label="Xenon100 N={0} in 8-240 keV".format(Nevents), c="r", ls="dashed")
+   ax.plot(finemasses, f3, label="Xenon100 N={0} in 8-1000 keV".format(Nevents), c="r", ls="dotted")
    ax.set_xlabel(r"$\mathrm{WIMP\,mass\,[GeV]}$")
    ax.set_ylabel(r"$c^2 * (m^4_\mathrm{weak})$")
    ax.set_xscale("log")
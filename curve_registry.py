@@ -0,0 +1,140 @@
+""" Registry of digitized external limit curves
+
+    Every curve we compare against (Goodman et. al. Tevatron limits on M*,
+    XENON100 225 live day SI/SD limits, CDMS/LUX limits on O3 and O8) is
+    listed once in 'curves' below, with the file it was digitized into and
+    how that file is to be read. A CurveRegistry for a data directory parses
+    each file once, sorts it in increasing mass, applies the standard
+    log-spaced resampling, and keeps the results in a single compact cache
+    file in that directory (curve_cache.npz): one concatenated array of
+    points plus an index of offsets per curve. Later runs load the cache
+    instead of re-parsing and re-smoothing; a curve is re-ingested whenever
+    its source file or its entry in 'curves' changes.
+
+    The resampling (for the Tevatron curves) is the one used in the goodman
+    scripts: num=50 log-spaced masses from 1 GeV up to the largest digitized
+    mass, linearly interpolated, i.e. constant extrapolation at the low end.
+"""
+
+import os
+import numpy as np
+
+CACHE = "curve_cache.npz"
+
+def _spec(fname,delimiter=",",log10=False,smooth=False):
+   # fname: file name relative to the data directory
+   # delimiter: column delimiter (None for whitespace)
+   # log10: second column holds log10 of the limit
+   # smooth: apply the log-spaced resampling
+   return {"fname":fname, "delimiter":delimiter, "log10":log10, "smooth":smooth}
+
+curves = {}
+# Goodman et. al. (2011) limits on M* vs WIMP mass, for pairs of operators with equal limits
+for ops in ["M1+3","M2+4","M5+6","M7+9","M8+10"]:
+   curves[ops] = _spec("{0}_tevatron.csv".format(ops),smooth=True)
+# XENON100 225 live days: SI (1207.5988) and SD (1301.6620) cross-section limits in cm^2
+curves["XENON100_SI"]  = _spec("xenon225livedays.csv",log10=True)
+curves["XENON100_SDn"] = _spec("xenon225livedays_SDn.csv",log10=True)
+curves["XENON100_SDp"] = _spec("xenon225livedays_SDp.csv",log10=True)
+# Coupling limits on O3 and O8 (LUX as estimated by CDMS)
+for base in ["CDMSIIGe","CDMSIISi","LUX","SuperCDMS_Soudan"]:
+   for Oname in ["O3","O8"]:
+      curves["{0}_{1}".format(base,Oname)] = _spec("{0}_{1}.dat".format(base,Oname),delimiter=None)
+
+def smooth(x,y,num=50,xmin=1.):
+   # Log-spaced resampling of a (sorted) curve from xmin up to its largest x
+   xs = np.logspace(np.log10(xmin),np.log10(np.max(x)),num=num)
+   return xs, np.interp(xs,x,y)
+
+def ingest(fname,delimiter=",",log10=False,smooth_curve=False):
+   # Parse one digitized curve; returns sorted (x, y) and (if smooth_curve) the resampled curve
+   x, y = np.loadtxt(fname,delimiter=delimiter,usecols=(0,1)).T
+   order = np.argsort(x,kind="mergesort")
+   x, y = x[order], y[order]
+   if log10:
+      y = 10**y
+   if smooth_curve:
+      return (x,y), smooth(x,y)
+   return (x,y), (x,y)
+
+class CurveRegistry(object):
+
+   def __init__(self,datadir,specs=curves):
+      self.datadir = datadir
+      self.specs   = specs
+      self.cache   = os.path.join(datadir,CACHE)
+      self._curves = {} # name -> (stamp, raw x, raw y, x, y)
+      if os.path.exists(self.cache):
+         d = np.load(self.cache)
+         data, offsets = d["data"], d["offsets"]
+         # caches from before the spec was part of the stamp are never fresh
+         keys = d["keys"] if "keys" in d.files else [""]*len(d["names"])
+         for n,name in enumerate(d["names"]):
+            if isinstance(name,bytes): # cache written by python 2
+               name = name.decode("utf-8")
+            key = keys[n].decode("utf-8") if isinstance(keys[n],bytes) else keys[n]
+            parts = [data[offsets[n,k]:offsets[n,k+1]] for k in range(4)]
+            self._curves[str(name)] = (tuple(d["stamps"][n])+(str(key),),) + tuple(parts)
+
+   def names(self):
+      return sorted(self.specs.keys())
+
+   def available(self):
+      # Registered curves whose source file is present in the data directory
+      return [name for name in self.names() if os.path.exists(os.path.join(self.datadir,self.specs[name]["fname"]))]
+
+   def _stamp(self,name):
+      # (modification time, size) of the source file of a curve, and its spec (so that changing
+      # e.g. log10 or smooth invalidates the cached points)
+      st = os.stat(os.path.join(self.datadir,self.specs[name]["fname"]))
+      return (float(st.st_mtime),float(st.st_size),repr(sorted(self.specs[name].items())))
+
+   def _fresh(self,name):
+      return name in self._curves and self._curves[name][0]==self._stamp(name)
+
+   def _ingest(self,name):
+      spec = self.specs[name]
+      (xr,yr), (x,y) = ingest(os.path.join(self.datadir,spec["fname"]),spec["delimiter"],spec["log10"],spec["smooth"])
+      self._curves[name] = (self._stamp(name),xr,yr,x,y)
+
+   def save(self):
+      # Write all ingested curves to the cache file, as one array of points plus an offset index
+      names = sorted(self._curves.keys())
+      parts = [part for name in names for part in self._curves[name][1:]]
+      sizes = np.array([len(part) for part in parts],dtype=np.int64).reshape(-1,4)
+      offsets = np.concatenate((np.zeros((len(names),1),dtype=np.int64),np.cumsum(sizes,axis=1)),axis=1)
+      offsets += np.concatenate(([0],np.cumsum(sizes.sum(axis=1))[:-1]))[:,None]
+      np.savez(self.cache,names=np.array(names),stamps=np.array([self._curves[n][0][:2] for n in names]).reshape(-1,2),
+               keys=np.array([self._curves[n][0][2] for n in names]),
+               offsets=offsets,data=np.concatenate(parts) if parts else np.zeros(0))
+
+   def ingest_all(self):
+      # (Re-)ingest every registered curve whose source file is present and whose file or spec has changed
+      changed = False
+      for name in self.available():
+         if not self._fresh(name):
+            self._ingest(name)
+            changed = True
+      if changed:
+         self.save()
+
+   def get(self,name,raw=False):
+      # (x, y) arrays for a curve, sorted in x; resampled unless raw=True
+      if name not in self.specs:
+         raise KeyError("Unknown limit curve '{0}'; registered curves are {1}".format(name,self.names()))
+      if not self._fresh(name):
+         self._ingest(name)
+         self.save()
+      c = self._curves[name]
+      return (c[1],c[2]) if raw else (c[3],c[4])
+
+if __name__=="__main__":
+   # Usage: python curve_registry.py <datadir>  (ingest all curves found in datadir into its cache)
+   import sys
+   if len(sys.argv) < 2:
+      print("Usage: python curve_registry.py <datadir>")
+      sys.exit(1)
+   registry = CurveRegistry(sys.argv[1])
+   registry.ingest_all()
+   for name in registry.available():
+      print("{0}: {1} points".format(name,len(registry.get(name)[0])))
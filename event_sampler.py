@@ -0,0 +1,106 @@
+""" Monte Carlo recoil events drawn from tabulated spectra
+
+    An EventSampler inverts the cumulative rate of a whole array of spectra
+    (e.g. the (mass, energy) block of one isotope/operator/isospin
+    combination from SpectrumArchive.index) within an energy window. dR/dE
+    is piecewise linear between grid points, as in rate_index, so the
+    inverse CDF within each grid cell is the root of a quadratic and
+    sampling is exact for the tabulated spectrum.
+
+    All spectra share one flattened, normalised cumulative table (spectrum k
+    occupying the interval [k, k+1]), so a single searchsorted call places
+    any number of events from any mixture of spectra; drawing millions of
+    energies or Poisson-fluctuated pseudo-experiments costs a few vectorised
+    operations and no Python loop over events or spectra.
+
+    Random numbers come from numpy RandomStates; worker_rng gives each
+    worker of a parallel job its own reproducible stream.
+"""
+
+import numpy as np
+
+from normalise_spectra import orig_exposure
+
+def worker_rng(seed,worker=0):
+   # Independent, reproducible random stream for one worker of a job with master seed 'seed'
+   return np.random.RandomState([int(seed) % 2**32,int(worker) % 2**32])
+
+class EventSampler(object):
+
+   def __init__(self,index,window=None):
+      # index: rate_index.CumulativeRate for (..., nE) spectra, e.g. spectra.index(iso,op,comb)
+      # window: (Emin,Emax) range of recoil energies to sample (default the whole grid)
+      self.index = index
+      self.shape = index.rates.shape[:-1]
+      self.window = (index.energies[0],index.energies[-1]) if window is None else (float(window[0]),float(window[1]))
+      nE = len(index.energies)
+      cum = index.cum.reshape(-1,nE)
+      # cumulative rate at the window edges, per spectrum
+      lo = index.integral(self.window[0]).reshape(-1)
+      hi = index.integral(self.window[1]).reshape(-1)
+      self.counts0 = (hi - lo).reshape(self.shape) # events in window, original exposure, unit coupling
+      total = np.where(cum[:,-1]>0,cum[:,-1],1.)
+      k = np.arange(cum.shape[0])
+      self._table = (cum/total[:,None] + k[:,None]).ravel()
+      self._lo, self._hi = lo/total, hi/total
+      self._total = total
+      self._empty = ~(hi > lo)
+
+   def expected(self,exposure,c=1.):
+      # Expected events in the window for an exposure in kg.days and coupling(s) c
+      # (c broadcast against the spectra, shape self.shape)
+      return np.asarray(c,dtype=float)**2 * float(exposure)/orig_exposure * self.counts0
+
+   def energies(self,u,spectrum):
+      # Inverse CDF: recoil energies for uniform deviates u (any shape) from flat spectrum indices
+      # 'spectrum' (same shape). Spectra with no events in the window give NaN.
+      nE = len(self.index.energies)
+      u  = np.asarray(u,dtype=float)
+      k  = np.asarray(spectrum,dtype=int)
+      y  = self._lo[k] + u*(self._hi[k] - self._lo[k]) # normalised cumulative rate of each event
+      j  = np.searchsorted(self._table,k + y,side="right") - 1 - k*nE
+      j  = np.clip(j,0,nE-2)
+      flat = k*nE + j
+      rates = self.index.rates.reshape(-1,nE)
+      r0 = rates.ravel()[flat]
+      r1 = rates.ravel()[flat+1]
+      h  = self.index.widths[j]
+      # solve cum_j + r0 t + (r1-r0) t^2/(2h) = y*total for t in [0,h]
+      D  = np.maximum(y*self._total[k] - self.index.cum.reshape(-1,nE).ravel()[flat],0.)
+      a  = (r1-r0)/(2*h)
+      den = r0 + np.sqrt(np.maximum(r0**2 + 4*a*D,0.))
+      with np.errstate(divide="ignore",invalid="ignore"):
+         t = np.where(den>0,2*D/den,0.)
+      E = self.index.energies[j] + np.clip(t,0.,h)
+      return np.where(self._empty[k],np.nan,E)
+
+   def sample(self,n,rng=None):
+      # n recoil energies from every spectrum; shape self.shape + (n,)
+      rng = np.random if rng is None else rng
+      nspec = len(self._total)
+      k = np.repeat(np.arange(nspec),n)
+      return self.energies(rng.uniform(size=nspec*n),k).reshape(self.shape+(n,))
+
+   def toys(self,ntoys,exposure,c=1.,rng=None):
+      # Poisson-fluctuated pseudo-experiments for every spectrum.
+      # Returns counts, shape (ntoys,) + self.shape, and the energies of all events as one flat
+      # array, ordered by toy and then spectrum (C order of counts), i.e. the events of cell
+      # counts.flat[i] are energies[offsets[i]:offsets[i+1]] with offsets from toy_offsets.
+      rng = np.random if rng is None else rng
+      mu = np.broadcast_to(self.expected(exposure,c),self.shape)
+      counts = rng.poisson(np.broadcast_to(mu,(ntoys,)+self.shape))
+      nspec = len(self._total)
+      k = np.repeat(np.tile(np.arange(nspec),ntoys),counts.ravel())
+      return counts, self.energies(rng.uniform(size=len(k)),k)
+
+def toy_offsets(counts):
+   # Start/end positions of each pseudo-experiment cell in the flat energies array from toys()
+   return np.concatenate(([0],np.cumsum(np.ravel(counts))))
+
+def sampler(spectra,iso,op,comb="p=n",masses=None,window=None,resolution=None,efficiency=None):
+   # EventSampler for one isotope (or mix)/operator/isospin combination of a SpectrumArchive,
+   # for the given masses (default all), optionally including the detector response
+   index = spectra.index(iso,op,comb,resolution,efficiency)
+   if masses is not None:
+      index = index.row(np.array([spectra.mass_index(m) for m in masses]))
+   return EventSampler(index,window)
@@ -0,0 +1,86 @@
+#!/usr/local/bin/MathKernel -script
+
+(* Export the NR interference matrix of one Xenon isotope from DMFormFactor, for response_tables.py *)
+(* dR/dE = c^T M c, with c = (c1p, c1n, ..., c15p, c15n); each non-zero entry M_ij = (1/2) d^2(dR/dE)/dc_i dc_j
+   is written as a table of ER (keV) and one column per WIMP mass, in events/keV for 7800 kg.days, using
+   the same parameters as recoil_generator.m. response_tables.py fits the nuclear responses W_X^{tau tau'}(q)
+   to these tables and writes them as nuclear_responses/Xe<A>.npz for recoil_rates.py *)
+
+(*Args:*)
+(*1 - Absolute path to the DMFormFactor directory (containing "v6/dmformfactor-V6.m")*)
+(*2 - Relative output path*)
+(*3 - Xenon isotope (e.g. "131")*)
+
+messageHandler = If[Last[#], Print["An error has occurred in 'export_responses.m'; aborting evaluation..."] Exit[1];]&
+Internal`AddHandler["Message", messageHandler]
+Off[Simplify::time]
+
+args = Join[$CommandLine[[4;;]],Table[{},{i,1,10}]];
+outpath = Directory[]<>"/"<>args[[2]];
+If[!DirectoryQ[outpath],
+  Print["\nOutput directory "<>outpath<>" does not exist! Please create it and try again.\n"];
+  Exit[1];
+];
+path = args[[1]];
+isotope = ToExpression[args[[3]]];
+Check[
+  Import[path<>"/v6/dmformfactor-V6.m"]
+ ,
+  Print["...Error loading DMFormFactor package. Please check the path (this script requires v6) and try again"];
+  Exit[1];
+]
+validiso = {128,129,130,131,132,134,136};
+If[Count[validiso,isotope]==0,
+  Print["\nRequested Xenon isotope '"<>ToString[isotope]<>"' is invalid! Aborting...\n"];
+  Exit[1];
+];
+
+SetAttributes[DoSilent, HoldAll];
+DoSilent[expr_] := Block[{Print = Null &}, expr];
+
+(* A few masses are enough: the responses depend only on q, and heavy WIMPs reach the whole energy range *)
+m\[Chi]={100,1000,10000};
+Earr=Join[Table[N[ER*10^-6],{ER,0.05,100,0.05}],Table[N[ER*10^-6],{ER,100.5,1000,0.5}]];
+benchmarkExposure = 7800 KilogramDay;
+
+(* Model Setup (as in recoil_generator.m) *)
+SetJChi[1/2]
+SetMChi[MWIMP GeV]
+SetHelm[False];
+SetIsotope[54,isotope,"default","default"]
+ZeroCoeffs[];
+labels=Flatten[Table[{"c"<>ToString[i]<>"p","c"<>ToString[i]<>"n"},{i,1,15}]];
+coefflist=ToExpression/@labels;
+DoSilent[
+  Do[
+    SetCoeffsNonrel[i,coefflist[[2i-1]],"p"];
+    SetCoeffsNonrel[i,coefflist[[2i]],"n"];
+    ,{i,1,15}];
+];
+
+mNucleon=0.938 GeV;
+NT=1/(isotope* mNucleon);
+Centimeter=(10^13 Femtometer);
+rhoDM=0.3GeV/Centimeter^3;
+ve=220 KilometerPerSecond;
+v0=220 KilometerPerSecond;
+vesc=544 KilometerPerSecond;
+SetHALO["MBcutoff"];
+DoSilent[
+  dRdE=EventRate[NT,rhoDM,qGeV,ve,v0,vesc];
+];
+
+mT = isotope*mNucleon;
+generalfunc = benchmarkExposure*dRdE GeV /. qGeV->Sqrt[2*mTv*ER] /. mTv->mT/GeV;
+noGeVfunc = generalfunc // Simplify[#, { MWIMP \[Element] Reals, MWIMP > 0, GeV \[Element] Reals, GeV>0}, TimeConstraint -> 0.01] &;
+
+Export[outpath<>"/Xe"<>ToString[isotope]<>"_masses.dat", Transpose[{m\[Chi]}], "Table"];
+Do[
+  Mij = 1/2 D[noGeVfunc,coefflist[[i]],coefflist[[j]]];
+  If[!AllTrue[Mij/.{MWIMP -> 1000, ER -> Earr},PossibleZeroQ],
+    filename=outpath<>"/Xe"<>ToString[isotope]<>"_M_"<>labels[[i]]<>"_"<>labels[[j]]<>".dat";
+    Print["  Writing file: "<>filename];
+    tmp = Table[10^-6 * Mij /. {MWIMP -> m, ER -> Earr}, {m, m\[Chi]}];
+    Export[filename, Transpose[Join[{SetPrecision[Earr*10^6,8]},tmp]], "Table"];
+  ]
+,{i,1,30},{j,i,30}];
@@ -1,6 +1,7 @@
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import numpy as np
+import spectrum_store as ss
 
 labels = [["c{0}p".format(i),"c{0}n".format(i),"c{0}p=c{0}n".format(i)] for i in range(1,16)]
 
@@ -14,14 +15,18 @@ mlabels = ["{0} GeV".format(m) for m in masses]
 
 iso = "Comb"
 
+pathtodat = "/home/farmer/mathematica/DMFormFactor_13086288/EFTcoeffplotdata/"
+isotopes = [128,129,130,131,132,134,136]
+spectra = ss.open_spectra(pathtodat,ss.archive_name(pathtodat,isotopes,masses),isotopes,masses)
+spectra.add_mix(iso) # natural xenon, combined on the fly
+
 # Loop through operators
 for i,l in enumerate(labels):
    # Loop through p,n,p+n combinations
    for p,lab in enumerate(l):
-      data = np.loadtxt("/home/farmer/mathematica/DMFormFactor_13086288/EFTcoeffplotdata/Xe{0}/Xe{0}_{1}.dat".format(iso,lab))
       for m,mass in enumerate(masses):
          print "mWIMP={0}, {1}".format(mass,lab)
-         spectrum = data[:,[0,m+1]]
+         spectrum = spectra.spectrum(iso,i+1,ss.COMBS[p],mass)
          norm = 1 # should be 1 datapoint per keV
          rate0 = np.sum(spectrum[:,1])/norm
          c0 = 1
@@ -31,3 +36,19 @@ for i,l in enumerate(labels):
          print "  Coupling required for 10  events: c={0}".format( np.sqrt(c0**2 * (10/rate0)) )
          print "  Coupling required for 100 events: c={0}".format( np.sqrt(c0**2 * (100/rate0)) )
 
+
+# Pseudo-experiments at the coupling giving 10 expected events, to see the spread in the
+# number of events and their energies (set ntoys > 0 to run)
+ntoys = 0
+if ntoys > 0:
+   import event_sampler as es
+   rng = es.worker_rng(seed=1)
+   for i,l in enumerate(labels):
+      sampler = es.sampler(spectra,iso,i+1,"p=n",masses)
+      c10 = np.sqrt(10/np.where(sampler.counts0>0,sampler.counts0,np.inf)) # no events if the rate vanishes
+      counts, energies = sampler.toys(ntoys,es.orig_exposure,c10,rng)
+      # mass of each event, to split the energies up by mass
+      m = np.repeat(np.tile(np.arange(len(masses)),ntoys),counts.ravel())
+      print "{0}, {1} toys at c(10 events):".format(l[2],ntoys)
+      for j,mass in enumerate(masses):
+         print "  mWIMP={0}: events {1:.2f} +- {2:.2f}, median ER {3:.1f} keV".format(mass,counts[:,j].mean(),counts[:,j].std(),np.median(energies[m==j]))
@@ -1,6 +1,8 @@
 #!/bin/bash
 
 # Runs recoil_generator.m for several isotopes of Xenon
+# (serially; see spectrum_jobs.py for a parallel version which can resume interrupted runs,
+#  e.g. python spectrum_jobs.py recoil_spectrum_tables --engine mathematica --idm yes --dmff $DMFFdir)
 
 # Location of DMFormFactor package
 DMFFdir="/home/farmer/mathematica/DMFormFactor_13086288"
@@ -16,24 +18,26 @@ for isotope in 128 129 130 131 132 134 136; do
     #echo " Generating recoil spectra for Xe"$isotope"..."
     #echo "**************************************"
     ./recoil_generator.m $DMFFdir $outdir $isotope NR nocheck noHelm IDM 
-    echo $?
-    if ! echo $?; then 
+    status=$?
+    echo $status
+    if [ $status -ne 0 ]; then 
         echo "Error detected, aborting loop."
         break; 
     fi
     #./recoil_generator.m $DMFFdir $outdir $isotope R nocheck noHelm
-    #if ! echo $?; then 
+    #if [ $? -ne 0 ]; then 
     #    echo "Error detected, aborting loop."
     #    break; 
     #fi
     #./recoil_generator.m $DMFFdir $outdir $isotope NR nocheck UseHelm 
-    #echo $?
-    #if ! echo $?; then 
+    #status=$?
+    #echo $status
+    #if [ $status -ne 0 ]; then 
     #    echo "Error detected, aborting loop."
     #    break; 
     #fi
     #./recoil_generator.m $DMFFdir $outdir $isotope R nocheck UseHelm
-    #if ! echo $?; then 
+    #if [ $? -ne 0 ]; then 
     #    echo "Error detected, aborting loop."
     #    break; 
     #fi
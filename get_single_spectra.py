@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import numpy as np
 import normalise_spectra as ns
+import spectrum_store as ss
 
 pathtodat = "/home/farmer/mathematica/DMFormFactor_13086288/EFTcoeffplotdata/"
 
@@ -13,12 +14,20 @@ isotopes = [128,129,130,131,132,134,136]
 # Exposure to use for normalisation
 exposure = 225*34
 
-def get_norm_spectra(iso, lab, mass):
+_archive = []
+def get_archive():
+   # Pack the per-isotope text spectrum tables into a memory-mapped archive the first time round,
+   # and combine them into natural xenon ("Comb") on demand; opened once and reused
+   if not _archive:
+      _archive.append(ss.open_spectra(pathtodat,ss.archive_name(pathtodat,isotopes,masses),isotopes,masses))
+      _archive[0].add_mix("Comb")
+   return _archive[0]
+
+def get_norm_spectra(iso, op, comb, mass):
+   lab = ss.label(op,comb)
    print "Extracting: ",iso, lab, "mWIMP=",mass
-   data = np.loadtxt("{0}/Xe{1}/Xe{1}_{2}.dat".format(pathtodat,iso,lab))
    print "Normalising spectrum for Xe iso={0}, operator={1}, mWIMP={2}".format(iso,lab,mass)
-   index = np.where(masses==mass)[0][0]+1 #first column is ER
-   spectrum = data[:,[0,index]]
+   spectrum = get_archive().spectrum(iso,op,comb,mass)
    scaled_spectrum, c = ns.normalise_spectrum(spectrum,exposure,normrate=5)
 
    # output normalised spectrum to file
@@ -35,10 +44,10 @@ def get_norm_spectra(iso, lab, mass):
    fig.savefig("{0}/Xe{1}_{2}_M={3}GeV_EinkeV_sumdRdE=1.png".format(pathtodat,iso,lab,mass))
 
 iso = "Comb"  #131
-llist = ["c{0}p=c{0}n".format(i) for i in [1,3,8]]
+olist = [1,3,8]
 mlist = [m for m in [50,100,500,1000]]
 
-for l in llist:
+for o in olist:
    for m in mlist:
-      get_norm_spectra(iso, l, m)
+      get_norm_spectra(iso, o, "p=n", m)
 
@@ -5,11 +5,11 @@
 import numpy as np
 import matplotlib.pyplot as plt
 #from scipy.interpolate import interp1d
-from scipy import interp
 
 import old.limit_comparison.translate_couplings as t
 import old.limit_comparison.comparison_tools as tools
 import old.limit_comparison.parameters as p
+from curve_registry import CurveRegistry
 
 output_list = "\nFiles created:\n"
 
@@ -46,17 +46,16 @@ g9G = g7G
 
 #================================
 # Goodman limit curves
-M1_mchi, M1_limit = np.loadtxt("goodman_limits_data/M1+3_tevatron.csv",delimiter=",").T
-M6_mchi, M6_limit = np.loadtxt("goodman_limits_data/M5+6_tevatron.csv",delimiter=",").T
-M7_mchi, M7_limit = np.loadtxt("goodman_limits_data/M7+9_tevatron.csv",delimiter=",").T
+curves = CurveRegistry("goodman_limits_data")
+M1_mchi, M1_limit = curves.get("M1+3",raw=True)
+M6_mchi, M6_limit = curves.get("M5+6",raw=True)
+M7_mchi, M7_limit = curves.get("M7+9",raw=True)
 
 # Do some (constant) extrapolation on the low end, and interpolation in the middle.
-smooth_M1_mchi = np.logspace(0,np.log10(np.max(M1_mchi)),num=50)
-smooth_M6_mchi = np.logspace(0,np.log10(np.max(M6_mchi)),num=50)
-smooth_M7_mchi = np.logspace(0,np.log10(np.max(M7_mchi)),num=50)
-smooth_M1_limit = interp(smooth_M1_mchi, M1_mchi, M1_limit)
-smooth_M6_limit = interp(smooth_M6_mchi, M6_mchi, M6_limit)
-smooth_M7_limit = interp(smooth_M7_mchi, M7_mchi, M7_limit)
+# (done once by the registry, and cached)
+smooth_M1_mchi, smooth_M1_limit = curves.get("M1+3")
+smooth_M6_mchi, smooth_M6_limit = curves.get("M5+6")
+smooth_M7_mchi, smooth_M7_limit = curves.get("M7+9")
 
 # Visually check limit digitization and interpolation
 fig = plt.figure()
@@ -194,8 +193,7 @@ g10n_M9G = t.calc_cN_pseudoscalar(0,0,0,0,0,0,g9G_limit,p.data_n)
 #=========================================
 
 # Get SI XENON100 225 live day limits (1207.5988)
-mX225, sigmaSI_X225 = np.loadtxt("goodman_limits_data/xenon225livedays.csv",delimiter=",").T
-sigmaSI_X225 = 10**sigmaSI_X225 # data in file is in log10 units
+mX225, sigmaSI_X225 = curves.get("XENON100_SI") # (data in file is in log10 units; converted by the registry)
 
 # Compare to SI XENON100 estimated limits via EFT:
 c1_lim_XENON100 = tools.get_c_curve("c1p=c1n") # SI operator, equal proton/neutron couplings
@@ -280,10 +278,8 @@ output_list += fname+"\n"
 #-- Now the SD plots ---
 
 # Get SD XENON100 225 live day limits (1301.6620)
-mX225_SDn, sigmaSDn_X225 = np.loadtxt("goodman_limits_data/xenon225livedays_SDn.csv",delimiter=",").T
-mX225_SDp, sigmaSDp_X225 = np.loadtxt("goodman_limits_data/xenon225livedays_SDp.csv",delimiter=",").T
-sigmaSDn_X225 = 10**sigmaSDn_X225 # data in file is in log10 units
-#sigmaSDp_X225 = 10**sigmaSDn_X225 # data in file is in log10 units
+mX225_SDn, sigmaSDn_X225 = curves.get("XENON100_SDn")
+mX225_SDp, sigmaSDp_X225 = curves.get("XENON100_SDp")
 
 # SD XENON100 estimated limits via EFT:
 c4_lim_XENON100 = tools.get_c_curve("c4p=c4n") # SD operator, equal proton/neutron couplings
@@ -0,0 +1,115 @@
+""" Velocity integrals for the standard Maxwell-Boltzmann halo with a sharp
+    cutoff at the escape velocity (SetHALO["MBcutoff"] in DMFormFactor)
+
+    eta(vmin) = int_{v>vmin} f(v)/v d^3v    in (km/s)^-1
+    xi(vmin)  = int_{v>vmin} f(v) v d^3v    in km/s
+
+    f(v) is the WIMP velocity distribution in the Earth frame. xi is needed for
+    the v_perp^2-dependent parts of the NR EFT rate, since
+    int_{v>vmin} f(v)/v (v^2 - vmin^2) d^3v = xi(vmin) - vmin^2 eta(vmin)
+"""
+
+import os
+import numpy as np
+from collections import OrderedDict
+from scipy.special import erf
+
+c_kms = 299792.458 # speed of light in km/s
+
+# Defaults used by recoil_generator.m (from XEPHYR)
+ve_default   = 220. # Earth's velocity in galactic rest frame (km/s)
+v0_default   = 220. # Mean WIMP speed in galactic rest frame (km/s)
+vesc_default = 544. # Galactic escape speed (km/s)
+
+def Nesc(v0,vesc):
+   # Normalisation of the truncated Maxwell-Boltzmann distribution (relative to the untruncated one)
+   z = vesc/v0
+   return erf(z) - 2*z*np.exp(-z**2)/np.sqrt(np.pi)
+
+def speed_distribution_over_v(v,ve=ve_default,v0=v0_default,vesc=vesc_default):
+   # Earth-frame speed distribution divided by speed, g(v)/v, in (km/s)^-2.
+   # (g(v) = v^2 int dOmega f(v); dividing out one power of v keeps this finite at v=0)
+   v = np.asarray(v,dtype=float)
+   umax = np.minimum(v+ve,vesc) # largest galactic-frame speed allowed along this shell
+   gv = (np.exp(-(v-ve)**2/v0**2) - np.exp(-umax**2/v0**2)) / (np.sqrt(np.pi)*v0*ve*Nesc(v0,vesc))
+   return np.where(np.abs(v-ve) < vesc, gv, 0.)
+
+def eta_analytic(vmin,ve=ve_default,v0=v0_default,vesc=vesc_default):
+   # Closed form of eta(vmin) for the MBcutoff halo (e.g. Savage, Freese & Gondolo 2006), in (km/s)^-1
+   x = np.asarray(vmin,dtype=float)/v0
+   y = ve/v0
+   z = vesc/v0
+   K = 1./(2*Nesc(v0,vesc)*y*v0)
+   low  = erf(x+y) - erf(x-y) - 4*y*np.exp(-z**2)/np.sqrt(np.pi)
+   high = erf(z)   - erf(x-y) - 2*(y+z-x)*np.exp(-z**2)/np.sqrt(np.pi)
+   return K*np.where(x < z-y, low, np.where(x < z+y, high, 0.))
+
+class HaloTable(object):
+   """ eta(vmin) and xi(vmin) tabulated once for one set of halo parameters
+
+       Both are obtained from running integrals of g(v)/v on a dense speed grid,
+       and evaluated at arbitrary vmin by linear interpolation.
+   """
+
+   def __init__(self,ve=ve_default,v0=v0_default,vesc=vesc_default,nv=4001,tables=None):
+      self.ve   = ve
+      self.v0   = v0
+      self.vesc = vesc
+      if tables is not None:
+         self.v, self.eta, self.xi = tables
+         return
+      v   = np.linspace(0,ve+vesc,nv)
+      h   = speed_distribution_over_v(v,ve,v0,vesc)
+      hv2 = h*v**2
+      dv  = v[1]-v[0]
+      # integrals from v up to the maximum speed (trapezoid rule, accumulated from the top)
+      self.v   = v
+      self.eta = np.concatenate((np.cumsum((0.5*dv*(h[1:]+h[:-1]))[::-1])[::-1],[0.]))
+      self.xi  = np.concatenate((np.cumsum((0.5*dv*(hv2[1:]+hv2[:-1]))[::-1])[::-1],[0.]))
+
+   def __call__(self,vmin):
+      # eta(vmin) in (km/s)^-1 and xi(vmin) in km/s, for any array of vmin (km/s)
+      vmin = np.asarray(vmin,dtype=float)
+      return np.interp(vmin,self.v,self.eta,right=0.), np.interp(vmin,self.v,self.xi,right=0.)
+
+   def save(self,fname):
+      np.savez(fname,params=[self.ve,self.v0,self.vesc],v=self.v,eta=self.eta,xi=self.xi)
+
+   @classmethod
+   def load(cls,fname):
+      d = np.load(fname)
+      ve, v0, vesc = d["params"]
+      return cls(ve,v0,vesc,tables=(d["v"],d["eta"],d["xi"]))
+
+# In-memory cache of HaloTables, keyed by (ve,v0,vesc,nv), least recently used evicted first
+cache_size = 64
+_cache = OrderedDict()
+
+# Directory in which to persist tables between runs (None to keep them in memory only)
+cache_dir = None
+
+def get_table(ve=ve_default,v0=v0_default,vesc=vesc_default,nv=4001):
+   key = (float(ve),float(v0),float(vesc),int(nv))
+   if key in _cache:
+      table = _cache.pop(key)
+   else:
+      fname = None
+      if cache_dir is not None:
+         fname = os.path.join(cache_dir,"halo_ve{0:g}_v0{1:g}_vesc{2:g}_nv{3}.npz".format(*key))
+      if fname is not None and os.path.exists(fname):
+         table = HaloTable.load(fname)
+      else:
+         table = HaloTable(*key)
+         if fname is not None:
+            if not os.path.isdir(cache_dir):
+               os.makedirs(cache_dir)
+            table.save(fname)
+      if len(_cache) >= cache_size:
+         _cache.popitem(last=False)
+   _cache[key] = table # (re)insert as most recently used
+   return table
+
+def halo_integrals(vmin,ve=ve_default,v0=v0_default,vesc=vesc_default,nv=4001):
+   # eta(vmin) in (km/s)^-1 and xi(vmin) in km/s, for any array of vmin (km/s),
+   # interpolated from the (cached) table for these halo parameters
+   return get_table(ve,v0,vesc,nv)(vmin)
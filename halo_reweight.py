@@ -0,0 +1,108 @@
+""" Spectra and coupling limits for many halo models without regenerating anything
+
+    The halo only enters dR/dE through two velocity integrals at
+    vmin(mass,E) (see recoil_rates.RateBasis): every basis spectrum is a
+    coupling- and halo-independent part (kinematics x nuclear response)
+    times either eta(vmin) or the v_perp^2 integral xi(vmin) - vmin^2 eta(vmin).
+    Contracting the couplings with the two groups of basis parts once, the
+    spectra for any halo are
+       dR/dE = S_eta(mass,E) eta(vmin) + S_perp(mass,E) [xi - vmin^2 eta](vmin)
+    so a grid of (v0, ve, vesc) only needs new eta and xi tables. These are
+    built for the whole grid at once on a shared speed grid (as in
+    halo.HaloTable), and spectra, window counts and coupling limits for all
+    halos follow from broadcast products. E.g. recoil_generator.m's
+    (v0,ve,vesc) = (220,220,544) km/s and check_dRdE_form.m's (220,232,550)
+    can be compared directly.
+"""
+
+import numpy as np
+
+import halo
+import recoil_rates as rr
+from rate_index import CumulativeRate
+
+def halo_grid(v0s=[halo.v0_default],ves=[halo.ve_default],vescs=[halo.vesc_default]):
+   # (nhalo,3) array of all combinations of (v0, ve, vesc) in km/s
+   return np.array(np.meshgrid(v0s,ves,vescs,indexing="ij")).reshape(3,-1).T
+
+def halo_integrals(vmin,halos,nv=4001):
+   # eta(vmin) in (km/s)^-1 and xi(vmin) in km/s for every halo; shape (nhalo,) + vmin.shape.
+   # Same construction as halo.HaloTable, on one speed grid covering all halos.
+   halos = np.atleast_2d(np.asarray(halos,dtype=float))
+   v0, ve, vesc = [halos[:,i:i+1] for i in range(3)]
+   v   = np.linspace(0,np.max(ve+vesc),nv)
+   h   = halo.speed_distribution_over_v(v[None,:],ve,v0,vesc) # (nhalo,nv)
+   hv2 = h*v**2
+   dv  = v[1]-v[0]
+   eta = np.concatenate((np.cumsum((0.5*dv*(h[:,1:]+h[:,:-1]))[:,::-1],axis=1)[:,::-1],np.zeros((len(halos),1))),axis=1)
+   xi  = np.concatenate((np.cumsum((0.5*dv*(hv2[:,1:]+hv2[:,:-1]))[:,::-1],axis=1)[:,::-1],np.zeros((len(halos),1))),axis=1)
+   # linear interpolation on the shared grid (zero beyond its end)
+   vmin = np.asarray(vmin,dtype=float)
+   x = np.clip(vmin/dv,0,nv-1)
+   i = np.minimum(np.floor(x).astype(int),nv-2)
+   t = x - i
+   inside = vmin <= v[-1]
+   interp = lambda T: np.where(inside,T[:,i]*(1-t) + T[:,i+1]*t,0.)
+   return interp(eta), interp(xi)
+
+class HaloReweighter(object):
+
+   def __init__(self,basis,nv=4001):
+      # basis: recoil_rates.RateBasis (for any halo; only its halo-independent parts are used)
+      self.basis = basis
+      self.nv = nv
+      self._trap = {} # windows -> (nE,nW) integration weights
+
+   def integrals(self,halos):
+      # (nhalo, nm*nE) eta and v_perp^2 integrals in the units used by RateBasis (speeds in units of c)
+      vmin = self.basis.vmin.reshape(-1)
+      eta, xi = halo_integrals(vmin,halos,self.nv)
+      eta = eta*halo.c_kms
+      return eta, xi/halo.c_kms - (vmin/halo.c_kms)**2*eta
+
+   def parts(self,cp,cn):
+      # Halo-independent (nsets, nm*nE) spectra multiplying eta and the v_perp^2 integral
+      C = self.basis.coefficients(cp,cn)
+      vp = self.basis.vp
+      return np.dot(C[:,~vp],self.basis.A[~vp]), np.dot(C[:,vp],self.basis.A[vp])
+
+   def spectra(self,cp,cn,halos):
+      # dR/dE for coefficient sets (as for RateBasis.spectra) and every halo; shape (nhalo,nsets,nm,nE)
+      Seta, Sperp = self.parts(cp,cn)
+      eta, vperp = self.integrals(halos)
+      S = Seta[None]*eta[:,None] + Sperp[None]*vperp[:,None]
+      return S.reshape(S.shape[:2]+self.basis.shape)
+
+   def operator_spectra(self,halos,ops=range(1,16),combs=["p=n"]):
+      # (nhalo, operator, comb, mass, energy) spectra for single-operator couplings
+      cs = [rr.couplings(op,comb) for op in ops for comb in combs]
+      S = self.spectra(np.array([c[0] for c in cs]),np.array([c[1] for c in cs]),halos)
+      return S.reshape((S.shape[0],len(ops),len(combs))+self.basis.shape)
+
+   def _weights(self,windows):
+      # Window integrals are linear in dR/dE: weights reproducing CumulativeRate.window_counts
+      key = tuple(map(tuple,np.asarray(windows,dtype=float).reshape(-1,2)))
+      if key not in self._trap:
+         nE = len(self.basis.ER)
+         self._trap[key] = CumulativeRate(self.basis.ER,np.eye(nE)).window_counts(windows)
+      return self._trap[key]
+
+   def window_counts(self,cp,cn,halos,windows,chunk=32):
+      # Expected events (exposure of the basis) in each window; shape (nhalo,nsets,nm,nW).
+      # Halos are processed chunk at a time, without forming the full spectra.
+      nm, nE = self.basis.shape
+      Wt = self._weights(windows)
+      Seta, Sperp = [S.reshape(-1,nm,nE) for S in self.parts(cp,cn)]
+      halos = np.atleast_2d(halos)
+      out = []
+      for k in range(0,len(halos),chunk):
+         eta, vperp = [I.reshape(-1,nm,nE) for I in self.integrals(halos[k:k+chunk])]
+         out += [np.einsum("sme,hme,ew->hsmw",Seta,eta,Wt) + np.einsum("sme,hme,ew->hsmw",Sperp,vperp,Wt)]
+      return np.concatenate(out)
+
+   def limits(self,cp,cn,halos,windows,exposure,normrate=5):
+      # Couplings giving normrate expected events in each window for an exposure in kg.days,
+      # relative to the couplings cp, cn; shape (nhalo,nsets,nm,nW) (inf where the rate vanishes)
+      N = self.window_counts(cp,cn,halos,windows) * float(exposure)/self.basis.exposure
+      with np.errstate(divide="ignore",invalid="ignore"):
+         return np.sqrt(normrate/np.maximum(N,0))
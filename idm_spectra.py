@@ -0,0 +1,165 @@
+""" Lazy access to the inelastic (IDM) spectrum tables written by recoil_generator.m
+
+    In IDM mode recoil_generator.m writes one HDF5 file per operator,
+       <outpath>/Xe{A}/IDM_Xe{A}_{Tag}_{SRtag}_c{op}p=c{op}n.h5
+    holding one dataset "delm{d}" per mass splitting d (keV) in delmlist.
+    Each dataset is an (nE, 1+nm) table: recoil energy in keV, then one
+    dR/dE column per WIMP mass (the masses of recoil_generator.m).
+
+    Files are only opened when first needed, and only the requested delm
+    datasets and mass columns are read from disk (h5py reads just the
+    selected hyperslab). Recently used slices are kept in a small cache.
+
+    Between tabulated splittings the spectra are interpolated as in
+    SpectrumArchive.interpolated_rates: dR/dE divided by the halo integral
+    eta(vmin) is nearly independent of delm (the delm dependence is almost
+    all in vmin), so that ratio is interpolated linearly in delm and
+    multiplied by eta at the requested splitting. This keeps the kinematic
+    endpoint exact.
+
+    Requires h5py (optional dependency; only needed for inelastic tables).
+"""
+
+import os
+import numpy as np
+from collections import OrderedDict
+
+try:
+   import h5py
+except ImportError:
+   h5py = None
+
+import halo
+import recoil_rates as rr
+
+# Number of (delm, mass selection) slices kept in memory per file
+cache_size = 16
+
+class IDMFile(object):
+   """ One IDM HDF5 file (one operator), opened lazily """
+
+   def __init__(self,fname,A,masses=rr.masses):
+      # A: isotope mass number (for the inelastic kinematics used in interpolation)
+      # masses: WIMP masses (GeV) of the dR/dE columns
+      self.fname  = fname
+      self.A      = A
+      self.masses = np.asarray(masses,dtype=float)
+      self._file  = None
+      self._energies = None
+      self._cache = OrderedDict()
+
+   @property
+   def file(self):
+      if self._file is None:
+         if h5py is None:
+            raise ImportError("h5py is required to read the inelastic spectrum tables ({0})".format(self.fname))
+         if not os.path.exists(self.fname):
+            raise IOError("IDM spectrum table {0} not found!".format(self.fname))
+         self._file = h5py.File(self.fname,"r")
+         self.delms = np.array(sorted(float(k[len("delm"):]) for k in self._file.keys() if k.startswith("delm")))
+      return self._file
+
+   @property
+   def energies(self):
+      if self._energies is None:
+         self._energies = self._dataset(self.delms[0])[:,0]
+      return self._energies
+
+   def close(self):
+      if self._file is not None:
+         self._file.close()
+         self._file = None
+
+   def _dataset(self,delm):
+      return self.file["delm{0:g}".format(delm)]
+
+   def mass_indices(self,masses=None):
+      # Column indices of the requested masses (all masses if None)
+      if masses is None:
+         return np.arange(len(self.masses))
+      idx = []
+      for m in np.atleast_1d(masses):
+         i = np.where(self.masses==m)[0]
+         if len(i)==0:
+            raise KeyError("WIMP mass {0} GeV not tabulated in {1}; available: {2}".format(m,self.fname,self.masses))
+         idx += [i[0]]
+      return np.array(idx)
+
+   def tabulated(self,delm,masses=None):
+      # (nm, nE) dR/dE for a tabulated mass splitting, reading only the requested mass columns
+      self.file
+      if delm not in self.delms:
+         raise KeyError("delm={0} keV not tabulated in {1}; available: {2}".format(delm,self.fname,self.delms))
+      idx = self.mass_indices(masses)
+      key = (float(delm),tuple(idx))
+      if key in self._cache:
+         data = self._cache.pop(key)
+      else:
+         # h5py needs increasing column selections; read sorted unique columns, then reorder
+         cols, inv = np.unique(idx,return_inverse=True)
+         data = self._dataset(delm)[:,list(cols+1)].T[inv]
+         if len(self._cache) >= cache_size:
+            self._cache.popitem(last=False)
+      self._cache[key] = data # (re)insert as most recently used
+      return data
+
+   def _eta(self,masses,delm):
+      # Halo integral eta(vmin) for each mass and energy (shape (nm,nE)) at splitting delm
+      q, vmin = rr.kinematics(self.A,masses[:,None],self.energies[None,:],delm)
+      return halo.halo_integrals(vmin)[0]
+
+   def rates(self,delm,masses=None):
+      # (nm, nE) dR/dE for any splitting between the smallest and largest tabulated ones
+      self.file
+      if delm in self.delms:
+         return self.tabulated(delm,masses)
+      if delm < self.delms[0] or delm > self.delms[-1]:
+         raise ValueError("delm={0} keV outside tabulated range [{1},{2}] keV of {3}".format(delm,self.delms[0],self.delms[-1],self.fname))
+      i = np.searchsorted(self.delms,delm) # delms[i-1] < delm < delms[i]
+      d0, d1 = self.delms[i-1], self.delms[i]
+      m = self.masses[self.mass_indices(masses)]
+      eta0, eta1, eta = self._eta(m,d0), self._eta(m,d1), self._eta(m,delm)
+      with np.errstate(divide="ignore",invalid="ignore"):
+         r0 = np.where(eta0>0,self.tabulated(d0,masses)/eta0,0.)
+         r1 = np.where(eta1>0,self.tabulated(d1,masses)/eta1,0.)
+      # vmin grows with delm, so eta1 can only vanish where eta0 does not: use the lower
+      # splitting alone there (eta itself vanishes wherever eta0 does)
+      r1 = np.where(eta1>0,r1,r0)
+      w  = (delm-d0)/(d1-d0)
+      return ((1-w)*r0 + w*r1) * eta
+
+   def spectrum(self,delm,mass):
+      # (nE, 2) array of [ER, dR/dE] for one mass, as in SpectrumArchive.spectrum
+      return np.column_stack((self.energies,self.rates(delm,[mass])[0]))
+
+class IDMSpectra(object):
+   """ The set of IDM files for one isotope, form factor choice and energy range """
+
+   def __init__(self,path,A,Tag="NR",SRtag="lowE",masses=rr.masses):
+      # path: output directory given to recoil_generator.m
+      self.path   = path
+      self.A      = A
+      self.Tag    = Tag
+      self.SRtag  = SRtag
+      self.masses = np.asarray(masses,dtype=float)
+      self._files = {}
+
+   def fname(self,op):
+      return os.path.join(self.path,"Xe{0}".format(self.A),
+                          "IDM_Xe{0}_{1}_{2}_c{3}p=c{3}n.h5".format(self.A,self.Tag,self.SRtag,op))
+
+   def operator(self,op):
+      # IDMFile for one operator (nothing is read until spectra are requested)
+      if op not in self._files:
+         self._files[op] = IDMFile(self.fname(op),self.A,self.masses)
+      return self._files[op]
+
+   def rates(self,op,delm,masses=None):
+      return self.operator(op).rates(delm,masses)
+
+   def spectrum(self,op,delm,mass):
+      return self.operator(op).spectrum(delm,mass)
+
+   def close(self):
+      for f in self._files.values():
+         f.close()
@@ -0,0 +1,134 @@
+""" Full operator interference tables for the NR EFT rate
+
+    dR/dE is a quadratic form in the 30 coefficients
+       c = (c1p, c1n, c2p, c2n, ..., c15p, c15n)
+    (same ordering as coefflist in check_dRdE_form.m), i.e.
+       dR/dE(mass,E) = c^T M(mass,E) c
+    with M a symmetric 30x30 matrix for each isotope, mass and recoil energy.
+
+    Most entries of M vanish (only some operator pairs interfere), so tables
+    store the non-zero entries of the upper triangle only: a list of index
+    pairs (i,j), i<=j, and an (npairs, mass, energy) array of values. Off-diagonal
+    values are stored as M_ij (the factor 2 from M_ij + M_ji is applied on use).
+"""
+
+import os
+import sys
+import numpy as np
+
+import recoil_rates as rr
+from rate_index import CumulativeRate
+
+Nops = 15
+Ncoeffs = 2*Nops
+
+def coeff_index(op,N):
+   # Position of coefficient c_op^N (N=0 proton, 1 neutron) in the 30-component coupling vector
+   return 2*(op-1) + N
+
+def coeff_labels():
+   return ["c{0}{1}".format(op,N) for op in range(1,Nops+1) for N in "pn"]
+
+def to_vector(cp,cn):
+   # Convert (...,Nops+1) cp, cn arrays indexed by operator number (entry 0 unused) to (...,30) vectors
+   cp = np.asarray(cp,dtype=float)
+   cn = np.asarray(cn,dtype=float)
+   return np.stack((cp[...,1:Nops+1],cn[...,1:Nops+1]),axis=-1).reshape(cp.shape[:-1]+(Ncoeffs,))
+
+class InterferenceTable(object):
+
+   def __init__(self,pairs,values,masses,energies,isotope=None,ncoeffs=Ncoeffs):
+      # pairs: (npairs,2) indices i<=j into the 30-component coupling vector
+      # values: (npairs,nm,nE) entries M_ij of the interference matrix
+      # ncoeffs: length of the coupling vectors (e.g. 40 for the relativistic tables of relativistic.py)
+      self.pairs    = np.asarray(pairs,dtype=int).reshape(-1,2)
+      self.values   = np.asarray(values)
+      self.masses   = np.asarray(masses,dtype=float)
+      self.energies = np.asarray(energies,dtype=float)
+      self.isotope  = isotope
+      self.ncoeffs  = int(ncoeffs)
+      # weight 2 for off-diagonal entries, since M_ij = M_ji both contribute
+      self.weights  = np.where(self.pairs[:,0]==self.pairs[:,1],1.,2.)
+      self._windows = {}
+
+   @classmethod
+   def from_basis(cls,basis,isotope=None):
+      # Build from a recoil_rates.RateBasis, symmetrising the basis spectra into the upper triangle
+      values = {}
+      for k,(a,N,b,M) in enumerate(basis.index):
+         i, j = sorted((coeff_index(a,N),coeff_index(b,M)))
+         w = 1. if i==j else 0.5
+         values[(i,j)] = values.get((i,j),0.) + w*basis.B[k]
+      pairs = sorted(values.keys())
+      V = np.array([values[p] for p in pairs]).reshape((len(pairs),)+basis.shape)
+      return cls(pairs,V,basis.mchi,basis.ER,isotope)
+
+   @classmethod
+   def generate(cls,A,helm=False,**kwargs):
+      # Interference table for xenon isotope A; kwargs are passed on to recoil_rates.RateBasis
+      return cls.from_basis(rr.RateBasis(rr.get_response(A,helm),**kwargs),A)
+
+   def save(self,fname):
+      np.savez(fname,pairs=self.pairs,values=self.values,masses=self.masses,energies=self.energies,
+               isotope=str(self.isotope),ncoeffs=self.ncoeffs)
+
+   @classmethod
+   def load(cls,fname):
+      d = np.load(fname)
+      ncoeffs = int(d["ncoeffs"]) if "ncoeffs" in d.files else Ncoeffs
+      return cls(d["pairs"],d["values"],d["masses"],d["energies"],str(d["isotope"]),ncoeffs)
+
+   def matrix(self):
+      # Dense symmetric (30,30,nm,nE) interference matrix
+      M = np.zeros((self.ncoeffs,self.ncoeffs)+self.values.shape[1:])
+      M[self.pairs[:,0],self.pairs[:,1]] = self.values
+      M[self.pairs[:,1],self.pairs[:,0]] = self.values
+      return M
+
+   def products(self,c):
+      # (npoints,npairs) weighted coefficient products for (npoints,30) coupling vectors
+      c = np.atleast_2d(c)
+      return c[:,self.pairs[:,0]] * c[:,self.pairs[:,1]] * self.weights
+
+   def rate(self,c):
+      # dR/dE = c^T M c for a batch of coupling vectors c, shape (npoints,30) (or (30,));
+      # returns (npoints,nm,nE)
+      P = self.products(c)
+      return np.dot(P,self.values.reshape(len(self.pairs),-1)).reshape((P.shape[0],)+self.values.shape[1:])
+
+   def window_values(self,windows):
+      # (npairs,nm,nW) window integrals of each interference entry; cached per set of windows
+      key = tuple(map(tuple,np.asarray(windows,dtype=float).reshape(-1,2)))
+      if key not in self._windows:
+         self._windows[key] = CumulativeRate(self.energies,self.values).window_counts(windows)
+      return self._windows[key]
+
+   def counts(self,c,windows,mass_index=None):
+      # Expected events in each window for a batch of coupling vectors; shape (npoints,nm,nW),
+      # or (npoints,nW) if mass_index is given (one mass index per point, or a single one for all)
+      P  = self.products(c)
+      Vw = self.window_values(windows)
+      if mass_index is None:
+         return np.einsum("pk,kmw->pmw",P,Vw)
+      mass_index = np.broadcast_to(np.asarray(mass_index,dtype=int),(P.shape[0],))
+      return np.einsum("pk,kpw->pw",P,Vw[:,mass_index])
+
+def write_tables(outpath,isos=rr.isotopes,helm=False,SRtag="lowE",**kwargs):
+   # Generate and save interference tables for several isotopes, as Xe{A}_{Tag}_{SRtag}_interference.npz
+   Tag = "NR_HelmFF" if helm else "NR"
+   fnames = []
+   for A in isos:
+      fname = os.path.join(outpath,"Xe{0}_{1}_{2}_interference.npz".format(A,Tag,SRtag))
+      InterferenceTable.generate(A,helm,ER=rr.Earrs[SRtag],**kwargs).save(fname)
+      fnames += [fname]
+   return fnames
+
+if __name__=="__main__":
+   # Usage: python interference.py <outpath> [UseHelm]
+   if len(sys.argv) < 2:
+      print("Usage: python interference.py <outpath> [UseHelm]")
+      sys.exit(1)
+   helm = len(sys.argv) > 2 and sys.argv[2]=="UseHelm"
+   for SRtag in ["lowE","highE"]:
+      for fname in write_tables(sys.argv[1],helm=helm,SRtag=SRtag):
+         print("Wrote {0}".format(fname))
@@ -0,0 +1,37 @@
+""" Isospin-angle scans from the stored p, n and p=n spectra
+
+    The rate is quadratic in (cp,cn) for each operator, so
+       R(cp,cn) = cp^2 R_p + cn^2 R_n + 2 cp cn R_x,   R_x = (R_{p=n} - R_p - R_n)/2
+    and the three stored isospin combinations determine the rate for every
+    ratio cn/cp. Couplings are parameterised as (cp,cn) = c (cos theta, sin theta).
+"""
+
+import numpy as np
+
+from normalise_spectra import orig_exposure
+
+def angle(ratio):
+   # Isospin angle for a given cn/cp ratio
+   return np.arctan(ratio)
+
+def form(spectra,iso,op,windows):
+   # (2,2,nm,nW) matrix of window event counts (original exposure) in the (cp,cn) basis, for all
+   # masses in a SpectrumArchive
+   Np  = spectra.index(iso,op,"p").window_counts(windows)
+   Nn  = spectra.index(iso,op,"n").window_counts(windows)
+   Npn = spectra.index(iso,op,"p=n").window_counts(windows)
+   Nx  = (Npn - Np - Nn)/2
+   return np.array([[Np,Nx],[Nx,Nn]])
+
+def counts(spectra,iso,op,thetas,windows):
+   # Expected events (original exposure, c=1) for each isospin angle; shape (ntheta,nm,nW)
+   F = form(spectra,iso,op,windows)
+   u = np.array([np.cos(thetas),np.sin(thetas)]).reshape(2,-1) # (2,ntheta)
+   return np.einsum("it,ijmw,jt->tmw",u,F,u)
+
+def limits(spectra,iso,op,thetas,windows,desired_exposure,normrate=5):
+   # Coupling c giving normrate events in each window, for every isospin angle and mass at once;
+   # shape (ntheta,nm,nW). Angles where the rate vanishes (e.g. xenophobic points) give inf.
+   N = counts(spectra,iso,op,thetas,windows) * desired_exposure/orig_exposure
+   with np.errstate(divide="ignore",invalid="ignore"):
+      return np.sqrt(normrate/np.maximum(N,0))
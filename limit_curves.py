@@ -0,0 +1,42 @@
+""" Smooth limit curves through coupling limits tabulated at a few WIMP masses
+
+    Fits log(limit) vs log(mass) splines for a whole array of curves (e.g.
+    operator x energy window) in one go, and evaluates all of them on a
+    shared fine mass grid once, so that the table and plotting code can
+    simply index into the results instead of rebuilding interpolators for
+    every curve they draw.
+"""
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+def fine_grid(mmin,mmax,step=1.01):
+   # Logarithmically spaced masses from mmin up to (not including) mmax, in steps of a factor 'step'
+   return np.exp(np.arange(np.log(mmin),np.log(mmax),np.log(step)))
+
+class LimitCurves(object):
+
+   def __init__(self,masses,limits,kind="cubic",step=1.01):
+      # masses: (nm,) WIMP masses (GeV) at which the limits are tabulated
+      # limits: (..., nm) array of limits, e.g. (operator, window, mass); signs (used to flag
+      #         entries in the coupling table) are ignored
+      # kind: interpolation order (as for scipy.interpolate.interp1d)
+      # step: ratio between neighbouring masses of the fine grid
+      self.masses = np.asarray(masses,dtype=float)
+      self.limits = np.abs(np.asarray(limits,dtype=float))
+      with np.errstate(divide="ignore"):
+         self._f = interp1d(np.log(self.masses),np.log(self.limits),kind=kind,axis=-1,bounds_error=False)
+      self.finemasses = fine_grid(self.masses[0],self.masses[-1],step)
+      self._fine = None
+
+   def __call__(self,masses):
+      # All curves evaluated at the given masses; shape limits.shape[:-1] + np.shape(masses).
+      # NaN outside the tabulated mass range.
+      return np.exp(self._f(np.log(masses)))
+
+   @property
+   def fine(self):
+      # All curves on the shared fine mass grid, shape limits.shape[:-1] + (len(finemasses),)
+      if self._fine is None:
+         self._fine = self(self.finemasses)
+      return self._fine
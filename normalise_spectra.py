@@ -1,4 +1,5 @@
 import numpy as np
+from rate_index import CumulativeRate
 
 labels = [["c{0}p".format(i),"c{0}n".format(i),"c{0}p=c{0}n".format(i)] for i in range(1,16)]
 
@@ -8,28 +9,21 @@ isotopes = [128,129,130,131,132,134,136]
 # original exposure, needed so we can rescale results for some different exposure 
 orig_exposure = 7800. #in kilogram.days
 
-def normalise_spectrum(in_spectrum,desired_exposure,normrate=5,normrange=(0,1000),c0=1,norm=1,verbose=True):
-   # in_spectrum: (2,n) array, column 1 is recoil energy in keV with normalisation=norm
+def normalise_spectrum(in_spectrum,desired_exposure,normrate=5,normrange=(0,1000),c0=1,verbose=True):
+   # in_spectrum: (n,2) array, column 1 is recoil energy in keV (any increasing grid)
    #                           column 2 is dR/dE in (keV)^-1
    # desired_exposure: Exposure in kg.days to use for coupling computations
    # normrate: Total expected number of events within normrange desired for rescaled spectrum
    # normrange: Range of recoil energies over which to compute normrate
    # c0: value of coupling used to generated original spectrum
-   # norm: e.g. 1 if datapoints are separated by 1 keV
+   #
+   # All event counts are integrals from the cumulative-rate index of the spectrum (see rate_index.py),
+   # so they do not depend on the spacing of the energy grid (a plain sum over datapoints only
+   # counts events correctly on a 1 keV grid)
+   index = CumulativeRate(in_spectrum[:,0],in_spectrum[:,1])
+   Emin, Emax = in_spectrum[0,0], in_spectrum[-1,0]
 
-   # Find the desired normrange endpoints in ER indices
-   #startcut = np.argmin(np.abs(spectrum[:,0] - normrange[0]))
-   #endcut   = np.argmax(np.abs(spectrum[:,0] - normrange[1]))
-   mask = (in_spectrum[:,0] >= normrange[0]) & (in_spectrum[:,0] <= normrange[1])
-
-   #mask = (in_spectrum[:,0] >= normrange[0]) & (in_spectrum[:,0] <= normrange[1])
-   #print "sum mask: ", np.sum(mask)
-   #print "sum mask: ", np.min(np.where(mask)), np.max(np.where(mask))
-   #print "sum normrange: ", normrange
-   #print "rate0 ({0}) = {1}".format(normrange,np.sum(in_spectrum[mask][1]))
-   #print "rate0 ({0}) = {1}".format(normrange,np.sum(in_spectrum[normrange[0]:normrange[1],1]))
-
-   if verbose: print "  Expected total events (in range {0}, with original exposure={1} kg.days) = {2}".format(normrange, orig_exposure, np.sum(in_spectrum[mask][:,1])/norm)
+   if verbose: print "  Expected total events (in range {0}, with original exposure={1} kg.days) = {2}".format(normrange, orig_exposure, index.counts(*normrange))
 
    exposeK = desired_exposure/orig_exposure
    
@@ -39,39 +33,26 @@ def normalise_spectrum(in_spectrum,desired_exposure,normrate=5,normrange=(0,1000
    spectrum[:,1] = exposeK*spectrum[:,1]
 
    # Compute total number of events in normrange
-   rate0 = np.sum(spectrum[mask][:,1])/norm
+   rate0 = exposeK*index.counts(*normrange)
    if verbose: print "  Expected total events (in range {0}, with desired exposure ={1} kg.days) = {2}".format(normrange, desired_exposure, rate0)
    
-   # Scale spectra so that there are 10 expected events in total
-   #norm = 1 # should be 1 datapoint per keV
-
    #(rate0/rate1 = c0^2 / c1^2,  i.e. c1^2 = c0^2 * (rate1/rate0) 
    # i.e. rate1 = (c0^2 / c1^2) * rate0
    c1   = np.sqrt(c0**2 * (normrate/rate0))
    scaling1 = normrate / rate0  # = (c1**2 / c0**2) 
-   #np.sum(scaled_spectrum["dRdE"][mask])
-   print "test:"
-   print scaling1
-   print np.sum(scaling1*spectrum[mask][:,1])
-   print np.sum((c1**2/c0**2)*spectrum[mask][:,1])
-   #print spectrum[8:30,0]
-   #print spectrum[mask,0]
 
-   #fraction of events below 30 keV / 200 keV
    scaled_spectrum = np.array(np.zeros(spectrum.shape[0]),dtype=np.dtype([("ER",np.int16),("dRdE",np.float16)]))
    scaled_spectrum["ER"] = spectrum[:,0]
    scaled_spectrum["dRdE"] = scaling1*spectrum[:,1]
-   print np.sum(scaled_spectrum["dRdE"][mask])
 
-   #print scaled_spectrum
-   inittotal= np.sum(spectrum[2:,1])
-   total   = np.sum(scaled_spectrum["dRdE"][7:])
-   frac30  = np.sum(scaled_spectrum["dRdE"][7:30])/total
-   frac200 = np.sum(scaled_spectrum["dRdE"][7:200])/total
+   # Totals over the whole grid, and fractions of the events above 7 keV, from the same index
+   inittotal = exposeK*index.counts(Emin,Emax)
+   total     = scaling1*inittotal
+   frac30, frac200 = index.window_counts([(7,30),(7,200)]) / index.counts(7,Emax)
    if verbose: print "  Expected total events with c=1: {0}".format(inittotal)
    if verbose: print "  Expected total events with c={0}: {1}".format(c1, total)
-   if verbose: print "  Expected total events with c={0} (in range {1}, with desired exposure ={2} kg.days) = {3}".format(c1, normrange, desired_exposure, np.sum(scaled_spectrum["dRdE"][mask]))
-   if verbose: print "  fraction of events below 30 keV (200 keV): {0} ({1})".format(frac30,frac200)  
+   if verbose: print "  Expected total events with c={0} (in range {1}, with desired exposure ={2} kg.days) = {3}".format(c1, normrange, desired_exposure, scaling1*rate0)
+   if verbose: print "  fraction of events in 7-30 keV (7-200 keV): {0} ({1})".format(frac30,frac200)  
    if verbose: print "  Coupling (coupling^2) required for {0} events (exposure={1} kg.days): c={2}, c^2={3}".format(normrate, desired_exposure, c1  ,c1**2  )
    #plt.plot(scaled_spectrum["ER"],    scaled_spectrum["dRdE"])
    #plt.plot(scaled_spectrum["ER"], 10*scaled_spectrum["dRdE"])
@@ -94,4 +75,33 @@ def normalise_spectrum(in_spectrum,desired_exposure,normrate=5,normrange=(0,1000
    # ax.set_ylabel("dR/dE (per keV)")
    # fig.savefig("{0}/Xe{1}_{2}_M={3}GeV_EinkeV_sumdRdE=1.png".format(pathtodat,iso,lab,mass))
 
+def batch_couplings(energies,rates,desired_exposure,normrate=5,normranges=[(0,1000)],c0=1):
+   # Vectorised version of the coupling calculation in normalise_spectrum, for many spectra at once.
+   # No copies of the spectra are made and nothing is printed.
+   # energies: (nE,) array of recoil energies in keV (any increasing grid)
+   # rates: (..., nE) array of dR/dE in (keV)^-1, e.g. (operator, mass, energy) slice of a SpectrumArchive
+   # desired_exposure: Exposure(s) in kg.days to use for coupling computations
+   # normrate: Total expected number(s) of events within each normrange
+   # normranges: list of (Emin,Emax) windows over which to compute normrate
+   # c0: value of coupling used to generated original spectrum
+   #
+   # desired_exposure and normrate are broadcast against each other, giving shape S.
+   # Returns couplings c1 with shape S + rates.shape[:-1] + (len(normranges),)
+   # Window counts come from the cumulative-rate index, as in normalise_spectrum and
+   # SpectrumArchive.counts
+   rate0 = CumulativeRate(energies,rates).window_counts(normranges) # events with original exposure
+   return couplings_from_counts(rate0,desired_exposure,normrate,c0)
+
+def couplings_from_counts(rate0,desired_exposure,normrate=5,c0=1):
+   # Couplings for expected event counts rate0 (any shape, original exposure and coupling c0),
+   # e.g. window counts from SpectrumArchive.index(...).window_counts; broadcasting as in batch_couplings
+   rate0    = np.asarray(rate0,dtype=float)
+   exposeK  = np.asarray(desired_exposure,dtype=float)/orig_exposure
+   normrate = np.asarray(normrate,dtype=float)
+   exposeK  = exposeK.reshape(exposeK.shape + (1,)*rate0.ndim)
+   normrate = normrate.reshape(normrate.shape + (1,)*rate0.ndim)
 
+   #(rate0/rate1 = c0^2 / c1^2,  i.e. c1^2 = c0^2 * (rate1/rate0) 
+   with np.errstate(divide="ignore"):
+      c1 = np.sqrt(c0**2 * normrate / (exposeK*rate0))
+   return c1
@@ -0,0 +1,217 @@
+""" Scans over several EFT couplings (and the WIMP mass) at once
+
+    Event numbers for any coupling vector c = (c1p, c1n, ..., c15p, c15n)
+    are a quadratic form in c (see interference.py), so the window
+    integrals of the interference tables are computed once (combined over
+    the target isotopes) and the expected events in every window for a
+    batch of points are one contraction with the coupling products:
+       N_w = exposure/7800 * sum_k P_k(c) V_kw(m)
+    Between tabulated WIMP masses V is interpolated linearly in log(mass).
+
+    The likelihood is a Poisson likelihood for the observed counts in a set
+    of (independent) energy windows with known backgrounds, evaluated for
+    whole arrays of points. Three ways of choosing the points are provided:
+      grid_scan   - regular grid over the parameter ranges
+      lhs_scan    - Latin hypercube sample
+      mcmc        - Metropolis chains, all advanced together as one array;
+                    progress is checkpointed to disk (new steps in blocks)
+                    and resumed on rerun
+    Parameters are uniform within their ranges (in log10 for log=True).
+"""
+
+import os
+import numpy as np
+from scipy.special import gammaln
+
+import interference as itf
+import recoil_rates as rr
+import spectrum_store as ss
+
+class Parameter(object):
+
+   def __init__(self,name,lo,hi,log=False):
+      # name: "mchi" (GeV), a coefficient label "c{op}p"/"c{op}n", or "c{op}" for c{op}p=c{op}n
+      # lo, hi: range; log: uniform in log10 rather than linearly (requires lo > 0)
+      self.name, self.lo, self.hi, self.log = name, float(lo), float(hi), bool(log)
+      if self.log and self.lo <= 0:
+         raise ValueError("Parameter {0} scanned in log10 needs a positive range (got [{1},{2}])".format(name,lo,hi))
+
+   def __call__(self,u):
+      # Physical values for positions u in [0,1]
+      if self.log:
+         return 10**(np.log10(self.lo) + u*(np.log10(self.hi)-np.log10(self.lo)))
+      return self.lo + u*(self.hi-self.lo)
+
+def coeff_indices(name):
+   # Positions in the 30-component coupling vector set by a parameter name
+   op = int(name[1:].rstrip("pn"))
+   if name.endswith("p"):
+      return [itf.coeff_index(op,0)]
+   elif name.endswith("n"):
+      return [itf.coeff_index(op,1)]
+   return [itf.coeff_index(op,0),itf.coeff_index(op,1)]
+
+class ScanSpace(object):
+
+   def __init__(self,parameters,fixed={}):
+      # parameters: list of Parameters to scan; fixed: {name: value} for other non-zero couplings
+      # (and the WIMP mass, which must be either scanned or fixed)
+      self.parameters = list(parameters)
+      self.fixed = dict(fixed)
+      self.names = [p.name for p in self.parameters]
+      if "mchi" not in self.names and "mchi" not in self.fixed:
+         raise ValueError("The WIMP mass 'mchi' must be scanned or fixed!")
+
+   @property
+   def ndim(self):
+      return len(self.parameters)
+
+   def physical(self,u):
+      # (npoints,ndim) parameter values for (npoints,ndim) unit-cube positions
+      u = np.atleast_2d(u)
+      return np.column_stack([p(u[:,i]) for i,p in enumerate(self.parameters)])
+
+   def point(self,x):
+      # Coupling vectors (npoints,30) and WIMP masses (npoints,) for parameter values x (npoints,ndim)
+      x = np.atleast_2d(x)
+      c = np.zeros((x.shape[0],itf.Ncoeffs))
+      mchi = np.ones(x.shape[0])*self.fixed.get("mchi",np.nan)
+      values = list(self.fixed.items()) + [(name,x[:,i]) for i,name in enumerate(self.names)]
+      for name,v in values:
+         if name=="mchi":
+            mchi = np.ones(x.shape[0])*v
+         else:
+            for i in coeff_indices(name):
+               c[:,i] = v
+      return c, mchi
+
+class QuadraticRate(object):
+
+   def __init__(self,tables,windows,exposure=rr.benchmark_exposure,abundance=None):
+      # tables: InterferenceTables for the target isotopes (same masses and energies)
+      # windows: (Emin,Emax) energy windows; exposure in kg.days
+      # abundance: {isotope: atom fraction} (default natural xenon) used to weight the isotopes
+      fractions = ss.mass_fractions(dict((t.isotope,(ss.natural_abundance if abundance is None else abundance)[int(t.isotope)])
+                                         for t in tables))
+      self.masses  = tables[0].masses
+      self.windows = windows
+      V = {} # combined window integrals of each interference entry over all isotopes
+      for t in tables:
+         if not np.array_equal(t.masses,self.masses):
+            raise ValueError("Interference tables must share one WIMP mass grid!")
+         Vw = t.window_values(windows) * fractions[t.isotope]
+         for k,(i,j) in enumerate(t.pairs):
+            V[(i,j)] = V.get((i,j),0.) + Vw[k]
+      self.pairs   = np.array(sorted(V.keys()),dtype=int).reshape(-1,2)
+      self.weights = np.where(self.pairs[:,0]==self.pairs[:,1],1.,2.)
+      self.V = np.array([V[tuple(p)] for p in self.pairs]) * float(exposure)/rr.benchmark_exposure # (npairs,nm,nW)
+      self.logm = np.log(self.masses)
+
+   def events(self,c,mchi):
+      # Expected events (npoints,nW) for coupling vectors c (npoints,30) and WIMP masses mchi (npoints,);
+      # NaN outside the tabulated mass range
+      c = np.atleast_2d(c)
+      P = c[:,self.pairs[:,0]] * c[:,self.pairs[:,1]] * self.weights # (npoints,npairs)
+      lm = np.log(np.asarray(mchi,dtype=float))
+      i = np.clip(np.searchsorted(self.logm,lm,side="right")-1,0,len(self.masses)-2)
+      t = (lm - self.logm[i])/(self.logm[i+1]-self.logm[i])
+      inside = (lm >= self.logm[0]) & (lm <= self.logm[-1])
+      Vm = self.V[:,i]*(1-t)[None,:,None] + self.V[:,i+1]*t[None,:,None] # (npairs,npoints,nW)
+      N = np.einsum("pk,kpw->pw",P,Vm)
+      return np.where(inside[:,None],N,np.nan)
+
+class PoissonLikelihood(object):
+
+   def __init__(self,rate,n_obs,b):
+      # rate: QuadraticRate; n_obs, b: observed counts and expected backgrounds in each window
+      self.rate  = rate
+      self.n_obs = np.asarray(n_obs,dtype=float)
+      self.b     = np.asarray(b,dtype=float)
+
+   def __call__(self,space,x):
+      # log-likelihood for parameter values x (npoints,ndim); -inf outside the mass range
+      c, mchi = space.point(x)
+      mu = np.maximum(self.rate.events(c,mchi),0.) + self.b
+      with np.errstate(divide="ignore",invalid="ignore"):
+         lnL = np.sum(np.where(self.n_obs>0,self.n_obs*np.log(mu),0.) - mu - gammaln(self.n_obs+1),axis=-1)
+      return np.where(np.isnan(lnL),-np.inf,lnL)
+
+def _evaluate(space,like,u,chunk):
+   # Parameter values and log-likelihoods for unit-cube points u, chunk points at a time
+   x = space.physical(u)
+   lnL = np.concatenate([like(space,x[k:k+chunk]) for k in range(0,len(x),chunk)])
+   return x, lnL
+
+def grid_scan(space,like,n,chunk=100000):
+   # Regular grid with n points per dimension (n may be a list, one per parameter), cell centres.
+   # Returns parameter values (npoints,ndim) and log-likelihoods (npoints,)
+   n = np.broadcast_to(np.asarray(n,dtype=int),(space.ndim,))
+   axes = [(np.arange(k)+0.5)/k for k in n]
+   u = np.stack(np.meshgrid(*axes,indexing="ij"),axis=-1).reshape(-1,space.ndim)
+   return _evaluate(space,like,u,chunk)
+
+def lhs_scan(space,like,n,rng=None,chunk=100000):
+   # Latin hypercube sample of n points (each parameter range split into n strata, each used once)
+   rng = np.random if rng is None else rng
+   u = (np.array([rng.permutation(n) for i in range(space.ndim)]).T + rng.uniform(size=(n,space.ndim)))/n
+   return _evaluate(space,like,u,chunk)
+
+def _save_chains(fname,state):
+   # Write under a temporary name first so that an interruption cannot corrupt the checkpoint
+   part = fname+".part.npz"
+   np.savez(part,**state)
+   os.rename(part,fname)
+
+def _block_name(fname,k):
+   # File holding block k of checkpointed steps, next to the checkpoint itself
+   return "{0}_block{1:05d}.npz".format(os.path.splitext(fname)[0],k)
+
+def mcmc(space,like,nchains,nsteps,fname=None,step=0.05,seed=1,checkpoint_every=100):
+   # Metropolis sampling with nchains chains advanced together (one likelihood call per step for all
+   # chains). Gaussian proposals of width 'step' in the unit cube; points outside it are rejected.
+   # If fname is given, the chains are checkpointed every checkpoint_every steps and a rerun continues
+   # from the last checkpoint: each block of new steps goes to its own file (see _block_name), and
+   # fname only holds the current state, the RNG state and the number of blocks written. Returns
+   # samples (nsteps,nchains,ndim), their log-likelihoods (nsteps,nchains) and the acceptance
+   # fraction of each chain.
+   if fname is not None and os.path.exists(fname):
+      d = np.load(fname)
+      if d["u"].shape!=(nchains,space.ndim) or list(d["names"])!=space.names:
+         raise ValueError("Checkpoint {0} is for a different scan! Delete it to start again.".format(fname))
+      xs, lnLs = [], []
+      for k in range(int(d["nblocks"])):
+         b = np.load(_block_name(fname,k))
+         xs, lnLs = xs + list(b["x"]), lnLs + list(b["lnL"])
+      u, lnL, accepted = d["u"], d["lnL_current"], d["accepted"]
+      rng = np.random.RandomState()
+      rng.set_state((str(d["rng_name"]),d["rng_keys"],int(d["rng_pos"]),int(d["rng_has_gauss"]),float(d["rng_gauss"])))
+      nblocks = int(d["nblocks"])
+   else:
+      rng = np.random.RandomState(seed)
+      u = rng.uniform(size=(nchains,space.ndim))
+      lnL = like(space,space.physical(u))
+      xs, lnLs, accepted = [], [], np.zeros(nchains,dtype=int)
+      nblocks = 0
+   saved = len(xs)
+   while len(xs) < nsteps:
+      proposal = u + step*rng.normal(size=u.shape)
+      inside = np.all((proposal >= 0) & (proposal <= 1),axis=1)
+      lnLp = np.full(nchains,-np.inf)
+      if np.any(inside):
+         lnLp[inside] = like(space,space.physical(proposal[inside]))
+      with np.errstate(invalid="ignore"):
+         accept = np.log(rng.uniform(size=nchains)) < lnLp - lnL
+      u = np.where(accept[:,None],proposal,u)
+      lnL = np.where(accept,lnLp,lnL)
+      accepted += accept
+      xs += [space.physical(u)]
+      lnLs += [lnL]
+      if fname is not None and (len(xs) % checkpoint_every==0 or len(xs)==nsteps):
+         # the block first, so the checkpoint never refers to a block that was not written
+         _save_chains(_block_name(fname,nblocks),{"x":np.array(xs[saved:]),"lnL":np.array(lnLs[saved:])})
+         nblocks, saved = nblocks+1, len(xs)
+         name, keys, pos, has_gauss, gauss = rng.get_state()
+         _save_chains(fname,{"names":np.array(space.names),"nblocks":nblocks,"u":u,
+                             "lnL_current":lnL,"accepted":accepted,"rng_name":name,"rng_keys":keys,
+                             "rng_pos":pos,"rng_has_gauss":has_gauss,"rng_gauss":gauss})
+   return np.array(xs[:nsteps]), np.array(lnLs[:nsteps]), accepted/float(max(len(xs),1))
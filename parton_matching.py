@@ -0,0 +1,130 @@
+""" Quark/gluon -> nucleon coupling translation in matrix form
+
+    The nucleon couplings produced by translate_couplings.calc_cN_scalar,
+    calc_cN_pseudoscalar and calc_cN_axialvector are linear in the
+    parton-level couplings, so for each type of current they are described
+    by a (nucleon x parton) matrix of hadronic matrix elements,
+       c_N = sum_q H[N,q] g_q,   N = (p, n),   q = (u, d, s, c, b, t, G)
+    built here once from p.data_p and p.data_n by applying the translation
+    functions to unit couplings.
+
+    The Goodman et. al. (2011) operators are then described by a table of
+    (current type, NR operator, parton couplings as a function of M*, extra
+    prefactor), and nucleon couplings for any number of operators, masses
+    (and hadronic-input samples) follow from a single batched contraction.
+"""
+
+import numpy as np
+
+import old.limit_comparison.translate_couplings as t
+import old.limit_comparison.parameters as p
+
+partons = ["u","d","s","c","b","t","G"]
+quarks  = partons[:6]
+
+def quark_masses():
+   return np.array([p.mu,p.md,p.ms,p.mc,p.mb,p.mt])
+
+def hadronic_matrix(kind,data_p=None,data_n=None):
+   # (2,7) matrix H[N,q] for current type 'kind' ("scalar", "pseudoscalar" or "axialvector"),
+   # for the given hadronic inputs (default p.data_p, p.data_n)
+   data = [p.data_p if data_p is None else data_p, p.data_n if data_n is None else data_n]
+   H = np.zeros((2,len(partons)))
+   for N in range(2):
+      for q in range(len(partons)):
+         g = np.zeros(len(partons))
+         g[q] = 1.
+         if kind=="scalar":
+            H[N,q] = t.calc_cN_scalar(*(list(g)+[data[N]]))
+         elif kind=="pseudoscalar":
+            H[N,q] = t.calc_cN_pseudoscalar(*(list(g)+[data[N]]))
+         elif kind=="axialvector":
+            # only the light quarks contribute (see calc_cN_axialvector)
+            H[N,q] = t.calc_cN_axialvector(*(list(g[:3])+[data[N]])) if q < 3 else 0.
+         else:
+            raise ValueError("Unknown current type '{0}'!".format(kind))
+   return H
+
+# Parton-level couplings of the Goodman et. al. operators, as (7,nm) arrays for limits M on M*
+# (all quarks share one M*; factors of i for M2,M3,M8,M10 are ignored)
+def quark_mass_scaled(M):
+   # g_q = m_q/(2 M^3) (M1-M4)
+   M = np.asarray(M,dtype=float)
+   return np.concatenate((quark_masses()[:,None]/(2*M[None,:]**3),np.zeros((1,)+M.shape)))
+
+def universal_quark(M):
+   # g_q = 1/(2 M^2) for u,d,s (M5,M6)
+   M = np.asarray(M,dtype=float)
+   g = np.zeros((len(partons),)+M.shape)
+   g[:3] = 1/(2*M**2)
+   return g
+
+def gluon(M):
+   # g_G = alpha_s/(8 M^3) (M7-M10)
+   M = np.asarray(M,dtype=float)
+   g = np.zeros((len(partons),)+M.shape)
+   g[-1] = p.alpha_s/(8*M**3)
+   return g
+
+def one(mchi):
+   return np.ones(np.shape(mchi))
+
+def minus_mN_over_mchi(mchi):
+   # from the mapping of the pseudoscalar-pseudoscalar operator onto O6
+   return -p.mN/np.asarray(mchi,dtype=float)
+
+# Goodman operator -> (current type, NR operator, parton couplings, prefactor, limit curve)
+operators = {"M1" : ("scalar",      1, quark_mass_scaled, one,                "M1+3"),
+             "M7" : ("scalar",      1, gluon,             one,                "M7+9"),
+             "M6" : ("axialvector", 4, universal_quark,   one,                "M5+6"),
+             "M4" : ("pseudoscalar",6, quark_mass_scaled, minus_mN_over_mchi, "M2+4"),
+             "M10": ("pseudoscalar",6, gluon,             minus_mN_over_mchi, "M8+10"),
+             "M3" : ("pseudoscalar",10,quark_mass_scaled, one,                "M1+3"),
+             "M9" : ("pseudoscalar",10,gluon,             one,                "M7+9")}
+
+class Translator(object):
+
+   def __init__(self,data_p=None,data_n=None):
+      # data_p, data_n: hadronic inputs (default p.data_p, p.data_n), or lists of them (one
+      # per sample), in which case all results get a leading sample axis
+      if isinstance(data_p,(list,tuple)):
+         self.H = dict((kind,np.array([hadronic_matrix(kind,dp,dn) for dp,dn in zip(data_p,data_n)]))
+                       for kind in ["scalar","pseudoscalar","axialvector"])
+      else:
+         self.H = dict((kind,hadronic_matrix(kind,data_p,data_n)) for kind in ["scalar","pseudoscalar","axialvector"])
+
+   def parton_couplings(self,ops,M):
+      # (nops,7,nm) parton couplings for limits M (shape (nops,nm)) on M* of each operator
+      return np.array([operators[op][2](Mi) for op,Mi in zip(ops,M)])
+
+   def translate(self,ops,M,mchi):
+      # Nucleon couplings (..., nops, 2, nm) for Goodman operators 'ops', given limits M on M*
+      # (nops,nm) at WIMP masses mchi (nops,nm); each row may have its own mass grid
+      M    = np.asarray(M,dtype=float).reshape(len(ops),-1)
+      mchi = np.asarray(mchi,dtype=float).reshape(len(ops),-1)
+      g    = self.parton_couplings(ops,M)
+      H    = np.stack([self.H[operators[op][0]] for op in ops],axis=-3) # (..., nops, 2, 7)
+      pre  = np.array([operators[op][3](m) for op,m in zip(ops,mchi)])
+      return np.einsum("...oNq,oqm->...oNm",H,g) * pre[:,None,:]
+
+def collider_limits(curves,ops,translator=None):
+   # Limits on the nucleon couplings of the NR operators, from the (smoothed) limit curves on M*
+   # of Goodman operators 'ops' served by a curve_registry.CurveRegistry. Returns the NR operator
+   # numbers (nops,), WIMP masses (nops,nm) and (proton, neutron) couplings (..., nops, 2, nm).
+   if translator is None:
+      translator = Translator()
+   mchi, M = np.array([curves.get(operators[op][4]) for op in ops]).transpose(1,0,2)
+   NRops = np.array([operators[op][1] for op in ops])
+   return NRops, mchi, translator.translate(ops,M,mchi)
+
+# Columns of a results table: NR operator, source of the limit, plot label, masses, limit values
+results_dtype = [("op",int),("source",object),("label",object),("mchi",object),("data",object)]
+
+def results_table(op,source,label,mchi,data):
+   # Structured array with one row per limit curve (curves may have different mass grids)
+   table = np.empty(len(op),dtype=results_dtype)
+   table["op"] = op
+   for name,column in zip(["source","label","mchi","data"],[source,label,mchi,data]):
+      for i,x in enumerate(column):
+         table[name][i] = x
+   return table
@@ -0,0 +1,121 @@
+""" Upper limits on a Poisson signal with known background
+
+    Two constructions are available:
+      "poisson" - classical upper limit, s_up = mu_up - b with mu_up the
+                  Poisson mean for which P(N <= n_obs) = 1-CL, i.e.
+                  mu_up = chi2.ppf(CL, 2(n_obs+1))/2 (clipped at 0)
+      "FC"      - Feldman & Cousins (physics/9711021) likelihood-ratio
+                  ordering, giving unified upper limits / two-sided intervals
+
+    For the FC construction the confidence belt is built once per
+    (background, CL) on a fine grid of signal means: for each s the
+    acceptance region [n1(s), n2(s)] ("critical counts") is found for all s
+    at once, and the interval for every possible observed count is read off
+    from it. These lookup tables are cached, so limits for any array of
+    observed counts (e.g. operator x mass x window x n_obs grids) are simple
+    indexing operations. (The belt is built strictly as described by FC; it
+    reproduces their Table IV except where they adjusted a few entries by
+    hand, e.g. b=3, n_obs=0, which gives 0.95 here rather than 1.08.)
+
+    coupling_limits converts signal limits into limits on a coupling c for
+    spectra scaling as c^2 (expected events = c^2 * counts at c=1).
+"""
+
+import numpy as np
+from collections import OrderedDict
+from scipy.stats import chi2, poisson
+
+def poisson_upper(n_obs,b=0.,CL=0.9):
+   # Classical upper limits for any (broadcastable) arrays of observed counts and backgrounds
+   n_obs = np.asarray(n_obs)
+   return np.maximum(0.5*chi2.ppf(CL,2*(n_obs+1)) - b, 0.)
+
+class BeltTable(object):
+   """ Feldman-Cousins confidence belt for one background and CL, tabulated up to nmax observed events """
+
+   def __init__(self,b=0.,CL=0.9,nmax=50,ds=0.005,chunk=2000):
+      # b: expected background events
+      # nmax: largest observed count to tabulate
+      # ds: spacing of the signal grid (limits are accurate to about this)
+      # chunk: number of signal values processed at a time (bounds memory use)
+      self.b, self.CL, self.nmax, self.ds = float(b), float(CL), int(nmax), float(ds)
+      smax = poisson_upper(self.nmax,0.,1-1e-4) + 1 # well above any limit we will need
+      self.s = np.arange(0.,smax+ds,ds)
+      # observed counts considered when building acceptance regions: enough to cover the
+      # upper tail for the largest signal on the grid
+      mu = smax + self.b
+      n  = np.arange(0,int(mu + 10*np.sqrt(mu) + 20))
+      # best-fit signal for each n, and its likelihood
+      Pbest = poisson.pmf(n,np.maximum(n-self.b,0.)+self.b)
+      self.n1 = np.empty(len(self.s),dtype=int)
+      self.n2 = np.empty(len(self.s),dtype=int)
+      for start in range(0,len(self.s),chunk):
+         s = self.s[start:start+chunk,None]
+         P = poisson.pmf(n[None,:],s+self.b) # (ns, nn)
+         R = P/Pbest                         # likelihood ratio ordering
+         order = np.argsort(-R,axis=1,kind="mergesort")
+         Psorted = np.take_along_axis(P,order,axis=1) if hasattr(np,"take_along_axis") \
+                   else P[np.arange(P.shape[0])[:,None],order]
+         # add counts in order of decreasing R until the probability content reaches CL
+         before = np.cumsum(Psorted,axis=1) - Psorted
+         accepted = np.zeros(P.shape,dtype=bool)
+         rows = np.arange(P.shape[0])[:,None]
+         accepted[rows,order] = before < self.CL
+         self.n1[start:start+chunk] = np.argmax(accepted,axis=1)
+         self.n2[start:start+chunk] = len(n) - 1 - np.argmax(accepted[:,::-1],axis=1)
+      # Interval for each observed count: all s whose acceptance region contains it
+      nobs = np.arange(self.nmax+1)[:,None]
+      inside = (self.n1[None,:] <= nobs) & (self.n2[None,:] >= nobs) # (nobs, ns)
+      self.lower = self.s[np.argmax(inside,axis=1)]
+      self.upper = self.s[len(self.s) - 1 - np.argmax(inside[:,::-1],axis=1)]
+
+   def critical_count(self,s):
+      # Smallest observed count in the acceptance region of signal s, i.e. observing fewer
+      # events than this excludes s (at this CL)
+      i = np.clip(np.round(np.asarray(s)/self.ds).astype(int),0,len(self.s)-1)
+      return self.n1[i]
+
+   def interval(self,n_obs):
+      # (lower, upper) limits for any array of observed counts (<= nmax)
+      n_obs = np.asarray(n_obs,dtype=int)
+      if np.any(n_obs > self.nmax) or np.any(n_obs < 0):
+         raise ValueError("Observed counts must lie in [0,{0}] for this table".format(self.nmax))
+      return self.lower[n_obs], self.upper[n_obs]
+
+# In-memory cache of belt tables, keyed by (b,CL,ds), least recently used evicted first
+cache_size = 32
+_cache = OrderedDict()
+
+def get_table(b=0.,CL=0.9,nmax=50,ds=0.005):
+   key = (float(b),float(CL),float(ds))
+   table = _cache.pop(key,None)
+   if table is None or table.nmax < nmax:
+      table = BeltTable(b,CL,max(nmax,table.nmax if table is not None else 0),ds)
+      if len(_cache) >= cache_size:
+         _cache.popitem(last=False)
+   _cache[key] = table # (re)insert as most recently used
+   return table
+
+def upper_limits(n_obs,b=0.,CL=0.9,method="FC",ds=0.005):
+   # Upper limits on the signal mean for any arrays of observed counts and backgrounds
+   # (broadcast against each other)
+   if method=="poisson":
+      return poisson_upper(n_obs,b,CL)
+   elif method!="FC":
+      raise ValueError("Unknown method '{0}'! Should be 'FC' or 'poisson'".format(method))
+   n_obs, b = np.broadcast_arrays(np.asarray(n_obs,dtype=int),np.asarray(b,dtype=float))
+   nmax = int(np.max(n_obs)) if n_obs.size else 0
+   out = np.empty(n_obs.shape)
+   # one table lookup per distinct background value
+   for bval in np.unique(b):
+      sel = (b==bval)
+      out[sel] = get_table(bval,CL,nmax,ds).upper[n_obs[sel]]
+   return out
+
+def coupling_limits(counts,n_obs,b=0.,CL=0.9,method="FC",ds=0.005):
+   # Upper limits on a coupling c for signals of counts*c^2 expected events, given observed
+   # counts and backgrounds; all arguments are broadcast, e.g. counts (operator, mass, window)
+   # against n_obs (nobs, 1, 1, 1) gives (nobs, operator, mass, window) limits
+   s_up = upper_limits(n_obs,b,CL,method,ds)
+   with np.errstate(divide="ignore"):
+      return np.sqrt(s_up/np.asarray(counts,dtype=float))
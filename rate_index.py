@@ -0,0 +1,79 @@
+""" Cumulative-rate index for tabulated recoil spectra
+
+    Stores the running integral of dR/dE along the recoil energy axis, so
+    that the expected number of events in any window [E1,E2] is found from
+    two lookups, independent of the length of the energy grid. dR/dE is
+    treated as piecewise linear between grid points (i.e. the integral is
+    the trapezoid rule), and the window edges are interpolated exactly
+    within their grid cells.
+
+    Works for any increasing energy grid; for evenly spaced grids (e.g. the
+    0.05 keV lowE and 0.5 keV highE grids of recoil_generator.m, or the old
+    1 keV tables) the cell lookup is pure arithmetic rather than a search.
+"""
+
+import numpy as np
+
+class CumulativeRate(object):
+
+   def __init__(self,energies,rates):
+      # energies: (nE,) increasing recoil energies in keV
+      # rates: (..., nE) array of dR/dE in (keV)^-1, e.g. (mass, energy)
+      self.energies = np.asarray(energies,dtype=float)
+      self.rates    = np.asarray(rates,dtype=float)
+      if self.energies.ndim!=1 or self.energies.shape[0]<2 or self.rates.shape[-1]!=self.energies.shape[0]:
+         raise ValueError("Need at least two recoil energies, matching the last axis of the rates array (got {0} and {1})".format(self.energies.shape,self.rates.shape))
+      self.widths = np.diff(self.energies)
+      if np.any(self.widths<=0):
+         raise ValueError("Recoil energies must be strictly increasing!")
+
+      # Running integral, cum[...,i] = integral of dR/dE from energies[0] to energies[i]
+      cells = 0.5*self.widths*(self.rates[...,1:] + self.rates[...,:-1])
+      self.cum = np.concatenate((np.zeros(self.rates.shape[:-1]+(1,)),np.cumsum(cells,axis=-1)),axis=-1)
+
+      # Even grids get O(1) cell lookup
+      self.step = self.widths[0]
+      self.uniform = np.allclose(self.widths,self.step,rtol=1e-6,atol=0)
+
+   def row(self,i):
+      # Index for the spectra rates[i] alone (e.g. one mass), sharing this index's arrays,
+      # so that scalar queries do not evaluate every other spectrum
+      sub = object.__new__(CumulativeRate)
+      sub.__dict__.update(self.__dict__)
+      sub.rates, sub.cum = self.rates[i], self.cum[i]
+      return sub
+
+   def _cell(self,E):
+      # Index of grid cell containing each energy (energies already clipped to the grid)
+      n = self.energies.shape[0]
+      if self.uniform:
+         i = np.floor((E - self.energies[0])/self.step).astype(int)
+      else:
+         i = np.searchsorted(self.energies,E,side="right") - 1
+      return np.clip(i,0,n-2)
+
+   def integral(self,E):
+      # Integral of dR/dE from the start of the grid up to energy/energies E.
+      # Energies outside the grid are clipped to its ends.
+      # Returns array of shape rates.shape[:-1] + np.shape(E)
+      E  = np.clip(np.asarray(E,dtype=float),self.energies[0],self.energies[-1])
+      i  = self._cell(E)
+      t  = E - self.energies[i]
+      h  = self.widths[i]
+      r0 = self.rates[...,i]
+      r1 = self.rates[...,i+1]
+      return self.cum[...,i] + r0*t + (r1-r0)*t**2/(2*h)
+
+   def counts(self,E1,E2):
+      # Expected number of events with E1 <= ER <= E2 (E1, E2 scalars or broadcastable arrays)
+      # Returns array of shape rates.shape[:-1] + broadcast shape of (E1,E2)
+      E1, E2 = np.broadcast_arrays(np.asarray(E1,dtype=float),np.asarray(E2,dtype=float))
+      return self.integral(E2) - self.integral(E1)
+
+   def window_counts(self,windows):
+      # Counts for a list of (Emin,Emax) windows; returns shape rates.shape[:-1] + (len(windows),)
+      windows = np.asarray(windows,dtype=float).reshape(-1,2)
+      return self.counts(windows[:,0],windows[:,1])
+
+   def total(self):
+      return self.cum[...,-1]
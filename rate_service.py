@@ -0,0 +1,216 @@
+""" Fast queries of expected event numbers and required couplings
+
+    Event numbers are linear in exposure and depend on the spectrum only
+    through its integral over the energy window, so a RateTable built once
+    from a SpectrumArchive (cumulative-rate indices for every requested
+    isotope/mix, operator and isospin combination, plus the counts in a set
+    of standard windows) answers
+       "expected events / coupling needed for N events, for (isotope mix,
+        operator, mass, window, exposure)"
+    with a couple of array lookups, without reloading or re-normalising any
+    spectra. Standard windows are pure table lookups; any other window costs
+    two interpolations in the cumulative index of that one spectrum.
+
+    Counts follow the convention of create_coupling_table.py: trapezoid
+    integrals of dR/dE over the window (cumulative-rate index, independent
+    of the energy grid), after the table's resolution model and efficiency
+    curve. The command-line service applies the same default acceptance as
+    the coupling tables (acceptance.default), so both give the same couplings.
+
+    serve() exposes a warmed RateTable over a small local HTTP endpoint
+    returning JSON, so several sessions can share one instance, e.g.
+       python rate_service.py <archive> [--port 8765] [--efficiency 0.5] [--resolution a,b,c]
+       RateClient("http://127.0.0.1:8765").coupling(iso="Comb",op=1,mass=100,E1=8,E2=30,exposure=7650)
+"""
+
+import json
+import numpy as np
+
+try:
+   from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+   from urlparse import urlparse, parse_qs
+   from urllib import urlencode
+   from urllib2 import urlopen, HTTPError
+except ImportError: # python 3
+   from http.server import BaseHTTPRequestHandler, HTTPServer
+   from urllib.parse import urlparse, parse_qs, urlencode
+   from urllib.request import urlopen
+   from urllib.error import HTTPError
+
+from normalise_spectra import orig_exposure
+
+class RateTable(object):
+
+   def __init__(self,spectra,isos,ops=None,combs=["p=n"],windows=[(8,30),(8,240),(8,1000)],
+                resolution=None,efficiency=None):
+      # spectra: SpectrumArchive (mixes to be queried must already be registered with add_mix)
+      # isos: isotopes/mixes to load; ops: operators (default all in the archive); combs: isospin combinations
+      # windows: (Emin,Emax) windows whose counts are precomputed for every mass
+      # resolution, efficiency: detector response applied to the spectra (see SpectrumArchive.rates)
+      self.spectra = spectra
+      self.resolution, self.efficiency = resolution, efficiency
+      self.masses  = np.asarray(spectra.masses,dtype=float)
+      self.windows = [(float(E1),float(E2)) for E1,E2 in windows]
+      self._mpos = dict((m,i) for i,m in enumerate(self.masses))
+      self._wpos = dict((w,i) for i,w in enumerate(self.windows))
+      self._indices = {} # (iso, op, comb) -> CumulativeRate over all masses
+      self._windows = {} # (iso, op, comb) -> (mass, window) counts in the standard windows
+      self._rows    = {} # (iso, op, comb, mass index) -> CumulativeRate for one mass
+      for iso in isos:
+         for op in (spectra.operators if ops is None else ops):
+            for comb in combs:
+               try:
+                  index = spectra.index(iso,op,comb,resolution,efficiency)
+               except KeyError: # spectra not stored for this combination
+                  continue
+               key = (str(iso),int(op),comb)
+               self._indices[key] = index
+               self._windows[key] = index.window_counts(self.windows) if self.windows else None
+
+   def keys(self):
+      # Loaded (isotope, operator, comb) combinations
+      return sorted(self._indices.keys(),key=str)
+
+   def _key(self,iso,op,comb):
+      key = (str(iso),int(op),comb)
+      if key not in self._indices:
+         raise KeyError("No spectra loaded for iso={0}, op={1}, comb={2}".format(iso,op,comb))
+      return key
+
+   def _mass(self,mass):
+      i = self._mpos.get(float(mass))
+      if i is None:
+         raise KeyError("WIMP mass {0} GeV not tabulated; available: {1}".format(mass,self.masses))
+      return i
+
+   def counts(self,iso,op,mass,E1,E2,comb="p=n"):
+      # Expected events with E1 <= ER <= E2, for the original exposure and unit coupling: integral of
+      # dR/dE (after the table's resolution and efficiency) from the cumulative-rate index
+      key = self._key(iso,op,comb)
+      m   = self._mass(mass)
+      w   = self._wpos.get((float(E1),float(E2)))
+      if w is not None:
+         return float(self._windows[key][m,w])
+      row = self._rows.get(key+(m,))
+      if row is None:
+         row = self._rows[key+(m,)] = self._indices[key].row(m)
+      return float(row.counts(E1,E2))
+
+   def events(self,iso,op,mass,E1,E2,exposure,c=1.,comb="p=n"):
+      # Expected events in [E1,E2] for an exposure in kg.days and coupling c
+      return c**2 * float(exposure)/orig_exposure * self.counts(iso,op,mass,E1,E2,comb)
+
+   def coupling(self,iso,op,mass,E1,E2,exposure,N=5.,comb="p=n"):
+      # Coupling giving N expected events in [E1,E2] for an exposure in kg.days (inf if no events).
+      # Same convention as create_coupling_table.py (normalise_spectra.couplings_from_counts) for
+      # the same resolution model and efficiency curve
+      n = self.events(iso,op,mass,E1,E2,exposure,1.,comb)
+      return float(np.sqrt(N/n)) if n > 0 else float("inf")
+
+   def info(self):
+      return {"keys":[list(k) for k in self.keys()], "masses":list(self.masses), "windows":self.windows,
+              "efficiency":None if self.efficiency is None else str(self.efficiency.name or self.efficiency.key),
+              "resolution":None if self.resolution is None else list(self.resolution.key[:3])}
+
+# Query arguments of the HTTP endpoint and their types
+_args = {"iso":str, "op":int, "mass":float, "E1":float, "E2":float, "exposure":float,
+         "c":float, "N":float, "comb":str}
+
+def handler(table):
+   # Request handler class answering GET /events, /coupling and /info from 'table'
+   class RateHandler(BaseHTTPRequestHandler):
+
+      def do_GET(self):
+         url = urlparse(self.path)
+         try:
+            query = dict((k,_args[k](v[0])) for k,v in parse_qs(url.query).items() if k in _args)
+            if url.path=="/events":
+               query.pop("N",None)
+               result = {"events":table.events(**query)}
+            elif url.path=="/coupling":
+               query.pop("c",None)
+               result = {"coupling":table.coupling(**query)}
+            elif url.path=="/info":
+               result = table.info()
+            else:
+               self._reply(404,{"error":"Unknown query '{0}'; use /events, /coupling or /info".format(url.path)})
+               return
+         except (KeyError,TypeError,ValueError) as e:
+            self._reply(400,{"error":str(e)})
+            return
+         self._reply(200,result)
+
+      def _reply(self,code,result):
+         body = json.dumps(result).encode("utf-8")
+         self.send_response(code)
+         self.send_header("Content-Type","application/json")
+         self.send_header("Content-Length",str(len(body)))
+         self.end_headers()
+         self.wfile.write(body)
+
+      def log_message(self,*args):
+         pass # keep the console quiet; queries are frequent
+
+   return RateHandler
+
+def serve(table,host="127.0.0.1",port=8765):
+   # Serve queries on a RateTable until interrupted (local connections only by default)
+   server = HTTPServer((host,port),handler(table))
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      pass
+   finally:
+      server.server_close()
+
+class RateClient(object):
+   """ Same queries as RateTable.events/coupling/info, answered by a running serve() """
+
+   def __init__(self,url="http://127.0.0.1:8765"):
+      self.url = url.rstrip("/")
+
+   def _get(self,path,**query):
+      try:
+         return json.loads(urlopen("{0}/{1}?{2}".format(self.url,path,urlencode(query))).read().decode("utf-8"))
+      except HTTPError as e:
+         raise ValueError(json.loads(e.read().decode("utf-8"))["error"])
+
+   def events(self,**query):
+      return self._get("events",**query)["events"]
+
+   def coupling(self,**query):
+      return self._get("coupling",**query)["coupling"]
+
+   def info(self):
+      return self._get("info")
+
+if __name__=="__main__":
+   # natural xenon available as iso=Comb
+   import argparse
+   import spectrum_store as ss
+   import acceptance
+   from resolution import Resolution
+   parser = argparse.ArgumentParser(description="Serve expected events and couplings for a spectrum archive")
+   parser.add_argument("archive")
+   parser.add_argument("--port",type=int,default=8765)
+   parser.add_argument("--efficiency",default=None,
+                       help="flat efficiency (e.g. 0.5), 'none', or a two-column (keV, efficiency) file "
+                            "(default: acceptance.default, as in create_coupling_table.py)")
+   parser.add_argument("--resolution",default=None,help="a,b,c of resolution.Resolution (default: none)")
+   args = parser.parse_args()
+   if args.efficiency is None:
+      efficiency = acceptance.default
+   elif args.efficiency.lower()=="none":
+      efficiency = None
+   else:
+      try:
+         efficiency = acceptance.flat(float(args.efficiency))
+      except ValueError:
+         efficiency = acceptance.Efficiency.load(args.efficiency)
+   resolution = None if args.resolution is None else Resolution(*[float(x) for x in args.resolution.split(",")])
+   spectra = ss.SpectrumArchive(args.archive)
+   spectra.add_mix("Comb")
+   table = RateTable(spectra,[str(iso) for iso in spectra.isotopes]+["Comb"],combs=spectra.combs,
+                     resolution=resolution,efficiency=efficiency)
+   print("Serving {0} spectrum sets on http://127.0.0.1:{1}".format(len(table.keys()),args.port))
+   serve(table,port=args.port)
@@ -0,0 +1,299 @@
+""" Native numpy recoil-rate engine for the non-relativistic EFT operators
+
+    Computes dR/dE for the 15 NR operators O_i (coefficients c_i^p, c_i^n, in
+    units of 1/m_V^2 with m_V=246.2 GeV as in DMFormFactor) for whole
+    (WIMP mass x recoil energy) grids at once, replacing the symbolic
+    evaluation in recoil_generator.m. Uses the same parameters and output
+    units as recoil_generator.m: events per keV for the benchmark exposure
+    of 7800 kg.days, rhoDM=0.3 GeV/cm^3 and the MBcutoff halo.
+
+    The rate follows Fitzpatrick et. al. (1203.3542) / Anand et. al. (1308.6288):
+
+      dsigma/dER = 2 mT / ((2J+1) v^2) * sum_{tau,tau'} sum_X R_X^{tau tau'}(v_perp^2, q^2/mN^2) W_X^{tau tau'}(q)
+
+    with R_X the WIMP response functions (bilinear in the couplings, in the
+    isospin basis c^0=(c^p+c^n)/2, c^1=(c^p-c^n)/2) and W_X the nuclear
+    response functions. The nuclear responses are read from tables (see
+    NuclearResponse); a traditional Helm form factor response (W_M only) is
+    built in for the "UseHelm" case.
+"""
+
+import os
+import sys
+import numpy as np
+
+import halo
+import spectrum_store as ss
+
+# Physical constants and benchmark parameters (as in recoil_generator.m)
+mNucleon = 0.938           # GeV
+mV       = 246.2           # GeV, scale of the dimensionless EFT coefficients
+rhoDM    = 0.3             # GeV/cm^3
+Z_Xe     = 54
+hbarc_fm = 0.1973269804    # GeV.fm
+hbarc_cm = 1.973269804e-14 # GeV.cm
+c_cms    = 2.99792458e10   # cm/s
+GeV_kg   = 1.78266192e-27  # kg per GeV
+day      = 86400.          # s
+benchmark_exposure = 7800. # kg.days
+
+isotopes = [128,129,130,131,132,134,136]
+nuclear_spin = {128:0., 129:0.5, 130:0., 131:1.5, 132:0., 134:0., 136:0.}
+
+# WIMP masses and recoil energy grids used by recoil_generator.m
+masses = np.array([5,6,7,8,9,10,16,20,30,40,50,70,100,300,500,800,1000,3000,5000,8000,10000])
+Earrs  = {"lowE"  : 0.05*np.arange(1,2001), # keV
+          "highE" : 0.5 *np.arange(1,2001)}
+
+# Nuclear response functions, in the order they are stored in NuclearResponse tables
+responses = ["M","Sigma2","Sigma1","Phi2","Phi2M","Phit1","Delta","DeltaSigma1"]
+
+# Expansion of the WIMP response functions R_X into single coupling products:
+#  (X, a, b, factor, jpow, Qpow, vperp)
+# contributes  factor * (jchi(jchi+1))^jpow * (q^2/mN^2)^Qpow * [v_perp^2 if vperp] * c_a^tau c_b^tau' W_X^{tau tau'}
+# The extra q^2/mN^2 multiplying the Phi'', Phi''M, Phi~', Delta and Delta-Sigma' responses is included in Qpow.
+terms = [
+   ("M",           1, 1, 1.,     0,0,0),
+   ("M",           5, 5, 1./3,   1,1,1),
+   ("M",           8, 8, 1./3,   1,0,1),
+   ("M",          11,11, 1./3,   1,1,0),
+   ("Phi2",        3, 3, 1./4,   0,2,0),
+   ("Phi2",       12,12, 1./12,  1,1,0),
+   ("Phi2",       12,15,-1./12,  1,2,0),
+   ("Phi2",       15,12,-1./12,  1,2,0),
+   ("Phi2",       15,15, 1./12,  1,3,0),
+   ("Phi2M",       3, 1, 1.,     0,1,0),
+   ("Phi2M",      12,11, 1./3,   1,1,0),
+   ("Phi2M",      15,11,-1./3,   1,2,0),
+   ("Phit1",      12,12, 1./12,  1,1,0),
+   ("Phit1",      13,13, 1./12,  1,2,0),
+   ("Sigma2",     10,10, 1./4,   0,1,0),
+   ("Sigma2",      4, 4, 1./12,  1,0,0),
+   ("Sigma2",      4, 6, 1./12,  1,1,0),
+   ("Sigma2",      6, 4, 1./12,  1,1,0),
+   ("Sigma2",      6, 6, 1./12,  1,2,0),
+   ("Sigma2",     12,12, 1./12,  1,0,1),
+   ("Sigma2",     13,13, 1./12,  1,1,1),
+   ("Sigma1",      3, 3, 1./8,   0,1,1),
+   ("Sigma1",      7, 7, 1./8,   0,0,1),
+   ("Sigma1",      4, 4, 1./12,  1,0,0),
+   ("Sigma1",      9, 9, 1./12,  1,1,0),
+   ("Sigma1",     12,12, 1./24,  1,0,1),
+   ("Sigma1",     12,15,-1./24,  1,1,1),
+   ("Sigma1",     15,12,-1./24,  1,1,1),
+   ("Sigma1",     15,15, 1./24,  1,2,1),
+   ("Sigma1",     14,14, 1./24,  1,1,1),
+   ("Delta",       5, 5, 1./3,   1,2,0),
+   ("Delta",       8, 8, 1./3,   1,1,0),
+   ("DeltaSigma1", 5, 4, 1./3,   1,1,0),
+   ("DeltaSigma1", 8, 9,-1./3,   1,1,0),
+]
+
+def oscillator_b(A):
+   # Harmonic oscillator parameter in fm (default DMFormFactor approximation)
+   return np.sqrt(41.467/(45.*A**(-1./3) - 25.*A**(-2./3)))
+
+def helm_ff(q,A):
+   # Lewin-Smith Helm form factor, q in GeV
+   qfm = np.asarray(q,dtype=float)/hbarc_fm
+   s = 0.9
+   a = 0.52
+   c = 1.23*A**(1./3) - 0.6
+   rn = np.sqrt(c**2 + 7./3*np.pi**2*a**2 - 5*s**2)
+   qr = np.maximum(qfm*rn,1e-8)
+   j1 = (np.sin(qr) - qr*np.cos(qr))/qr**2
+   return 3*j1/qr*np.exp(-(qfm*s)**2/2)
+
+class NuclearResponse(object):
+   """ Tabulated nuclear response functions W_X^{tau tau'}(q) for one isotope
+
+       Table files are .npz archives with entries
+         A, Z, J : mass number, atomic number, nuclear spin
+         q       : (nq,) momentum transfer grid in GeV
+         W       : (8,2,2,nq) responses, in the order of recoil_rates.responses,
+                   normalised as in DMFormFactor (e.g. W_M^{00}(0) = (2J+1) A^2/(4 pi))
+       They are fitted to DMFormFactor output for its default density matrices by response_tables.py.
+   """
+
+   def __init__(self,A,Z,J,q,W):
+      self.A = A
+      self.Z = Z
+      self.J = J
+      self.q = np.asarray(q,dtype=float)
+      self.W = np.asarray(W,dtype=float)
+      if self.W.shape != (len(responses),2,2,len(self.q)):
+         raise ValueError("Nuclear response table should have shape {0}, not {1}".format((len(responses),2,2,len(self.q)),self.W.shape))
+
+   @classmethod
+   def load(cls,fname):
+      d = np.load(fname)
+      return cls(int(d["A"]),int(d["Z"]),float(d["J"]),d["q"],d["W"])
+
+   def save(self,fname):
+      np.savez(fname,A=self.A,Z=self.Z,J=self.J,q=self.q,W=self.W)
+
+   @classmethod
+   def helm(cls,A,Z=Z_Xe,J=None,q=np.linspace(0,1,2001)):
+      # "Traditional" Helm form factor treatment: coherent M response only
+      if J is None:
+         J = nuclear_spin[A]
+      iso = np.array([A,2*Z-A],dtype=float) # sum over nucleons of isospin operators 1 and tau_3
+      W = np.zeros((len(responses),2,2,len(q)))
+      W[0] = (2*J+1)/(4*np.pi) * iso[:,None,None]*iso[None,:,None] * helm_ff(q,A)**2
+      return cls(A,Z,J,q,W)
+
+   def __call__(self,q):
+      # Responses at momentum transfer(s) q (GeV); shape (8,2,2)+q.shape. Zero beyond the table.
+      q = np.asarray(q,dtype=float)
+      i = np.clip(np.searchsorted(self.q,q,side="right")-1,0,len(self.q)-2)
+      w = np.clip((q - self.q[i])/(self.q[i+1]-self.q[i]),0,1)
+      W = self.W[...,i]*(1-w) + self.W[...,i+1]*w
+      return np.where(q<=self.q[-1],W,0.)
+
+def get_response(A,helm=False,path="nuclear_responses"):
+   # Nuclear responses for xenon isotope A, either Helm or from path/Xe{A}.npz
+   if helm:
+      return NuclearResponse.helm(A)
+   fname = os.path.join(path,"Xe{0}.npz".format(A))
+   if not os.path.exists(fname):
+      raise IOError("Nuclear response table {0} not found! Produce it with export_responses.m and "
+                    "response_tables.py (see response_tables.py), or use helm=True.".format(fname))
+   return NuclearResponse.load(fname)
+
+def couplings(op,comb="p=n",Nops=15):
+   # (cp,cn) coefficient arrays (index = operator number, entry 0 unused) for a single operator
+   cp = np.zeros(Nops+1)
+   cn = np.zeros(Nops+1)
+   if comb in ("p","p=n"): cp[op] = 1
+   if comb in ("n","p=n"): cn[op] = 1
+   return cp, cn
+
+def kinematics(A,mchi,ER,delm=0.):
+   # Momentum transfer q (GeV) and minimum WIMP speed vmin (km/s) for recoil energies ER (keV)
+   # on WIMP masses mchi (GeV). delm is the inelastic mass splitting in keV.
+   mT = A*mNucleon
+   ER = np.asarray(ER,dtype=float)*1e-6
+   mu = mchi*mT/(mchi+mT)
+   q  = np.sqrt(2*mT*ER)
+   vmin = (q/(2*mu) + delm*1e-6/q) * halo.c_kms
+   return q, vmin
+
+# Change of basis for the nuclear responses, from isospin (tau) to proton/neutron (N):
+# c^tau = sum_N U[tau,N] c^N
+U_iso = np.array([[0.5, 0.5],
+                  [0.5,-0.5]])
+
+class RateBasis(object):
+   """ Factorisation of dR/dE for one isotope into coupling-independent basis spectra
+
+       dR/dE is bilinear in the coefficients, so for each (term, N, N') with N,N' in (p,n)
+       the product of the kinematic factors, halo integral and nuclear response
+       W_X^{NN'}(q) is computed once, over the whole (mass, energy) grid. The spectrum
+       for any set of coefficients is then
+
+          dR/dE = sum_k C_k(cp,cn) B_k(mass,E),   C_k = c_a^N c_b^N'
+
+       i.e. a single dense matrix product for any number of coupling sets.
+   """
+
+   def __init__(self,response,mchi=masses,ER=Earrs["lowE"],delm=0.,ve=halo.ve_default,v0=halo.v0_default,
+                vesc=halo.vesc_default,exposure=benchmark_exposure,jchi=0.5):
+      # response: NuclearResponse for the target isotope
+      # mchi: (nm,) WIMP masses in GeV
+      # ER: (nE,) recoil energies in keV
+      # delm: inelastic mass splitting in keV
+      # exposure: in kg.days; spectra are in events/keV
+      self.response = response
+      self.exposure = exposure
+      self.mchi = np.asarray(mchi,dtype=float)
+      self.ER   = np.asarray(ER,dtype=float)
+      mchi = self.mchi.reshape(-1,1)
+      q, vmin = kinematics(response.A,mchi,self.ER.reshape(1,-1),delm)
+      eta, xi = halo.halo_integrals(vmin,ve,v0,vesc)
+      # Halo integrals in natural units (speeds in units of c)
+      eta   = eta*halo.c_kms
+      vperp = xi/halo.c_kms - (vmin/halo.c_kms)**2*eta # int f/v (v^2 - vmin^2)
+
+      # Nuclear responses in the proton/neutron basis, evaluated once on the q grid
+      # (q does not depend on the WIMP mass)
+      W  = np.einsum("tN,uM,xtue->xNMe",U_iso,U_iso,response(q[0]))
+      Q  = q**2/mNucleon**2
+      jf = jchi*(jchi+1)
+
+      mT = response.A*mNucleon
+      K = (2*mT/(2*response.J+1)) * hbarc_cm**2 * c_cms * rhoDM/mchi / (mT*GeV_kg) # per (kg s GeV)
+      K = K * day * exposure * 1e-6 / mV**4 # events/keV, coefficients in units of 1/mV^2
+
+      # Keep only basis spectra whose nuclear response is not identically zero
+      self.index = [] # (a, N, b, N') for each basis spectrum
+      parts = []      # basis spectra without their halo integral
+      vps   = []      # whether each basis spectrum takes the v_perp^2 integral rather than eta
+      for X,a,b,factor,jpow,Qpow,vp in terms:
+         WX = W[responses.index(X)]
+         kin = K * factor * jf**jpow * Q**Qpow
+         for N in range(2):
+            for M in range(2):
+               if np.any(WX[N,M]!=0):
+                  self.index += [(a,N,b,M)]
+                  parts += [kin*WX[N,M]]
+                  vps   += [vp]
+      # Factorised form (used by halo_reweight to swap in other halos): B = A * (vperp if vp else eta)
+      self.vmin = vmin
+      self.vp = np.array(vps,dtype=bool)
+      self.A  = np.array(parts).reshape(len(parts),-1) # (nbasis, nm*nE)
+      self.B  = self.A * np.where(self.vp[:,None],vperp.reshape(1,-1),eta.reshape(1,-1))
+      self.shape = (len(self.mchi),len(self.ER))
+      idx = np.array(self.index,dtype=int).reshape(-1,4)
+      self._a, self._N, self._b, self._M = idx.T
+
+   def coefficients(self,cp,cn):
+      # (nsets,nbasis) coefficient matrix for arrays of cp, cn of shape (nsets,Nops+1) (or (Nops+1,))
+      c = np.stack((np.atleast_2d(cp),np.atleast_2d(cn)),axis=1).astype(float) # (nsets, N, operator)
+      return c[:,self._N,self._a] * c[:,self._M,self._b]
+
+   def spectra(self,cp,cn):
+      # dR/dE for one or more coefficient sets; shape (nsets,nm,nE)
+      C = self.coefficients(cp,cn)
+      return np.dot(C,self.B).reshape((C.shape[0],)+self.shape)
+
+   def operator_spectra(self,ops=range(1,16),combs=["p=n"]):
+      # (operator, comb, mass, energy) spectra for single-operator couplings
+      cs = [couplings(op,comb) for op in ops for comb in combs]
+      cp = np.array([c[0] for c in cs])
+      cn = np.array([c[1] for c in cs])
+      return self.spectra(cp,cn).reshape((len(ops),len(combs))+self.shape)
+
+def dRdE(response,cp,cn,mchi,ER,**kwargs):
+   # response: NuclearResponse for the target isotope
+   # cp, cn: arrays of proton/neutron coefficients indexed by operator number (entry 0 unused)
+   # mchi: (nm,) WIMP masses in GeV
+   # ER: (nE,) recoil energies in keV
+   # kwargs: delm, ve, v0, vesc, exposure, jchi (see RateBasis)
+   # Returns (nm,nE) array of dR/dE in events/keV for the given exposure (kg.days)
+   return RateBasis(response,mchi,ER,**kwargs).spectra(cp,cn)[0]
+
+def generate_spectra(A,ops=range(1,16),combs=["p=n"],mchi=masses,ER=Earrs["lowE"],helm=False,**kwargs):
+   # (operator, comb, mass, energy) array of spectra for one isotope. kwargs are passed on to RateBasis.
+   return RateBasis(get_response(A,helm),mchi,ER,**kwargs).operator_spectra(ops,combs)
+
+def write_archive(outfile,isos=isotopes,ops=range(1,16),combs=["p=n"],mchi=masses,ER=Earrs["lowE"],helm=False,**kwargs):
+   # Generate spectra for several isotopes straight into a SpectrumArchive file
+   cube = np.array([generate_spectra(A,ops,combs,mchi,ER,helm,**kwargs) for A in isos])
+   halo_params = (kwargs.get("ve",halo.ve_default),kwargs.get("v0",halo.v0_default),kwargs.get("vesc",halo.vesc_default))
+   ss.write_archive(outfile,cube,isos,list(ops),combs,mchi,ER,halo_params=halo_params)
+   return outfile
+
+if __name__=="__main__":
+   # Usage: python recoil_rates.py <outpath> [UseHelm]
+   # Writes Xe_<Tag>_<lowE|highE>_spectra.bin archives for all isotopes, in the same
+   # units and for the same masses/energies as recoil_generator.m
+   if len(sys.argv) < 2:
+      print("Usage: python recoil_rates.py <outpath> [UseHelm]")
+      sys.exit(1)
+   helm = len(sys.argv) > 2 and sys.argv[2]=="UseHelm"
+   halo.cache_dir = os.path.join(sys.argv[1],"halo_tables")
+   Tag = "NR_HelmFF" if helm else "NR"
+   for SRtag in ["lowE","highE"]:
+      fname = os.path.join(sys.argv[1],"Xe_{0}_{1}_spectra.bin".format(Tag,SRtag))
+      print("Writing {0}".format(fname))
+      write_archive(fname,combs=ss.COMBS,ER=Earrs[SRtag],helm=helm)
@@ -0,0 +1,138 @@
+""" Spectra for the 20 relativistic operators, composed from the NR interference tables
+
+    Each relativistic operator j (coefficients d_j^p, d_j^n, dimensionless
+    with the scale mM = 246.2 GeV as in DMFormFactor) reduces to a set of NR
+    operators with coefficients depending on q^2 and the WIMP mass; these are
+    the 'reductionrules' of recoil_generator.m (table 1 of the DMFormFactor
+    documentation), applied separately for protons and neutrons:
+       c_i^N(q^2, mX) = sum_j T_ij(q^2, mX) d_j^N
+    Since dR/dE = c^T M c (interference.py), the rate is again a quadratic
+    form, in the 40-component vector d = (d1p, d1n, ..., d20p, d20n):
+       dR/dE(mass,E) = d^T (T^T M T)(mass,E) d
+    compose() builds this relativistic interference table from an NR one in
+    one pass over the (few) non-zero entries of T and M, for all masses and
+    energies at once. Spectra for all 20 operators, or any combination of
+    d_j, are then single matrix products, with no further Mathematica runs.
+"""
+
+import os
+import sys
+import numpy as np
+
+import interference as itf
+import recoil_rates as rr
+import spectrum_store as ss
+
+mM = rr.mV       # GeV, scale of the dimensionless d_j (SetMM default)
+mN = rr.mNucleon # GeV
+Nrel = 20
+Nrelcoeffs = 2*Nrel
+
+# reductionrules of recoil_generator.m: relativistic operator -> [(NR operator, coefficient(q2,mX,mM))]
+# with q2 = q^2 in GeV^2 and mX the WIMP mass in GeV
+reductions = {
+    1: [(1,  lambda q2,mX,mM: 1.)],
+    2: [(10, lambda q2,mX,mM: 1.)],
+    3: [(11, lambda q2,mX,mM: -mN/mX)],
+    4: [(6,  lambda q2,mX,mM: -mN/mX)],
+    5: [(1,  lambda q2,mX,mM: 1.)],
+    6: [(1,  lambda q2,mX,mM: q2/(2*mN*mM)),
+        (3,  lambda q2,mX,mM: -2*mN/mM),
+        (4,  lambda q2,mX,mM: 2*mN**2/(mM*mX) * q2/mN**2),
+        (6,  lambda q2,mX,mM: -2*mN**2/(mM*mX))],
+    7: [(7,  lambda q2,mX,mM: -2.),
+        (9,  lambda q2,mX,mM: 2*mN/mX)],
+    8: [(10, lambda q2,mX,mM: 2*mN/mM)],
+    9: [(1,  lambda q2,mX,mM: -q2/(2*mX*mM)),
+        (5,  lambda q2,mX,mM: 2*mN/mM),
+        (4,  lambda q2,mX,mM: -2*mN/mM * q2/mN**2),
+        (6,  lambda q2,mX,mM: 2*mN/mM)],
+    10: [(4, lambda q2,mX,mM: 4*q2/mM**2),
+         (6, lambda q2,mX,mM: -mN**2/mM**2)],
+    11: [(9, lambda q2,mX,mM: 4*mN/mM)],
+    12: [(10,lambda q2,mX,mM: -mN/mX * q2/mM**2),
+         (12,lambda q2,mX,mM: -4*q2/mM**2),
+         (15,lambda q2,mX,mM: -4*mN**2/mM**2)],
+    13: [(8, lambda q2,mX,mM: 2.),
+         (9, lambda q2,mX,mM: 2.)],
+    14: [(9, lambda q2,mX,mM: -4*mN/mM)],
+    15: [(4, lambda q2,mX,mM: -4.)],
+    16: [(13,lambda q2,mX,mM: 4*mN/mM)],
+    17: [(11,lambda q2,mX,mM: 2*mN/mM)],
+    18: [(11,lambda q2,mX,mM: q2/mM**2),
+         (15,lambda q2,mX,mM: 4*mN**2/mM**2)],
+    19: [(14,lambda q2,mX,mM: -4*mN/mM)],
+    20: [(6, lambda q2,mX,mM: 4*mN**2/mM**2)],
+}
+
+def rel_index(op,N):
+   # Position of coefficient d_op^N (N=0 proton, 1 neutron) in the 40-component vector
+   return 2*(op-1) + N
+
+def to_vector(dp,dn):
+   # Convert (...,Nrel+1) dp, dn arrays indexed by operator number (entry 0 unused) to (...,40) vectors
+   dp = np.asarray(dp,dtype=float)
+   dn = np.asarray(dn,dtype=float)
+   return np.stack((dp[...,1:Nrel+1],dn[...,1:Nrel+1]),axis=-1).reshape(dp.shape[:-1]+(Nrelcoeffs,))
+
+def reduction_matrix(A,masses,energies,mM=mM):
+   # Non-zero entries of T: {40-vector index j: [(30-vector index i, (nm,nE) coefficient)]}
+   mT = int(A)*mN
+   q2 = 2*mT*np.asarray(energies,dtype=float)[None,:]*1e-6 # GeV^2
+   mX = np.asarray(masses,dtype=float)[:,None]
+   shape = (mX.shape[0],q2.shape[1])
+   T = {}
+   for op,rules in reductions.items():
+      for N in range(2):
+         T[rel_index(op,N)] = [(itf.coeff_index(i,N),np.broadcast_to(f(q2,mX,mM),shape)) for i,f in rules]
+   return T
+
+def compose(table,mM=mM):
+   # Relativistic InterferenceTable (40-component couplings d) from an NR InterferenceTable
+   M = {} # all non-zero entries of the symmetric NR matrix, both orders
+   for (a,b),V in zip(table.pairs,table.values):
+      M[(a,b)] = M[(b,a)] = V
+   T = reduction_matrix(table.isotope,table.masses,table.energies,mM)
+   values = {}
+   for j in range(Nrelcoeffs):
+      for k in range(j,Nrelcoeffs):
+         v = 0.
+         for a,Ta in T[j]:
+            for b,Tb in T[k]:
+               if (a,b) in M:
+                  v = v + Ta*Tb*M[(a,b)]
+         if np.any(v!=0):
+            values[(j,k)] = v
+   pairs = sorted(values.keys())
+   V = np.array([values[p] for p in pairs]).reshape((len(pairs),)+table.values.shape[1:])
+   return itf.InterferenceTable(pairs,V,table.masses,table.energies,table.isotope,Nrelcoeffs)
+
+def operator_spectra(reltable,ops=range(1,Nrel+1),combs=["p=n"]):
+   # (operator, comb, mass, energy) spectra for single relativistic operators with d=1
+   cs = [rr.couplings(op,comb,Nrel) for op in ops for comb in combs]
+   d  = to_vector(np.array([c[0] for c in cs]),np.array([c[1] for c in cs]))
+   return reltable.rate(d).reshape((len(ops),len(combs))+reltable.values.shape[1:])
+
+def write_archive(outfile,tables,ops=range(1,Nrel+1),combs=ss.COMBS,mM=mM):
+   # SpectrumArchive of relativistic-operator spectra, one isotope per NR interference table
+   cube = np.array([operator_spectra(compose(t,mM),ops,combs) for t in tables])
+   ss.write_archive(outfile,cube,[int(t.isotope) for t in tables],list(ops),combs,tables[0].masses,tables[0].energies)
+   return outfile
+
+if __name__=="__main__":
+   # Usage: python relativistic.py <outpath> [UseHelm]
+   # Reads the NR interference tables written by interference.py in outpath and writes
+   # Xe_R_<lowE|highE>_spectra.bin archives (Xe_R_HelmFF_... with UseHelm)
+   if len(sys.argv) < 2:
+      print("Usage: python relativistic.py <outpath> [UseHelm]")
+      sys.exit(1)
+   helm = len(sys.argv) > 2 and sys.argv[2]=="UseHelm"
+   for SRtag in ["lowE","highE"]:
+      fnames = [os.path.join(sys.argv[1],"Xe{0}_{1}_{2}_interference.npz".format(A,"NR_HelmFF" if helm else "NR",SRtag)) for A in rr.isotopes]
+      tables = [itf.InterferenceTable.load(f) for f in fnames if os.path.exists(f)]
+      if len(tables)==0:
+         print("No {0} interference tables found in {1}".format(SRtag,sys.argv[1]))
+         continue
+      fname = os.path.join(sys.argv[1],"Xe_{0}_{1}_spectra.bin".format("R_HelmFF" if helm else "R",SRtag))
+      print("Writing {0}".format(fname))
+      write_archive(fname,tables)
@@ -0,0 +1,157 @@
+""" Detector energy resolution: smearing of tabulated recoil spectra
+
+    recoil_generator.m tabulates dR/dE well beyond the signal region so that
+    the detector response can be applied afterwards. Here the response is a
+    Gaussian in observed energy whose width depends on the true recoil energy,
+       dR/dE_obs(E) = int dE' dR/dE(E') G(E - E'; sigma(E'))
+    applied to whole arrays of spectra (e.g. operator x mass x energy) at once.
+
+    Two implementations are used, chosen by the kernel width in grid points:
+      "band" - the response as a banded sparse (energy x energy) matrix, one
+               sparse-dense product for all spectra. Each true-energy bin's
+               kernel spans +-nsig sigma(E) of that bin and is normalised to
+               one over it. Exact up to the truncation; used for narrow kernels.
+      "fft"  - the energy axis is split into segments over which sigma varies
+               by less than a fraction 'tol'; each segment is convolved with the
+               Gaussian for its central sigma (normalised to one over +-nsig of
+               that sigma) by FFT, and the (overlapping) results are added up.
+               Used for wide kernels. Since every bin of a segment shares one
+               width, this approximates the band result to within the sigma
+               variation 'tol' allows (about 1% in the smeared rates for the
+               default tol=0.05).
+    In both cases events are only lost off the ends of the grid.
+
+    Smearers are built once per (resolution model, energy grid) and cached.
+    Requires an evenly spaced energy grid (as written by recoil_generator.m).
+"""
+
+import numpy as np
+from collections import OrderedDict
+from scipy import sparse
+
+try:
+   from scipy.fft import next_fast_len
+except ImportError:
+   from scipy.fftpack import next_fast_len
+
+class Resolution(object):
+   """ Energy resolution model sigma(E), in keV for recoil energy E in keV """
+
+   def __init__(self,a=0.,b=0.,c=0.,table=None):
+      # sigma(E)^2 = a^2 + b^2 E + c^2 E^2 (constant, statistical and linear terms),
+      # or, if table=(E, sigma) is given, sigma interpolated linearly from the table
+      self.a, self.b, self.c = float(a), float(b), float(c)
+      self.table = None
+      if table is not None:
+         E, sigma = table
+         self.table = (tuple(np.asarray(E,dtype=float)),tuple(np.asarray(sigma,dtype=float)))
+
+   @property
+   def key(self):
+      # Hashable identifier of the model (used to cache smearers and smeared spectra)
+      return (self.a,self.b,self.c,self.table)
+
+   def sigma(self,E):
+      E = np.asarray(E,dtype=float)
+      if self.table is not None:
+         return np.interp(E,self.table[0],self.table[1])
+      return np.sqrt(self.a**2 + self.b**2*E + self.c**2*E**2)
+
+def _kernel(sigma,h,W):
+   # (len(sigma), 2W+1) normalised Gaussian weights for offsets -W..W grid points of spacing h
+   d = np.arange(-W,W+1)*h
+   s = np.maximum(np.asarray(sigma,dtype=float),1e-6*h)[...,None] # sigma=0 -> delta function
+   K = np.exp(-0.5*(d/s)**2)
+   return K/K.sum(axis=-1)[...,None]
+
+class Smearer(object):
+   """ Resolution smearing for one model on one (evenly spaced) energy grid """
+
+   def __init__(self,energies,resolution,nsig=5.,method="auto",band_max=64,tol=0.05):
+      # energies: (nE,) evenly spaced recoil energies in keV
+      # resolution: Resolution model
+      # nsig: kernels are truncated at +-nsig sigma
+      # method: "band", "fft", or "auto" (band if the widest kernel spans <= band_max grid points)
+      # tol: largest relative change in sigma across an FFT segment
+      self.energies   = np.asarray(energies,dtype=float)
+      self.resolution = resolution
+      self.h = self.energies[1] - self.energies[0]
+      if not np.allclose(np.diff(self.energies),self.h,rtol=1e-6,atol=0):
+         raise ValueError("Smearing requires an evenly spaced energy grid!")
+      self.nsig  = float(nsig)
+      self.sigma = resolution.sigma(self.energies)
+      self.W = int(np.ceil(self.nsig*np.max(self.sigma)/self.h))
+      if method=="auto":
+         method = "band" if 2*self.W+1 <= band_max else "fft"
+      if method not in ("band","fft"):
+         raise ValueError("Unknown smearing method '{0}'! Should be 'band', 'fft' or 'auto'".format(method))
+      self.method = method
+      if method=="band":
+         self._build_band()
+      else:
+         self._build_segments(tol)
+
+   def _build_band(self):
+      # Sparse matrix M[i,j] = K_j(i-j): contribution of true energy j to observed energy i.
+      # Column j only spans +-nsig sigma(E_j), so narrow bins do not carry the widest bin's band.
+      n = len(self.energies)
+      d = np.arange(-self.W,self.W+1)
+      Wj = np.ceil(self.nsig*self.sigma/self.h).astype(int)
+      K = np.exp(-0.5*(d*self.h/np.maximum(self.sigma,1e-6*self.h)[:,None])**2) * (np.abs(d)[None,:] <= Wj[:,None])
+      K = K/K.sum(axis=-1)[:,None] # (n, 2W+1)
+      j = np.repeat(np.arange(n),2*self.W+1)
+      i = j + np.tile(d,n)
+      keep = (i>=0) & (i<n) & (K.ravel()>0)
+      self.matrix = sparse.csr_matrix((K.ravel()[keep],(i[keep],j[keep])),shape=(n,n))
+
+   def _build_segments(self,tol):
+      # Split the grid where log(sigma) crosses multiples of log(1+tol); one kernel per segment
+      logs  = np.log(np.maximum(self.sigma,1e-6*self.h))
+      level = np.floor((logs - logs[0])/np.log1p(tol)).astype(int)
+      edges = np.concatenate(([0],np.flatnonzero(np.diff(level))+1,[len(self.energies)]))
+      self.segments = []
+      for a,b in zip(edges[:-1],edges[1:]):
+         s = self.sigma[(a+b-1)//2]
+         W = int(np.ceil(self.nsig*s/self.h))
+         nfft = next_fast_len(b-a+2*W)
+         K = np.fft.rfft(_kernel(s,self.h,W),nfft)
+         self.segments += [(a,b,W,nfft,K)]
+
+   def __call__(self,rates):
+      # Smeared dR/dE (observed energy, on the same grid) for any (..., nE) array of spectra
+      rates = np.asarray(rates,dtype=float)
+      n = len(self.energies)
+      if rates.shape[-1]!=n:
+         raise ValueError("Last axis of rates ({0}) does not match the energy grid ({1})".format(rates.shape[-1],n))
+      x = rates.reshape(-1,n)
+      if self.method=="band":
+         return np.asarray(self.matrix.dot(x.T).T).reshape(rates.shape)
+      out = np.zeros(x.shape)
+      for a,b,W,nfft,K in self.segments:
+         # full convolution of this segment; element o lands at observed energy index a-W+o
+         y  = np.fft.irfft(np.fft.rfft(x[:,a:b],nfft,axis=-1)*K,nfft,axis=-1)
+         i0 = a - W
+         lo, hi = max(i0,0), min(b+W,n)
+         out[:,lo:hi] += y[:,lo-i0:hi-i0]
+      return out.reshape(rates.shape)
+
+# In-memory cache of Smearers, keyed by (model, grid, settings), least recently used evicted first
+cache_size = 16
+_cache = OrderedDict()
+
+def get_smearer(energies,resolution,nsig=5.,method="auto",band_max=64,tol=0.05):
+   energies = np.asarray(energies,dtype=float)
+   key = (resolution.key,energies[0],energies[-1],len(energies),float(nsig),method,int(band_max),float(tol))
+   if key in _cache:
+      smearer = _cache.pop(key)
+   else:
+      smearer = Smearer(energies,resolution,nsig,method,band_max,tol)
+      if len(_cache) >= cache_size:
+         _cache.popitem(last=False)
+   _cache[key] = smearer # (re)insert as most recently used
+   return smearer
+
+def smear(energies,rates,resolution,**kwargs):
+   # Smeared dR/dE for any (..., nE) array of spectra tabulated on 'energies'
+   # (keyword arguments as for Smearer)
+   return get_smearer(energies,resolution,**kwargs)(rates)
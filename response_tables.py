@@ -0,0 +1,90 @@
+""" Nuclear response tables for recoil_rates.py, fitted to DMFormFactor output
+
+    export_responses.m writes the entries M_ij(mass,E) of the NR interference
+    matrix (dR/dE = c^T M c, see interference.py) of one isotope, as computed
+    by DMFormFactor for its default density matrices. Each entry is linear in
+    the 32 nuclear responses W_X^{tau tau'}(q) at q = sqrt(2 mT E), with
+    coefficients given by the same kinematics and halo integrals as
+    recoil_rates.RateBasis. These coefficients are obtained by running
+    RateBasis with constant unit responses, one response at a time, and the
+    responses at each energy are then the least-squares solution over all
+    exported entries and masses. The result is written as
+    nuclear_responses/Xe<A>.npz, which recoil_rates.get_response reads.
+
+    Usage:
+      MathKernel -script export_responses.m <DMFormFactor dir> <outpath> <A>
+      python response_tables.py <outpath> <A> [nuclear_responses]
+"""
+
+import os
+import sys
+from glob import glob
+import numpy as np
+
+import halo
+import interference as itf
+import recoil_rates as rr
+
+def read_export(outpath,A):
+   # WIMP masses (nm,), recoil energies (nE,) in keV and {(i,j): (nm,nE) M_ij} written by export_responses.m
+   masses = np.atleast_1d(np.loadtxt(os.path.join(outpath,"Xe{0}_masses.dat".format(A))))
+   labels = itf.coeff_labels()
+   entries = {}
+   ER = None
+   for fname in glob(os.path.join(outpath,"Xe{0}_M_*.dat".format(A))):
+      a, b = os.path.basename(fname)[:-4].split("_")[2:]
+      d = np.loadtxt(fname)
+      ER = d[:,0]
+      entries[tuple(sorted((labels.index(a),labels.index(b))))] = d[:,1:].T
+   if ER is None:
+      raise IOError("No interference tables for Xe{0} found in {1}! Run export_responses.m first.".format(A,outpath))
+   return masses, ER, entries
+
+def design(A,masses,ER,pairs,ve=halo.ve_default,v0=halo.v0_default,vesc=halo.vesc_default):
+   # (npairs,nm,nE,32) contribution of each unit response W_X^{tau tau'} (flattened in the order of
+   # NuclearResponse.W) to the interference entries 'pairs'
+   nW = len(rr.responses)*4
+   q = np.array([0.,10.])
+   D = np.zeros((len(pairs),len(masses),len(ER),nW))
+   for u in range(nW):
+      W = np.zeros((nW,len(q)))
+      W[u] = 1.
+      response = rr.NuclearResponse(A,rr.Z_Xe,rr.nuclear_spin[A],q,W.reshape(len(rr.responses),2,2,len(q)))
+      table = itf.InterferenceTable.from_basis(rr.RateBasis(response,masses,ER,ve=ve,v0=v0,vesc=vesc),A)
+      index = dict((tuple(p),k) for k,p in enumerate(table.pairs))
+      for k,p in enumerate(pairs):
+         if p in index:
+            D[k,:,:,u] = table.values[index[p]]
+   return D
+
+def fit_responses(A,masses,ER,entries,**kwargs):
+   # NuclearResponse for isotope A from the exported interference entries; kwargs: halo (ve, v0, vesc).
+   # Energies no mass can reach carry no information and are left out of the table.
+   pairs = sorted(entries.keys())
+   D = design(A,masses,ER,pairs,**kwargs)
+   y = np.array([entries[p] for p in pairs])
+   D = D.transpose(2,0,1,3).reshape(len(ER),-1,D.shape[-1]) # (nE, npairs*nm, 32)
+   y = y.transpose(2,0,1).reshape(len(ER),-1)
+   keep = np.any(D!=0,axis=(1,2))
+   W = np.zeros((D.shape[-1],len(ER)))
+   for e in np.where(keep)[0]:
+      # scale each equation to unit size; the entries span many orders of magnitude
+      s = np.max(np.abs(D[e]),axis=1)
+      rows = s > 0
+      W[:,e] = np.linalg.lstsq(D[e][rows]/s[rows,None],y[e][rows]/s[rows],rcond=None)[0]
+   q = np.sqrt(2*A*rr.mNucleon*ER[keep]*1e-6)
+   order = np.argsort(q)
+   W = W[:,keep][:,order].reshape(len(rr.responses),2,2,-1)
+   return rr.NuclearResponse(A,rr.Z_Xe,rr.nuclear_spin[A],q[order],W)
+
+if __name__=="__main__":
+   if len(sys.argv) < 3:
+      print("Usage: python response_tables.py <outpath> <A> [nuclear_responses]")
+      sys.exit(1)
+   A = int(sys.argv[2])
+   respath = sys.argv[3] if len(sys.argv) > 3 else "nuclear_responses"
+   if not os.path.isdir(respath):
+      os.makedirs(respath)
+   fname = os.path.join(respath,"Xe{0}.npz".format(A))
+   print("Writing {0}".format(fname))
+   fit_responses(A,*read_export(sys.argv[1],A)).save(fname)
@@ -0,0 +1,277 @@
+""" Parallel, resumable generation of the recoil spectrum tables
+
+    Replaces the serial isotope loop of get_all_spectra.sh. The full
+    regeneration is split into independent tasks (isotope x operator set x
+    energy range x Helm/density-matrix form factors x elastic/inelastic),
+    which are farmed out to a process pool. Every finished task is recorded
+    in a manifest (manifest.json in the output directory) together with the
+    sha256 hashes of the files it wrote, so that an interrupted or partly
+    failed run can simply be restarted: tasks whose outputs are all present
+    and unchanged are skipped.
+
+    Two engines are available:
+      python       - recoil_rates.py; one SpectrumArchive per task, written
+                     under a temporary name and renamed once complete. After
+                     a successful run the elastic archives are merged into
+                     Xe_<Tag>_<SRtag>_spectra.bin in the output directory,
+                     one archive per form factor choice and energy range with
+                     all isotopes (the files recoil_rates.py writes directly)
+      mathematica  - recoil_generator.m (one MathKernel per task); the script
+                     always writes both energy ranges and all operators of one
+                     type (NR or R) for an isotope, so that is one task
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import traceback
+import subprocess
+import multiprocessing
+import numpy as np
+
+import recoil_rates as rr
+import spectrum_store as ss
+
+# Mass splittings (keV) used by recoil_generator.m in inelastic mode
+delmlist = [0,5,10,30,70,100,150,200,250,300,400,500,700,1000]
+
+MANIFEST = "manifest.json"
+
+generator = os.path.join(os.path.dirname(os.path.abspath(__file__)),"recoil_generator.m")
+
+def file_hash(fname,blocksize=1<<20):
+   h = hashlib.sha256()
+   with open(fname,"rb") as f:
+      for block in iter(lambda: f.read(blocksize),b""):
+         h.update(block)
+   return h.hexdigest()
+
+def makedirs(d):
+   # os.makedirs that tolerates another worker creating the directory at the same time
+   try:
+      os.makedirs(d)
+   except OSError:
+      if not os.path.isdir(d):
+         raise
+
+def ops_label(ops):
+   # e.g. "c1-15" for a contiguous range of operators, "c1_3_8" otherwise
+   ops = list(ops)
+   if len(ops) > 1 and ops == list(range(ops[0],ops[-1]+1)):
+      return "c{0}-{1}".format(ops[0],ops[-1])
+   return "c" + "_".join(str(op) for op in ops)
+
+class PythonTask(object):
+   """ Spectra for one isotope, operator set, energy range, form factor choice and mass splitting """
+
+   def __init__(self,A,ops=range(1,16),SRtag="lowE",helm=False,delm=None,combs=ss.COMBS):
+      # delm: inelastic mass splitting in keV (None for elastic scattering)
+      self.A     = A
+      self.ops   = list(ops)
+      self.SRtag = SRtag
+      self.helm  = helm
+      self.delm  = delm
+      self.combs = list(combs)
+      Tag = "NR_HelmFF" if helm else "NR"
+      self.key = "Xe{0}_{1}_{2}_{3}".format(A,Tag,SRtag,ops_label(self.ops))
+      if delm is not None:
+         self.key = "IDM_{0}_delm{1:g}".format(self.key,delm)
+
+   def run(self,outdir):
+      # Returns the written files, relative to outdir
+      fname = os.path.join("Xe{0}".format(self.A),self.key+"_spectra.bin")
+      path = os.path.join(outdir,fname)
+      makedirs(os.path.dirname(path))
+      delm = 0. if self.delm is None else self.delm
+      cube = rr.generate_spectra(self.A,self.ops,self.combs,ER=rr.Earrs[self.SRtag],helm=self.helm,delm=delm)
+      ss.write_archive(path,cube[np.newaxis],[self.A],self.ops,self.combs,rr.masses,rr.Earrs[self.SRtag])
+      return [fname]
+
+class MathematicaTask(object):
+   """ One run of recoil_generator.m (all operators of one type, both energy ranges, one isotope) """
+
+   def __init__(self,A,Otype="NR",helm=False,idm=False,dmff=".",script=generator):
+      # dmff: path to the DMFormFactor package (argument 1 of recoil_generator.m)
+      self.A      = A
+      self.Otype  = Otype
+      self.helm   = helm
+      self.idm    = idm
+      self.dmff   = dmff
+      self.script = script
+      self.Tag = Otype + ("_HelmFF" if helm else "")
+      self.key = "{0}Xe{1}_{2}_mathematica".format("IDM_" if idm else "",A,self.Tag)
+
+   def outputs(self,outdir):
+      # Tables written by this run; the tag must be followed directly by the energy range, since
+      # e.g. the NR pattern would otherwise also pick up the NR_HelmFF tables
+      name = re.compile(r"^{0}Xe{1}_{2}_(lowE|highE)_.*\.h5$".format("IDM_" if self.idm else "",self.A,re.escape(self.Tag)))
+      files = glob.glob(os.path.join(outdir,"Xe{0}".format(self.A),"*.h5"))
+      return sorted(os.path.relpath(f,outdir) for f in files if name.match(os.path.basename(f)))
+
+   def run(self,outdir):
+      # recoil_generator.m writes into Directory[]/<outpath>, so pass outdir relative to the cwd.
+      # Its CreateDirectory of <outpath>/Xe<A> fails if a parallel task for the same isotope got
+      # there first, so the directory is made here instead.
+      makedirs(os.path.join(outdir,"Xe{0}".format(self.A)))
+      cmd = [self.script,self.dmff,os.path.relpath(outdir),str(self.A),self.Otype,"nocheck",
+             "UseHelm" if self.helm else "noHelm","IDM" if self.idm else "noIDM"]
+      with open(os.path.join(outdir,self.key+".log"),"w") as log:
+         status = subprocess.call(cmd,stdout=log,stderr=subprocess.STDOUT)
+      if status != 0:
+         raise RuntimeError("{0} exited with status {1}; see {2}.log".format(" ".join(cmd),status,self.key))
+      outputs = self.outputs(outdir)
+      if len(outputs)==0:
+         raise RuntimeError("{0} wrote no spectrum tables!".format(" ".join(cmd)))
+      return outputs
+
+def python_tasks(isos=rr.isotopes,opsets=[range(1,16)],SRtags=["lowE","highE"],helm=[False],delms=[None]):
+   # All combinations of the given isotopes, operator sets, energy ranges, form factor choices and
+   # mass splittings (None for elastic)
+   return [PythonTask(A,ops,SRtag,h,d) for A in isos for ops in opsets for SRtag in SRtags
+                                       for h in helm for d in delms]
+
+def mathematica_tasks(isos=rr.isotopes,Otypes=["NR"],helm=[False],idm=[False],dmff="."):
+   return [MathematicaTask(A,Otype,h,i,dmff) for A in isos for Otype in Otypes for h in helm for i in idm]
+
+def merge(tasks,outdir):
+   # Combine the per-task archives of elastic PythonTasks into Xe_<Tag>_<SRtag>_spectra.bin in outdir,
+   # one archive for each form factor choice and energy range holding all isotopes and operators
+   # (spectra missing from every task are flagged as absent). Merged archives are only rewritten
+   # when one of their inputs is newer. Inelastic archives are left per task. Returns the files written.
+   groups = {}
+   for task in tasks:
+      if isinstance(task,PythonTask) and task.delm is None:
+         groups.setdefault(("NR_HelmFF" if task.helm else "NR",task.SRtag),[]).append(task)
+   written = []
+   for (Tag,SRtag),group in sorted(groups.items()):
+      fname = os.path.join(outdir,"Xe_{0}_{1}_spectra.bin".format(Tag,SRtag))
+      parts = [os.path.join(outdir,"Xe{0}".format(t.A),t.key+"_spectra.bin") for t in group]
+      if os.path.exists(fname) and os.path.getmtime(fname) >= max(os.path.getmtime(f) for f in parts):
+         continue
+      archives = [ss.SpectrumArchive(f) for f in parts]
+      isos  = sorted(set(a.isotopes[0] for a in archives))
+      ops   = sorted(set(op for a in archives for op in a.operators))
+      combs = [c for c in ss.COMBS if any(c in a.combs for a in archives)]
+      cube  = np.full((len(isos),len(ops),len(combs),len(rr.masses),len(rr.Earrs[SRtag])),np.nan)
+      present = np.zeros(cube.shape[:3],dtype=bool)
+      for a in archives:
+         i = isos.index(a.isotopes[0])
+         for j,op in enumerate(a.operators):
+            for k,comb in enumerate(a.combs):
+               cube[i,ops.index(op),combs.index(comb)] = a.cube[0,j,k]
+               present[i,ops.index(op),combs.index(comb)] = a.present[0,j,k]
+      ss.write_archive(fname,cube,isos,ops,combs,rr.masses,rr.Earrs[SRtag],present)
+      written += [fname]
+   return written
+
+class Manifest(object):
+   """ Record of finished tasks: key -> {"outputs": {file: sha256}, "seconds": runtime} """
+
+   def __init__(self,outdir):
+      self.fname = os.path.join(outdir,MANIFEST)
+      self.outdir = outdir
+      self.tasks = {}
+      if os.path.exists(self.fname):
+         with open(self.fname) as f:
+            self.tasks = json.load(f)
+
+   def done(self,key,verify=True):
+      # Whether a task finished and its outputs are still on disk (and, if verify, unchanged)
+      if key not in self.tasks:
+         return False
+      for fname,h in self.tasks[key]["outputs"].items():
+         path = os.path.join(self.outdir,fname)
+         if not os.path.exists(path) or (verify and file_hash(path)!=h):
+            return False
+      return True
+
+   def record(self,key,outputs,seconds):
+      self.tasks[key] = {"outputs": outputs, "seconds": seconds}
+      # Write under a temporary name first so that an interruption cannot corrupt the manifest
+      with open(self.fname+".part","w") as f:
+         json.dump(self.tasks,f,indent=1,sort_keys=True)
+      os.rename(self.fname+".part",self.fname)
+
+def _work(args):
+   # Run one task in a worker process; exceptions are returned rather than raised so that
+   # one failure does not bring down the rest of the run
+   task, outdir = args
+   start = time.time()
+   try:
+      outputs = dict((f,file_hash(os.path.join(outdir,f))) for f in task.run(outdir))
+      return task.key, outputs, time.time()-start, None
+   except Exception:
+      return task.key, None, time.time()-start, traceback.format_exc()
+
+def run(tasks,outdir,processes=None,verify=True):
+   # Run all tasks not already recorded as finished in outdir's manifest, on 'processes' worker
+   # processes (default: all cores). Returns the keys of tasks that failed.
+   makedirs(outdir)
+   manifest = Manifest(outdir)
+   keys = [task.key for task in tasks]
+   if len(set(keys)) != len(keys):
+      raise ValueError("Duplicate tasks in task list!")
+   pending = [task for task in tasks if not manifest.done(task.key,verify)]
+   print("{0} of {1} tasks already finished; running {2} on {3} processes".format(
+         len(tasks)-len(pending),len(tasks),len(pending),processes or multiprocessing.cpu_count()))
+   failed = []
+   if len(pending)==0:
+      return failed
+   pool = multiprocessing.Pool(processes)
+   try:
+      for n,(key,outputs,seconds,error) in enumerate(pool.imap_unordered(_work,[(t,outdir) for t in pending])):
+         if error is None:
+            manifest.record(key,outputs,seconds)
+            print("[{0}/{1}] Finished {2} ({3:.1f} s)".format(n+1,len(pending),key,seconds))
+         else:
+            failed += [key]
+            print("[{0}/{1}] FAILED {2}:\n{3}".format(n+1,len(pending),key,error))
+      pool.close()
+   except KeyboardInterrupt:
+      # Finished tasks are already in the manifest; the rest are rerun next time
+      pool.terminate()
+      raise
+   finally:
+      pool.join()
+   return failed
+
+if __name__=="__main__":
+   parser = argparse.ArgumentParser(description="Generate recoil spectrum tables in parallel, skipping tasks finished by previous runs")
+   parser.add_argument("outdir",help="output directory (holds the manifest)")
+   parser.add_argument("--engine",choices=["python","mathematica"],default="python")
+   parser.add_argument("--isotopes",type=int,nargs="+",default=rr.isotopes)
+   parser.add_argument("--opsets",nargs="+",default=["1-15"],help="python engine: operator sets, e.g. 1-15 or 1,3,8")
+   parser.add_argument("--Otypes",nargs="+",default=["NR"],help="mathematica engine: NR and/or R")
+   parser.add_argument("--SRtags",nargs="+",default=["lowE","highE"],help="python engine: energy ranges")
+   parser.add_argument("--helm",choices=["no","yes","both"],default="no",help="Helm form factors instead of density matrices")
+   parser.add_argument("--idm",choices=["no","yes","both"],default="no",help="inelastic scattering")
+   parser.add_argument("--dmff",default=".",help="mathematica engine: DMFormFactor directory")
+   parser.add_argument("--processes",type=int,default=None,help="number of worker processes (default: all cores)")
+   parser.add_argument("--no-verify",dest="verify",action="store_false",help="trust the manifest without re-hashing outputs")
+   args = parser.parse_args()
+
+   flags = {"no":[False],"yes":[True],"both":[False,True]}
+   if args.engine=="python":
+      opsets = []
+      for s in args.opsets:
+         if "-" in s:
+            first, last = s.split("-")
+            opsets += [range(int(first),int(last)+1)]
+         else:
+            opsets += [[int(op) for op in s.split(",")]]
+      delms = [d for i in flags[args.idm] for d in (delmlist if i else [None])]
+      tasks = python_tasks(args.isotopes,opsets,args.SRtags,flags[args.helm],delms)
+   else:
+      tasks = mathematica_tasks(args.isotopes,args.Otypes,flags[args.helm],flags[args.idm],args.dmff)
+
+   failed = run(tasks,args.outdir,args.processes,args.verify)
+   if len(failed) > 0:
+      print("{0} tasks failed: {1}".format(len(failed),failed))
+      sys.exit(1)
+   for fname in merge(tasks,args.outdir):
+      print("Merged spectra into {0}".format(fname))
@@ -0,0 +1,396 @@
+""" Binary archive for tabulated recoil spectra
+
+    Packs the whitespace text tables written for each isotope and operator
+    (first column recoil energy in keV, then one dR/dE column per WIMP mass)
+    into a single indexed file, so that they can be served as memory-mapped
+    numpy views instead of being re-parsed with np.loadtxt on every use.
+
+    File layout:
+      8 bytes   magic string
+      8 bytes   length of JSON header (little-endian uint64)
+      N bytes   JSON header (axes, dtype, shape, energies), padded with spaces
+      rest      C-ordered array of shape (isotope, operator, comb, mass, energy)
+"""
+
+import os
+import sys
+import json
+import hashlib
+import struct
+import numpy as np
+from collections import OrderedDict
+from scipy.interpolate import PchipInterpolator
+from rate_index import CumulativeRate
+import halo
+import resolution as res
+
+mNucleon = 0.938 # GeV
+
+MAGIC = b"EFTSPEC1"
+ALIGN = 64 # data block starts on a multiple of this many bytes
+
+# Isospin combinations for which spectra are tabulated
+COMBS = ["p","n","p=n"]
+
+# Number of smeared and of efficiency-weighted (operator, comb, mass, energy) arrays, and of
+# cumulative-rate indices, kept in memory per archive (least recently used evicted first)
+cache_size = 8
+
+# Natural isotopic abundances (atom fractions) of the xenon isotopes with tabulated spectra
+# (124Xe and 126Xe, together <0.2%, are neglected; fractions are renormalised on use)
+natural_abundance = {128:0.01910, 129:0.26401, 130:0.04071, 131:0.21232, 132:0.26909, 134:0.10436, 136:0.08857}
+
+def mass_fractions(abundance):
+   # Convert {isotope: atom fraction} to {isotope: fraction of target mass}. Per-isotope spectra are
+   # rates per kg of that isotope, so these are the weights for the rate per kg of the mixture.
+   total = float(sum(int(iso)*x for iso,x in abundance.items()))
+   return dict((iso,int(iso)*x/total) for iso,x in abundance.items())
+
+def label(op,comb):
+   # Name used for the operator/isospin combination in the spectrum filenames, e.g. "c1p=c1n"
+   if comb=="p=n":
+      return "c{0}p=c{0}n".format(op)
+   elif comb in ("p","n"):
+      return "c{0}{1}".format(op,comb)
+   raise ValueError("Unknown isospin combination '{0}'! Should be one of {1}".format(comb,COMBS))
+
+def pack_spectra(pathtodat,outfile,isotopes,masses,operators=range(1,16),combs=COMBS,
+                 pattern="Xe{iso}/Xe{iso}_{label}.dat",dtype=np.float64,halo_params=None,columns=None):
+   # pathtodat: directory containing the text spectrum tables
+   # outfile: name of archive file to create
+   # isotopes: list of isotope names, e.g. [128,129,...,"Comb"]
+   # masses: WIMP masses (GeV) of the dR/dE columns to pack
+   # columns: positions of these columns among the dR/dE columns of the tables (0 is the first
+   #          column after ER); default the first len(masses) columns, further ones are ignored
+   # operators: operator numbers to look for
+   # combs: isospin combinations to look for (see COMBS)
+   # pattern: filename of each table relative to pathtodat
+   # halo_params: (ve, v0, vesc) the tables were generated for (default: those of recoil_generator.m)
+   #
+   # Tables which are missing are left as NaN in the archive, and flagged as such
+   # in the header. Each text table is parsed exactly once.
+   isotopes  = list(isotopes)
+   operators = list(operators)
+   combs     = list(combs)
+   masses    = np.asarray(masses,dtype=float)
+   columns   = np.arange(len(masses)) if columns is None else np.asarray(columns,dtype=int)
+   if len(columns) != len(masses):
+      raise ValueError("{0} columns were selected for {1} masses!".format(len(columns),len(masses)))
+
+   energies = None
+   present  = np.zeros((len(isotopes),len(operators),len(combs)),dtype=bool)
+   cube     = None
+   for i,iso in enumerate(isotopes):
+      for j,op in enumerate(operators):
+         for k,comb in enumerate(combs):
+            fname = os.path.join(pathtodat,pattern.format(iso=iso,label=label(op,comb)))
+            if not os.path.exists(fname):
+               continue
+            data = np.loadtxt(fname)
+            if data.shape[1] <= np.max(columns)+1:
+               raise ValueError("Table {0} has {1} dR/dE columns, but column {2} was selected!".format(fname,data.shape[1]-1,np.max(columns)))
+            if energies is None:
+               energies = data[:,0].copy()
+               cube = np.empty((len(isotopes),len(operators),len(combs),len(masses),len(energies)),dtype=dtype)
+               cube[:] = np.nan
+            elif not np.array_equal(data[:,0],energies):
+               raise ValueError("Recoil energies in table {0} do not match those of the other tables!".format(fname))
+            cube[i,j,k] = data[:,columns+1].T
+            present[i,j,k] = True
+
+   if energies is None:
+      raise IOError("No spectrum tables matching '{0}' found in {1}".format(pattern,pathtodat))
+
+   write_archive(outfile,cube,isotopes,operators,combs,masses,energies,present,halo_params)
+   return outfile
+
+def write_archive(outfile,cube,isotopes,operators,combs,masses,energies,present=None,halo_params=None):
+   # Write an (isotope, operator, comb, mass, energy) array of dR/dE values to an archive file.
+   # halo_params: (ve, v0, vesc) in km/s of the halo the spectra were computed for (default: the
+   # recoil_generator.m values); used to divide out the halo integral when interpolating in mass
+   cube = np.ascontiguousarray(cube)
+   if present is None:
+      present = np.ones(cube.shape[:3],dtype=bool)
+   if halo_params is None:
+      halo_params = (halo.ve_default,halo.v0_default,halo.vesc_default)
+   header = {"dtype"    : cube.dtype.str,
+             "shape"    : list(cube.shape),
+             "isotope"  : list(isotopes),
+             "operator" : list(operators),
+             "comb"     : list(combs),
+             "mass"     : [float(m) for m in masses],
+             "energy"   : [float(E) for E in energies],
+             "present"  : [bool(x) for x in present.flat],
+             "halo"     : [float(v) for v in halo_params]}
+   hbytes = json.dumps(header).encode("utf-8")
+   hlen = len(hbytes) + (-(len(MAGIC)+8+len(hbytes)) % ALIGN)
+   hbytes = hbytes.ljust(hlen,b" ")
+   # Write under a temporary name first so that an interrupted write never leaves a truncated archive
+   part = outfile+".part"
+   with open(part,"wb") as f:
+      f.write(MAGIC)
+      f.write(struct.pack("<Q",hlen))
+      f.write(hbytes)
+      cube.tofile(f)
+   os.rename(part,outfile)
+
+class SpectrumArchive(object):
+   """ Read-only, memory-mapped access to a spectrum archive written by pack_spectra """
+
+   def __init__(self,fname):
+      self.fname = fname
+      with open(fname,"rb") as f:
+         if f.read(len(MAGIC)) != MAGIC:
+            raise IOError("{0} is not a spectrum archive!".format(fname))
+         hlen, = struct.unpack("<Q",f.read(8))
+         header = json.loads(f.read(hlen).decode("utf-8"))
+      self.isotopes  = header["isotope"]
+      self.operators = header["operator"]
+      self.combs     = header["comb"]
+      self.masses    = np.array(header["mass"])
+      self.energies  = np.array(header["energy"])
+      shape = tuple(header["shape"])
+      self.present = np.array(header["present"],dtype=bool).reshape(shape[:3])
+      # (ve, v0, vesc) of the halo the spectra were computed for (archives written before this
+      # was recorded used the recoil_generator.m defaults)
+      self.halo_params = tuple(header.get("halo",(halo.ve_default,halo.v0_default,halo.vesc_default)))
+      # The full (isotope, operator, comb, mass, energy) array; pages are only
+      # read from disk when touched, and are shared between processes.
+      self.cube = np.memmap(fname,dtype=np.dtype(header["dtype"]),mode="r",
+                            offset=len(MAGIC)+8+hlen,shape=shape)
+      self._indices = OrderedDict() # (isotope or mix, operator, comb, resolution, efficiency) -> CumulativeRate
+      self._splines = {}
+      self._mixes   = {} # name -> weight vector over the isotope axis
+      self._mixed   = {} # weight vector -> combined (operator, comb, mass, energy) array
+      self._smeared = OrderedDict() # (isotope or mix, resolution model) -> smeared (operator, comb, mass, energy) array
+      self._accepted = OrderedDict() # (isotope or mix, efficiency curve, resolution model) -> efficiency-weighted array
+
+   def _find(self,axis,values,key):
+      # Position of 'key' along one of the archive axes (isotopes may be given as int or str)
+      for i,v in enumerate(values):
+         if v==key or str(v)==str(key):
+            return i
+      raise KeyError("{0} '{1}' not found in archive {2}; available: {3}".format(axis,key,self.fname,values))
+
+   def mass_index(self,mass):
+      i = np.where(self.masses==mass)[0]
+      if len(i)==0:
+         raise KeyError("WIMP mass {0} GeV not found in archive {1}; available: {2}".format(mass,self.fname,self.masses))
+      return i[0]
+
+   def add_mix(self,name,abundance=None):
+      # Register a target composition {isotope: atom fraction} (default natural xenon) under 'name',
+      # after which 'name' can be used as an isotope everywhere in the archive interface.
+      # The combined spectra are computed on first use, and shared between mixes with equal weights.
+      if abundance is None:
+         abundance = natural_abundance
+      w = np.zeros(len(self.isotopes))
+      for iso,f in mass_fractions(abundance).items():
+         w[self._find("Isotope",self.isotopes,iso)] = f
+      self._mixes[str(name)] = tuple(w)
+      for cache in (self._indices,self._splines,self._smeared,self._accepted):
+         for key in [key for key in cache if key[0]==str(name)]:
+            del cache[key]
+
+   def mixed(self,name):
+      # (operator, comb, mass, energy) array for a registered mix: one weighted contraction over isotopes
+      w = self._mixes[str(name)]
+      if w not in self._mixed:
+         i = np.nonzero(w)[0] # isotopes absent from the mix may hold NaN placeholders; leave them out
+         self._mixed[w] = np.einsum("i,i...->...",np.array(w)[i],self.cube[i])
+      return self._mixed[w]
+
+   def smeared(self,iso,resolution,**kwargs):
+      # (operator, comb, mass, energy) dR/dE in observed energy for one isotope (or registered mix),
+      # smeared with a resolution.Resolution model in one batched operation and cached per model.
+      # Keyword arguments are passed on to resolution.Smearer.
+      key = (str(iso),resolution.key,tuple(sorted(kwargs.items())))
+      if key in self._smeared:
+         smeared = self._smeared.pop(key)
+      else:
+         if str(iso) in self._mixes:
+            cube = self.mixed(iso)
+         else:
+            cube = self.cube[self._find("Isotope",self.isotopes,iso)]
+         smeared = res.smear(self.energies,cube,resolution,**kwargs)
+         if len(self._smeared) >= cache_size:
+            self._smeared.popitem(last=False)
+      self._smeared[key] = smeared # (re)insert as most recently used
+      return smeared
+
+   def accepted(self,iso,efficiency,resolution=None):
+      # (operator, comb, mass, energy) dR/dE times an acceptance.Efficiency curve (applied in
+      # observed energy, after smearing if a resolution model is given), cached per curve
+      key = (str(iso),efficiency.key,None if resolution is None else resolution.key)
+      if key in self._accepted:
+         accepted = self._accepted.pop(key)
+      else:
+         if resolution is not None:
+            cube = self.smeared(iso,resolution)
+         elif str(iso) in self._mixes:
+            cube = self.mixed(iso)
+         else:
+            cube = self.cube[self._find("Isotope",self.isotopes,iso)]
+         accepted = efficiency.apply(self.energies,cube)
+         if len(self._accepted) >= cache_size:
+            self._accepted.popitem(last=False)
+      self._accepted[key] = accepted # (re)insert as most recently used
+      return accepted
+
+   def rates(self,iso,op,comb="p=n",resolution=None,efficiency=None):
+      # (mass, energy) view of dR/dE for one isotope (or registered mix)/operator/isospin combination,
+      # in observed energy if a resolution model is given (see smeared), and weighted by the
+      # efficiency curve if one is given (see accepted)
+      j = self._find("Operator",self.operators,op)
+      k = self._find("Isospin combination",self.combs,comb)
+      if str(iso) in self._mixes:
+         if not np.all(self.present[np.array(self._mixes[str(iso)])>0,j,k]):
+            raise KeyError("Archive {0} is missing spectra for {1} for some isotopes of mix '{2}'".format(self.fname,label(op,comb),iso))
+      else:
+         i = self._find("Isotope",self.isotopes,iso)
+         if not self.present[i,j,k]:
+            raise KeyError("No spectra stored for Xe{0}, {1} in archive {2}".format(iso,label(op,comb),self.fname))
+      if efficiency is not None:
+         return self.accepted(iso,efficiency,resolution)[j,k]
+      if resolution is not None:
+         return self.smeared(iso,resolution)[j,k]
+      if str(iso) in self._mixes:
+         return self.mixed(iso)[j,k]
+      return self.cube[i,j,k]
+
+   def spectrum(self,iso,op,comb,mass):
+      # (n,2) array in the old text-table format: column 0 is ER, column 1 is dR/dE
+      # Masses which are not tabulated are interpolated (see interpolated_rates)
+      if mass in self.masses:
+         rates = self.rates(iso,op,comb)[self.mass_index(mass)]
+      else:
+         rates = self.interpolated_rates(iso,op,comb,mass)
+      return np.column_stack((self.energies,rates))
+
+   def interpolated_rates(self,iso,op,comb,mass):
+      # dR/dE at arbitrary WIMP mass(es) (scalar, or array giving shape mass.shape+(nE,)).
+      # Interpolates in log(mass) with monotone cubic (PCHIP) splines, fitted once per
+      # isotope/operator/isospin combination and cached. The splines are fitted to log(rate/g),
+      # where g is the halo integral of the archive's halo the rate is proportional to near the
+      # kinematic endpoint: eta(vmin), or the v_perp^2 integral for spectra made up of v_perp^2
+      # terms only (whichever gives the smoother fit). The endpoint, where the rate drops to
+      # zero, then follows from g rather than being interpolated. Below the endpoint of the
+      # lighter tabulated masses, log(rate/g) is extrapolated linearly in log(mass) from the
+      # two lightest masses reaching each energy (exact for spin-independent Helm spectra,
+      # where rate/eta goes as 1/mass).
+      # Energies where the rate is exactly zero at both bracketing masses (e.g. every energy for
+      # a neutron-only operator queried for protons) give exactly zero.
+      # Registered mixes are interpolated isotope by isotope, each with its own kinematics.
+      # Masses outside the tabulated range give NaN.
+      mass = np.asarray(mass,dtype=float)
+      if str(iso) in self._mixes:
+         w = self._mixes[str(iso)]
+         return sum(w[i]*self.interpolated_rates(self.isotopes[i],op,comb,mass) for i in np.nonzero(w)[0])
+      key = (str(iso),op,comb)
+      if key not in self._splines:
+         rates = np.asarray(self.rates(iso,op,comb),dtype=float)
+         logm  = np.log(self.masses)
+         E     = np.arange(len(self.energies))
+         rough, logrs = [], []
+         for g in self._halo_integrals(iso,self.masses):
+            reach = g > 0
+            with np.errstate(divide="ignore",invalid="ignore"):
+               logr = np.log(np.maximum(rates,np.finfo(float).tiny)/g)
+            # Heavier masses reach higher energies, so at each energy the masses reaching it are
+            # first..nm-1; fill the lighter ones along the line through the first two of these
+            first  = np.argmax(reach,axis=0)
+            second = np.minimum(first+1,len(self.masses)-1)
+            with np.errstate(divide="ignore",invalid="ignore"):
+               slope = np.where(second>first,(logr[second,E]-logr[first,E])/(logm[second]-logm[first]),0.)
+            logr = np.where(reach,logr,logr[first,E] + slope*(logm[:,None]-logm[first][None,:]))
+            # roughness: squared second differences in log(mass) where all three masses reach
+            d2 = np.diff(np.diff(logr,axis=0)/np.diff(logm)[:,None],axis=0)
+            rough += [np.sum(np.where(reach[:-2],d2,0.)**2)]
+            logrs += [logr]
+         which = int(np.argmin(rough))
+         self._splines[key] = (PchipInterpolator(logm,logrs[which],axis=0,extrapolate=False),which,rates==0)
+      spline, which, zero = self._splines[key]
+      logm = np.log(self.masses)
+      i = np.clip(np.searchsorted(logm,np.log(mass),side="right")-1,0,len(logm)-2)
+      r = np.exp(spline(np.log(mass))) * self._halo_integrals(iso,mass)[which]
+      return np.where(zero[i] & zero[i+1] & ~np.isnan(r),0.,r)
+
+   def _halo_integrals(self,iso,mass):
+      # Halo integrals eta(vmin) and int f/v (v^2-vmin^2) (speeds in units of c) for mass(es)
+      # (shape mass.shape+(nE,)) and the archive's halo, with the kinematics of the isotope.
+      # Tables for combined targets packed as such (e.g. "Comb") cannot be split by isotope; for
+      # these the largest integrals of the natural xenon isotopes are used, which vanish at the
+      # right endpoint (that of the isotope reaching furthest) but only approximate the shape of
+      # the rate just below it (tens of percent within a few keV of the endpoint); register the
+      # composition with add_mix to interpolate such targets exactly.
+      try:
+         As = [int(iso)]
+      except ValueError:
+         As = sorted(natural_abundance)
+      ve, v0, vesc = self.halo_params
+      eta, vperp = 0., 0.
+      for A in As:
+         mT = A*mNucleon
+         mu = mass[...,None]*mT/(mass[...,None]+mT)
+         vmin = np.sqrt(2*mT*self.energies*1e-6)/(2*mu)*halo.c_kms
+         e, xi = halo.halo_integrals(vmin,ve,v0,vesc)
+         eta   = np.maximum(eta,e)
+         vperp = np.maximum(vperp,xi/halo.c_kms**2 - (vmin/halo.c_kms)**2*e)
+      return eta, vperp
+
+   def index(self,iso,op,comb="p=n",resolution=None,efficiency=None):
+      # Cumulative-rate index (all masses) for one isotope/operator/isospin combination
+      # (in observed energy if a resolution model is given, weighted by the efficiency curve if given).
+      # Built on first request and cached, keeping the cache_size most recently used indices.
+      key = (str(iso),op,comb,None if resolution is None else resolution.key,
+             None if efficiency is None else efficiency.key)
+      if key in self._indices:
+         index = self._indices.pop(key)
+      else:
+         index = CumulativeRate(self.energies,self.rates(iso,op,comb,resolution,efficiency))
+         if len(self._indices) >= cache_size:
+            self._indices.popitem(last=False)
+      self._indices[key] = index # (re)insert as most recently used
+      return index
+
+   def counts(self,iso,op,comb,E1,E2,resolution=None,efficiency=None):
+      # Expected events (original exposure) with E1 <= ER <= E2, for every mass in the archive
+      return self.index(iso,op,comb,resolution,efficiency).counts(E1,E2)
+
+   def table(self,iso,op,comb="p=n"):
+      # Equivalent of np.loadtxt on the original text table
+      return np.column_stack((self.energies,self.rates(iso,op,comb).T))
+
+def archive_name(directory,isotopes,masses,prefix="Xe_spectra",**kwargs):
+   # Archive file name in 'directory' identifying what is packed into it: the isotopes, masses
+   # and any other pack_spectra settings (kwargs) are hashed into the name, so that scripts
+   # packing different selections of the same text tables never pick up each other's archives
+   settings = {"isotope":[str(iso) for iso in isotopes],"mass":[float(m) for m in masses]}
+   for k,v in kwargs.items():
+      settings[k] = [str(x) for x in v] if np.iterable(v) and not isinstance(v,str) else str(v)
+   key = hashlib.sha1(json.dumps(settings,sort_keys=True).encode("utf-8")).hexdigest()[:12]
+   return os.path.join(directory,"{0}_{1}.bin".format(prefix,key))
+
+def open_spectra(pathtodat,archive,isotopes,masses,**kwargs):
+   # Open a spectrum archive, packing it from the text tables in pathtodat first if it does not exist yet.
+   # Extra keyword arguments are passed on to pack_spectra. Use archive_name (with the same arguments)
+   # for an archive name that changes with the selection packed into it.
+   if not os.path.exists(archive):
+      pack_spectra(pathtodat,archive,isotopes,masses,**kwargs)
+   spectra = SpectrumArchive(archive)
+   if not np.array_equal(spectra.masses,np.asarray(masses,dtype=float)):
+      raise ValueError("Archive {0} was packed for WIMP masses {1}, not {2}! Delete it to repack.".format(archive,spectra.masses,masses))
+   return spectra
+
+if __name__=="__main__":
+   # Usage: python spectrum_store.py <pathtodat> <outfile> <mass1,mass2,...> [isotope1,isotope2,...]
+   if len(sys.argv) < 4:
+      print("Usage: python spectrum_store.py <pathtodat> <outfile> <mass1,mass2,...> [isotope1,isotope2,...]")
+      sys.exit(1)
+   masses = [float(m) for m in sys.argv[3].split(",")]
+   if len(sys.argv) > 4:
+      isotopes = sys.argv[4].split(",")
+   else:
+      isotopes = [128,129,130,131,132,134,136,"Comb"]
+   pack_spectra(sys.argv[1],sys.argv[2],isotopes,masses)
+   print("Wrote spectrum archive {0}".format(sys.argv[2]))
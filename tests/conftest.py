@@ -0,0 +1,5 @@
+# The modules live flat in the repository root
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
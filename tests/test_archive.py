@@ -0,0 +1,27 @@
+""" Packing text spectrum tables into archives, and archive naming """
+
+import os
+import numpy as np
+
+import spectrum_store as ss
+
+def write_tables(pathtodat,E,nmasses):
+   # Xe131 tables for c1p=c1n with nmasses dR/dE columns; column k holds (k+1)*exp(-E/10)
+   os.makedirs(os.path.join(pathtodat,"Xe131"))
+   data = np.column_stack([E]+[(k+1)*np.exp(-E/10.) for k in range(nmasses)])
+   np.savetxt(os.path.join(pathtodat,"Xe131","Xe131_{0}.dat".format(ss.label(1,"p=n"))),data)
+
+def test_archive_names_follow_contents(tmpdir):
+   d = str(tmpdir)
+   assert ss.archive_name(d,[131],[10,100])==ss.archive_name(d,["131"],[10.,100.])
+   assert ss.archive_name(d,[131],[10,100])!=ss.archive_name(d,[131],[10,100,1000])
+   assert ss.archive_name(d,[131],[10,100])!=ss.archive_name(d,[129,131],[10,100])
+
+def test_pack_selected_columns(tmpdir):
+   pathtodat = str(tmpdir)
+   E = np.arange(1,101.)
+   write_tables(pathtodat,E,4) # tables hold more columns than are packed
+   fname = ss.archive_name(pathtodat,[131],[10,1000])
+   spectra = ss.open_spectra(pathtodat,fname,[131],[10,1000],operators=[1],combs=["p=n"],columns=[0,3])
+   assert not os.path.exists(fname+".part")
+   assert np.allclose(spectra.rates(131,1,"p=n"),np.array([1,4])[:,None]*np.exp(-E/10.))
@@ -0,0 +1,72 @@
+""" Window counts and couplings must not depend on the recoil energy grid
+
+    Helm spectra on the lowE (0.05 keV) and highE (0.5 keV) grids of
+    recoil_generator.m, checked between batch_couplings, normalise_spectrum,
+    SpectrumArchive.counts and rate_service.RateTable, and between the two
+    grids.
+"""
+
+import numpy as np
+import pytest
+
+import acceptance
+import normalise_spectra as ns
+import recoil_rates as rr
+import spectrum_store as ss
+from rate_service import RateTable
+
+ops     = [1,8]
+masses  = [10.,100.,1000.]
+windows = [(8,30),(8,100)]
+exposure = 7650.
+
+def archive(tmpdir,SRtag):
+   cube = rr.generate_spectra(131,ops,["p=n"],masses,rr.Earrs[SRtag],helm=True)
+   fname = str(tmpdir.join("Xe_{0}.bin".format(SRtag)))
+   ss.write_archive(fname,cube[None],[131],ops,["p=n"],masses,rr.Earrs[SRtag])
+   return ss.SpectrumArchive(fname)
+
+@pytest.fixture(scope="module")
+def archives(tmpdir_factory):
+   tmpdir = tmpdir_factory.mktemp("spectra")
+   return dict((SRtag,archive(tmpdir,SRtag)) for SRtag in ["lowE","highE"])
+
+@pytest.mark.parametrize("SRtag",["lowE","highE"])
+def test_batch_couplings_match_archive_counts(archives,SRtag):
+   spectra = archives[SRtag]
+   cube = np.array([spectra.rates(131,op) for op in ops])
+   c = ns.batch_couplings(spectra.energies,cube,exposure,normrate=5,normranges=windows)
+   counts = np.array([spectra.index(131,op).window_counts(windows) for op in ops])
+   assert np.allclose(c,np.sqrt(5*ns.orig_exposure/(exposure*counts)),rtol=1e-12)
+
+@pytest.mark.parametrize("SRtag",["lowE","highE"])
+def test_normalise_spectrum_matches_batch(archives,SRtag):
+   spectra = archives[SRtag]
+   for m in masses:
+      scaled, c = ns.normalise_spectrum(spectra.spectrum(131,1,"p=n",m),exposure,5,(8,30),verbose=False)
+      assert np.isclose(c,ns.batch_couplings(spectra.energies,spectra.rates(131,1)[spectra.mass_index(m)],
+                                             exposure,5,[(8,30)])[0],rtol=1e-12)
+
+def test_counts_independent_of_grid(archives):
+   low, high = [np.array([archives[SRtag].index(131,op).window_counts(windows) for op in ops])
+                for SRtag in ["lowE","highE"]]
+   # trapezoid integrals on the 0.5 keV grid agree with the 0.05 keV ones to below a percent (not for
+   # 10 GeV, whose spectra end a few coarse grid cells above the window edge; ~30% there)
+   heavy = np.array(masses) >= 100
+   assert np.all(low > 0)
+   assert np.allclose(high[:,heavy],low[:,heavy],rtol=1e-2)
+
+@pytest.mark.parametrize("SRtag",["lowE","highE"])
+def test_rate_table_matches_coupling_tables(archives,SRtag):
+   # the service with the default acceptance answers as create_coupling_table.py does
+   spectra = archives[SRtag]
+   eff = acceptance.default
+   table = RateTable(spectra,[131],ops,windows=windows[:1],efficiency=eff)
+   cube = np.array([spectra.rates(131,op,efficiency=eff) for op in ops])
+   c = ns.batch_couplings(spectra.energies,cube,exposure,normrate=5,normranges=windows)
+   counts = np.array([spectra.index(131,op,efficiency=eff).window_counts(windows) for op in ops])
+   assert np.allclose(ns.couplings_from_counts(counts,exposure,5),c,rtol=1e-12)
+   for i,op in enumerate(ops):
+      for j,m in enumerate(masses):
+         for w,(E1,E2) in enumerate(windows): # standard and non-standard windows
+            assert np.isclose(table.coupling(131,op,m,E1,E2,exposure,N=5),c[i,j,w],rtol=1e-12)
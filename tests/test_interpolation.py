@@ -0,0 +1,30 @@
+""" SpectrumArchive.interpolated_rates against spectra computed directly at the same masses """
+
+import numpy as np
+import pytest
+
+import recoil_rates as rr
+import spectrum_store as ss
+
+masses = [10.,20.,50.,100.,300.,1000.]
+
+@pytest.fixture(scope="module")
+def spectra(tmpdir_factory):
+   cube = rr.generate_spectra(131,[1,8],["p","n"],masses,rr.Earrs["lowE"],helm=True)
+   cube[:,0] = 0. # no proton couplings: rows that vanish everywhere
+   fname = str(tmpdir_factory.mktemp("spectra").join("Xe131.bin"))
+   ss.write_archive(fname,cube[None],[131],[1,8],["p","n"],masses,rr.Earrs["lowE"])
+   return ss.SpectrumArchive(fname)
+
+@pytest.mark.parametrize("op",[1,8])
+def test_interpolation_matches_direct(spectra,op):
+   m = np.array([12.5,35.,150.,700.])
+   direct = rr.generate_spectra(131,[op],["n"],m,rr.Earrs["lowE"],helm=True)[0,0]
+   interp = spectra.interpolated_rates(131,op,"n",m)
+   # including the kinematic endpoint: zero wherever the direct spectra are
+   assert np.all(interp[direct==0]==0)
+   assert np.allclose(interp,direct,rtol=1e-6,atol=1e-12*direct.max())
+
+def test_zero_rows_stay_zero(spectra):
+   assert np.all(spectra.interpolated_rates(131,1,"p",[15.,70.,500.])==0)
+   assert np.all(np.isnan(spectra.interpolated_rates(131,1,"p",5.)))
@@ -0,0 +1,20 @@
+""" mcmc checkpoints: an interrupted and resumed run gives the same chains as an uninterrupted one """
+
+import numpy as np
+
+import param_scan as ps
+
+def like(space,x):
+   return -((np.log10(x[:,0])-2)**2 + (x[:,1]-0.3)**2)/0.1
+
+def test_mcmc_resume(tmpdir):
+   space = ps.ScanSpace([ps.Parameter("mchi",10,1000,log=True),ps.Parameter("c1",0,1)])
+   x0, lnL0, acc0 = ps.mcmc(space,like,8,250)
+   fname = str(tmpdir.join("chains.npz"))
+   x1, lnL1, acc1 = ps.mcmc(space,like,8,130,fname=fname,checkpoint_every=50)
+   x2, lnL2, acc2 = ps.mcmc(space,like,8,250,fname=fname,checkpoint_every=50)
+   assert np.array_equal(x1,x0[:130])
+   assert np.array_equal(x2,x0) and np.array_equal(lnL2,lnL0) and np.array_equal(acc2,acc0)
+   # a finished scan is read back from its blocks
+   x3, lnL3, acc3 = ps.mcmc(space,like,8,250,fname=fname,checkpoint_every=50)
+   assert np.array_equal(x3,x0)
@@ -0,0 +1,148 @@
+""" Toy Monte Carlo sensitivity bands and coverage for counting-experiment limits
+
+    For every cell of an array of expected counts (e.g. operator x mass x
+    window, at unit coupling and the chosen exposure) pseudo-experiments are
+    drawn as n_obs ~ Poisson(c^2 * counts + b), with b the background in the
+    cell's window and c an injected signal coupling (0 for the background-only
+    sensitivity bands). Since the limits only depend on n_obs, each toy
+    chunk is reduced to a histogram of n_obs per cell; the histograms are
+    summed in an on-disk accumulator, so the result does not depend on the
+    order in which chunks finish, and an interrupted run carries on from the
+    chunks already recorded.
+
+    Chunk k always uses the random stream event_sampler.worker_rng(seed,k),
+    so the toys (and hence the result) depend only on the seed and the
+    number of chunks, not on how many processes ran them.
+
+    From the accumulated histograms:
+      bands    - median expected limit on c and its 1 and 2 sigma bands
+      coverage - fraction of toys whose limit lies above the injected coupling
+    with limits from poisson_limits (Feldman-Cousins or classical).
+"""
+
+import os
+import time
+import multiprocessing
+import numpy as np
+
+import poisson_limits as pl
+from event_sampler import worker_rng
+
+# Quantiles of the expected limit: -2, -1, 0, +1, +2 sigma
+sigmas    = np.array([-2,-1,0,1,2])
+quantiles = np.array([0.02275,0.15866,0.5,0.84134,0.97725])
+
+def default_nmax(mu):
+   # Largest n_obs given its own histogram bin (larger counts share one overflow bin)
+   mu = float(np.max(mu)) if np.size(mu) else 0.
+   return int(mu + 10*np.sqrt(mu) + 20)
+
+class ToyAccumulator(object):
+   """ Histograms of n_obs per cell, summed over finished chunks and kept on disk """
+
+   def __init__(self,fname,mu,nchunks,ntoys,seed,nmax=None):
+      # fname: accumulator file (.npz); resumed if it exists and was made with the same settings
+      # mu: array of expected n_obs per cell; nchunks, ntoys: number of chunks and toys per chunk
+      self.fname = fname
+      self.mu    = np.asarray(mu,dtype=float)
+      self.nchunks, self.ntoys, self.seed = int(nchunks), int(ntoys), int(seed)
+      self.nmax  = default_nmax(self.mu) if nmax is None else int(nmax)
+      if os.path.exists(fname):
+         d = np.load(fname)
+         if not (np.array_equal(d["mu"],self.mu) and int(d["nmax"])==self.nmax and
+                 int(d["ntoys"])==self.ntoys and int(d["seed"])==self.seed):
+            raise ValueError("Accumulator {0} was made with different settings! Delete it to start again.".format(fname))
+         done = d["done"]
+         self.done = np.zeros(self.nchunks,dtype=bool)
+         self.done[:min(len(done),self.nchunks)] = done[:self.nchunks]
+         self.hist = d["hist"]
+         if len(done) > self.nchunks and np.any(done[self.nchunks:]):
+            raise ValueError("Accumulator {0} holds more than {1} chunks! Delete it to start again.".format(fname,self.nchunks))
+      else:
+         self.done = np.zeros(self.nchunks,dtype=bool)
+         self.hist = np.zeros(self.mu.shape+(self.nmax+2,),dtype=np.int64) # last bin: n_obs > nmax
+
+   def add(self,chunk,hist):
+      if not self.done[chunk]:
+         self.hist += hist
+         self.done[chunk] = True
+
+   def save(self):
+      # Write under a temporary name first so that an interruption cannot corrupt the accumulator
+      part = self.fname+".part.npz"
+      np.savez(part,mu=self.mu,nmax=self.nmax,ntoys=self.ntoys,seed=self.seed,done=self.done,hist=self.hist)
+      os.rename(part,self.fname)
+
+   @property
+   def total(self):
+      return int(self.done.sum())*self.ntoys
+
+def toy_histogram(mu,ntoys,nmax,rng):
+   # Histogram (mu.shape + (nmax+2,)) of Poisson(mu) draws, ntoys per cell, in one vectorised pass
+   mu = np.asarray(mu,dtype=float)
+   n  = np.minimum(rng.poisson(np.broadcast_to(mu,(ntoys,)+mu.shape)),nmax+1)
+   cell = np.arange(mu.size).reshape(mu.shape)
+   return np.bincount((cell*(nmax+2) + n).ravel(),minlength=mu.size*(nmax+2)).reshape(mu.shape+(nmax+2,))
+
+def _chunk(args):
+   # Toys for one chunk, with the random stream fixed by (seed, chunk)
+   chunk, mu, ntoys, nmax, seed = args
+   start = time.time()
+   return chunk, toy_histogram(mu,ntoys,nmax,worker_rng(seed,chunk)), time.time()-start
+
+def run(fname,counts,b=0.,c=0.,nchunks=100,ntoys=1000,seed=1,nmax=None,processes=None,save_every=10):
+   # Accumulate nchunks x ntoys pseudo-experiments for every cell into 'fname', skipping chunks
+   # finished by previous runs, on 'processes' worker processes (default: all cores).
+   # counts: expected events per cell at unit coupling; b: background per cell; c: injected coupling
+   # (all broadcast against each other). Returns the ToyAccumulator.
+   mu  = np.broadcast_to(np.asarray(c,dtype=float)**2*np.asarray(counts,dtype=float) + np.asarray(b,dtype=float),
+                         np.broadcast(np.asarray(counts),np.asarray(b),np.asarray(c)).shape)
+   acc = ToyAccumulator(fname,mu,nchunks,ntoys,seed,nmax)
+   pending = [k for k in range(acc.nchunks) if not acc.done[k]]
+   print("{0} of {1} toy chunks already finished; running {2} on {3} processes".format(
+         acc.nchunks-len(pending),acc.nchunks,len(pending),processes or multiprocessing.cpu_count()))
+   if len(pending)==0:
+      return acc
+   pool = multiprocessing.Pool(processes)
+   try:
+      for n,(chunk,hist,seconds) in enumerate(pool.imap_unordered(_chunk,[(k,acc.mu,acc.ntoys,acc.nmax,acc.seed) for k in pending])):
+         acc.add(chunk,hist)
+         if (n+1) % save_every==0 or n+1==len(pending):
+            acc.save()
+            print("[{0}/{1}] {2} toys per cell accumulated ({3:.1f} s per chunk)".format(n+1,len(pending),acc.total,seconds))
+      pool.close()
+   except KeyboardInterrupt:
+      # Chunks saved so far are kept; the rest are rerun next time
+      acc.save()
+      pool.terminate()
+      raise
+   finally:
+      pool.join()
+   return acc
+
+def _limits_table(nmax,b,CL,method):
+   # Signal upper limits s_up(n) for n = 0..nmax (axis 0), for every background in b
+   b = np.asarray(b,dtype=float)
+   n = np.arange(nmax+1).reshape((-1,)+(1,)*b.ndim)
+   return pl.upper_limits(n,b,CL,method)
+
+def bands(acc,counts,b=0.,CL=0.9,method="FC"):
+   # Expected coupling limits at the -2,-1,0,+1,+2 sigma quantiles; shape (5,) + cell shape.
+   # (Limits grow with n_obs, so these are the limits for the quantiles of n_obs.) NaN where a
+   # quantile falls in the overflow bin (increase nmax).
+   cdf = np.cumsum(acc.hist,axis=-1)/float(acc.total)
+   nq  = np.array([np.argmax(cdf >= q,axis=-1) for q in quantiles]) # (5, cells)
+   b   = np.broadcast_to(np.asarray(b,dtype=float),acc.mu.shape)
+   s_up = pl.upper_limits(np.minimum(nq,acc.nmax),b,CL,method)
+   with np.errstate(divide="ignore"):
+      c = np.sqrt(s_up/np.asarray(counts,dtype=float))
+   return np.where(nq > acc.nmax,np.nan,c)
+
+def coverage(acc,counts,c,b=0.,CL=0.9,method="FC"):
+   # Fraction of toys (generated with injected coupling c) whose upper limit on c lies at or above c.
+   # Toys in the overflow bin count as covered (their limits are larger still).
+   b = np.broadcast_to(np.asarray(b,dtype=float),acc.mu.shape)
+   s_up = np.moveaxis(_limits_table(acc.nmax,b,CL,method),0,-1) # (cells, nmax+1)
+   s    = (np.asarray(c,dtype=float)**2*np.asarray(counts,dtype=float))[...,None]
+   covered = np.concatenate((s_up >= s*(1-1e-12),np.ones(s_up.shape[:-1]+(1,),dtype=bool)),axis=-1)
+   return np.sum(acc.hist*covered,axis=-1)/float(acc.total)